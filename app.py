@@ -3,9 +3,13 @@
 #----------------------------------------------------------------------------#
 
 import json
+import functools
+import hashlib
+import math
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify
+from datetime import timedelta
+from flask import Flask, Blueprint, render_template, request, Response, flash, redirect, url_for, jsonify, abort, session, stream_with_context
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
@@ -13,18 +17,73 @@ from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
+from sqlalchemy import event, orm
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from cache import MemoryBackend, PageCache, create_backend
+from db_pool import get_pool_options, pool_metrics
+from db_routing import RoutingSession, replica_router
+from profiling import query_profiler, template_profiler
+from templating import init_templating
+from assets import asset_versions, build_assets
+from importer import FORMATS, ErrorReport, batched, copy_rows, detect_format, read_rows, split_list
+from exporter import MIMETYPES, encode_rows, gzip_chunks
+from scheduling import Bookings, describe_conflict
+from jobs import job_queue
+from geo import (EARTH_RADIUS_KM, KM_PER_MILE, distance_km, encode_geohash, gazetteer,
+                 geohash_ranges, radius_boxes, split_box)
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date
+try:
+  import orjson
+except ImportError:
+  orjson = None
 import sys 
+import os
+import time
+import click
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
+class FyyurSQLAlchemy(SQLAlchemy):
+  # applies the DB_POOL_* settings from config.py when the engine is created
+  def apply_driver_hacks(self, app, sa_url, options):
+    result = super(FyyurSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+    options.update(get_pool_options(app.config, sa_url.drivername))
+    return result
+
+  # reports the pool of every engine, the primary's and each replica's
+  def get_engine(self, app=None, bind=None):
+    engine = super(FyyurSQLAlchemy, self).get_engine(app, bind)
+    pool_metrics.watch(engine, bind or 'primary')
+    return engine
+
+  # routes reads to the replicas, see db_routing.py
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 # connect to a local postgresql database
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = FyyurSQLAlchemy(app)
+replica_router.init_app(app, db)
+pool_metrics.init_app(app)
+query_profiler.init_app(app)
+template_profiler.init_app(app)
+asset_versions.init_app(app)
+gazetteer.init_app(app)
 migrate = Migrate(app, db)
+page_cache = PageCache(create_backend(app.config),
+                       bucket_seconds=app.config['PAGE_CACHE_NOW_BUCKET'])
+# fragments of the {% cache %} tag get a store of their own, so that many
+# small fragments cannot push the cached pages out of the page cache
+fragment_cache = MemoryBackend(maxsize=app.config['FRAGMENT_CACHE_SIZE'],
+                               ttl=app.config['PAGE_CACHE_TTL'])
+init_templating(app, fragment_cache, asset_versions.build_id)
 
 #----------------------------------------------------------------------------#
 # Models.
@@ -36,9 +95,26 @@ migrate = Migrate(app, db)
 # Models.
 #----------------------------------------------------------------------------#
 
+# genres are a postgres ARRAY; fall back to JSON so the models also work
+# against a local sqlite database (benchmarks, quick local runs). The
+# dialect's ARRAY brings the @> and && operators (see genre_condition).
+GenreList = postgresql.ARRAY(db.String()).with_variant(db.JSON(), 'sqlite')
+
 # Venue model
 class Venue(db.Model):
   __tablename__ = 'Venue'
+  __table_args__ = (
+    # trigram indexes serve the ILIKE/similarity search (see search_entities)
+    db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin',
+             postgresql_ops={'name': 'gin_trgm_ops'}),
+    db.Index('ix_Venue_city_trgm', 'city', postgresql_using='gin',
+             postgresql_ops={'city': 'gin_trgm_ops'}),
+    db.Index('ix_Venue_state', 'state'),
+    # genre filters and facets, see genre_condition
+    db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+    # "near" queries, see near_filter
+    db.Index('ix_Venue_geohash', 'geohash'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String(120), nullable=False)
@@ -48,10 +124,17 @@ class Venue(db.Model):
   phone = db.Column(db.String(120), nullable=False)
   image_link = db.Column(db.String(500))
   facebook_link = db.Column(db.String(120))
-  genres = db.Column("genres", db.ARRAY(db.String()), nullable=False)
+  genres = db.Column("genres", GenreList, nullable=False)
   website = db.Column(db.String(500))
   seeking_talent = db.Column(db.Boolean, default=True)
   seeking_description = db.Column(db.String(120))
+  # maintained by the show counter hooks, see update_show_counters
+  upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  # placed by city/state from the gazetteer, see geocode_venues
+  latitude = db.Column(db.Float)
+  longitude = db.Column(db.Float)
+  geohash = db.Column(db.BigInteger)
   shows = db.relationship('Show', backref='venue', lazy=True)
 
   def __repr__(self):
@@ -61,56 +144,713 @@ class Venue(db.Model):
 # Artist model
 class Artist(db.Model):
   __tablename__ = 'Artist'
+  __table_args__ = (
+    db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin',
+             postgresql_ops={'name': 'gin_trgm_ops'}),
+    db.Index('ix_Artist_city_trgm', 'city', postgresql_using='gin',
+             postgresql_ops={'city': 'gin_trgm_ops'}),
+    db.Index('ix_Artist_state', 'state'),
+    db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String(120), nullable=False)
   city = db.Column(db.String(120), nullable=False)
   state = db.Column(db.String(120), nullable=False)
   phone = db.Column(db.String(120))
-  genres = db.Column("genres", db.ARRAY(db.String()), nullable=False)
+  genres = db.Column("genres", GenreList, nullable=False)
   image_link = db.Column(db.String(500))
   facebook_link = db.Column(db.String(120))
   website = db.Column(db.String(500))
   seeking_venue = db.Column(db.Boolean, default=True)
   seeking_description = db.Column(db.String(120))
+  upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
   shows = db.relationship('Show', backref='artist', lazy=True)
 
   def __repr__(self):
       return f'<Artist {self.id} {self.name}>'
 
 
+def get_show_end_time(start_time, end_time=None):
+  # shows without an end time last SHOW_DEFAULT_MINUTES
+  return end_time or start_time + timedelta(minutes=app.config['SHOW_DEFAULT_MINUTES'])
+
+def default_end_time(context):
+  return get_show_end_time(context.get_current_parameters()['start_time'])
+
 # Show model
 class Show(db.Model):
   __tablename__ = 'Show'
-
+  __table_args__ = (
+    # detail pages: a venue's/artist's shows, split by start time
+    db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    # the /shows feed is ordered and paginated by (start_time, id)
+    db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+    # compact range index for time window scans over the whole table
+    db.Index('ix_Show_start_time_brin', 'start_time', postgresql_using='brin'),
+    # on postgres the migrations also add exclusion constraints against
+    # double bookings (ex_Show_venue_period, ex_Show_artist_period) and
+    # ck_Show_duration, see find_show_conflicts
+  )
+
+  # active_history: the show counters and the page cache invalidation need
+  # the old venue, artist and start time of a moved show, also when the
+  # attributes were expired by a commit before they were changed
   id = db.Column(db.Integer, primary_key=True)
-  artist_id = db.Column(db.Integer, db.ForeignKey(
-      'Artist.id'), nullable=False)
-  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
-  start_time = db.Column(db.DateTime, nullable=False,
-                        default=datetime.utcnow)
+  artist_id = orm.column_property(db.Column(db.Integer, db.ForeignKey(
+      'Artist.id'), nullable=False), active_history=True)
+  venue_id = orm.column_property(db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False),
+                                 active_history=True)
+  start_time = orm.column_property(db.Column(db.DateTime, nullable=False,
+                                             default=datetime.utcnow), active_history=True)
+  end_time = db.Column(db.DateTime, nullable=False, default=default_end_time)
 
   def __repr__(self):
     return f'<Show {self.id}, Artist {self.artist_id}, Venue {self.venue_id}>'
 
+
+# Show counter state, a single row holding the time up to which shows have
+# been rolled over from upcoming to past in the Venue/Artist counters
+class ShowCounterState(db.Model):
+  __tablename__ = 'ShowCounterState'
+
+  id = db.Column(db.Integer, primary_key=True)
+  rolled_over_at = db.Column(db.DateTime, nullable=False)
+
+  def __repr__(self):
+    return f'<ShowCounterState {self.rolled_over_at}>'
+
+
+# Import checkpoint, the number of rows of an import source already loaded
+class ImportCheckpoint(db.Model):
+  __tablename__ = 'ImportCheckpoint'
+
+  name = db.Column(db.String(500), primary_key=True)
+  rows_done = db.Column(db.Integer, nullable=False, default=0)
+  updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+  def __repr__(self):
+    return f'<ImportCheckpoint {self.name} {self.rows_done}>'
+
+
+# Table watermark, bumped in every transaction that writes to the table; the
+# versions make up the ETags and Last-Modified dates of the API responses
+class TableWatermark(db.Model):
+  __tablename__ = 'TableWatermark'
+
+  table_name = db.Column(db.String(120), primary_key=True)
+  version = db.Column(db.Integer, nullable=False, default=0)
+  # utc, for Last-Modified
+  modified_at = db.Column(db.DateTime, nullable=False)
+
+  def __repr__(self):
+    return f'<TableWatermark {self.table_name} {self.version}>'
+
+
+# Background job, queued in the transaction of the write it follows up on
+# and run once that commits, see jobs.py
+class Job(db.Model):
+  __tablename__ = 'Job'
+  __table_args__ = (
+    db.Index('ix_Job_status_run_at', 'status', 'run_at'),
+  )
+
+  id = db.Column(db.Integer, primary_key=True)
+  name = db.Column(db.String(120), nullable=False)
+  payload = db.Column(db.JSON, nullable=False, default=dict)
+  # queued, running, done or failed
+  status = db.Column(db.String(20), nullable=False, default='queued')
+  attempts = db.Column(db.Integer, nullable=False, default=0)
+  # utc; due from run_at, a running job is taken over after locked_until
+  run_at = db.Column(db.DateTime, nullable=False)
+  locked_until = db.Column(db.DateTime)
+  last_error = db.Column(db.Text)
+  created_at = db.Column(db.DateTime, nullable=False)
+  finished_at = db.Column(db.DateTime)
+
+  def __repr__(self):
+    return f'<Job {self.id} {self.name} {self.status}>'
+
+
+# Idempotency key of a write API request, with the response that is replayed
+# when the request is retried under the same key
+class IdempotencyKey(db.Model):
+  __tablename__ = 'IdempotencyKey'
+
+  key = db.Column(db.String(255), primary_key=True)
+  # sha256 of the request body, a key only ever stands for one request
+  request_hash = db.Column(db.String(64), nullable=False)
+  status_code = db.Column(db.Integer, nullable=False)
+  response = db.Column(db.JSON, nullable=False)
+  # utc
+  created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+  def __repr__(self):
+    return f'<IdempotencyKey {self.key} {self.status_code}>'
+
+#----------------------------------------------------------------------------#
+# Cache invalidation.
+#----------------------------------------------------------------------------#
+
+# cached pages: 'venues' (the area listing), 'artists', 'shows:<when>:<cursor>' (the
+# show feed), 'venue:<id>' and 'artist:<id>' (the detail pages). Venue pages
+# list the artists of their shows and artist pages list the venues, so a
+# change to either side invalidates the pages on the other side too.
+# 'browse:venues:<filters>' and 'browse:artists:<filters>' are the genre
+# browsing pages, which also show the numbers of upcoming shows.
+# 'calendar:<scope>:<view>:<date>' are the calendar pages, listing shows with
+# their venue and artist names.
+
+def get_counterpart_keys(session, obj):
+  if isinstance(obj, Venue):
+    rows = session.query(Show.artist_id).filter_by(venue_id=obj.id).distinct()
+    return ['artist:%d' % artist_id for artist_id, in rows]
+  rows = session.query(Show.venue_id).filter_by(artist_id=obj.id).distinct()
+  return ['venue:%d' % venue_id for venue_id, in rows]
+
+def get_show_keys(show):
+  # the show's current venue/artist and, if it was moved, the previous ones
+  keys = set()
+  for attr, kind in (('venue_id', 'venue'), ('artist_id', 'artist')):
+    history = db.inspect(show).attrs[attr].history
+    for value in history.sum() or [getattr(show, attr)]:
+      if value is not None:
+        keys.add('%s:%d' % (kind, int(value)))
+  return keys
+
+@event.listens_for(db.session, 'after_flush')
+def collect_page_cache_keys(session, flush_context):
+  keys = session.info.setdefault('page_cache_keys', set())
+  prefixes = session.info.setdefault('page_cache_prefixes', set())
+  for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+    if isinstance(obj, Venue):
+      keys.add('venues')
+      keys.add('venue:%d' % obj.id)
+      prefixes.add('browse:venues:')
+      if obj not in session.new:
+        keys.update(get_counterpart_keys(session, obj))
+        prefixes.add('shows:')
+        prefixes.add('calendar:')
+    elif isinstance(obj, Artist):
+      keys.add('artists')
+      keys.add('artist:%d' % obj.id)
+      prefixes.add('browse:artists:')
+      if obj not in session.new:
+        keys.update(get_counterpart_keys(session, obj))
+        prefixes.add('shows:')
+        prefixes.add('calendar:')
+    elif isinstance(obj, Show):
+      keys.add('venues')
+      keys.update(get_show_keys(obj))
+      prefixes.add('shows:')
+      prefixes.add('browse:venues:')
+      prefixes.add('browse:artists:')
+      prefixes.add('calendar:')
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_page_cache(session):
+  # the backend may be shared, so this invalidates every worker
+  for key in session.info.pop('page_cache_keys', ()):
+    page_cache.invalidate(key)
+  for prefix in session.info.pop('page_cache_prefixes', ()):
+    page_cache.invalidate_prefix(prefix)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_page_cache_keys(session, previous_transaction):
+  session.info.pop('page_cache_keys', None)
+  session.info.pop('page_cache_prefixes', None)
+
+#----------------------------------------------------------------------------#
+# Table watermarks.
+#----------------------------------------------------------------------------#
+
+# every transaction writing to Venue, Artist or Show bumps the version of the
+# table once, in the same transaction, so a version seen by a reader always
+# matches the data it can read. Show changes also move the Venue/Artist show
+# counters and the venue/artist names show up next to shows, so they bump all
+# three tables.
+
+WATERMARK_TABLES = {
+  'Venue': ('Venue',),
+  'Artist': ('Artist',),
+  'Show': ('Show', 'Venue', 'Artist'),
+}
+
+def touch_tables(session, tables):
+  touched = session.info.setdefault('touched_tables', set())
+  now = datetime.utcnow()
+  for table in sorted(set(tables) - touched):
+    watermark = TableWatermark.__table__
+    result = session.execute(watermark.update()
+                             .where(watermark.c.table_name == table)
+                             .values(version=watermark.c.version + 1, modified_at=now))
+    if not result.rowcount:
+      session.execute(watermark.insert().values(table_name=table, version=1, modified_at=now))
+    touched.add(table)
+
+@event.listens_for(db.session, 'after_flush')
+def update_table_watermarks(session, flush_context):
+  tables = set()
+  for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+    if obj in session.dirty and not session.is_modified(obj):
+      continue
+    tables.update(WATERMARK_TABLES.get(getattr(obj, '__tablename__', None), ()))
+  if tables:
+    touch_tables(session, tables)
+
+@event.listens_for(db.session, 'after_commit')
+@event.listens_for(db.session, 'after_soft_rollback')
+def reset_touched_tables(session, *args):
+  session.info.pop('touched_tables', None)
+
+def table_watermarks_query(tables):
+  return db.session.query(TableWatermark.table_name, TableWatermark.version,
+                          TableWatermark.modified_at) \
+    .filter(TableWatermark.table_name.in_(tables))
+
+def table_watermarks_data(rows, tables):
+  # (versions in table order, latest modification time or None)
+  rows = dict((row.table_name, row) for row in rows)
+  versions = [rows[table].version if table in rows else 0 for table in tables]
+  modified = [row.modified_at for row in rows.values()]
+  return versions, max(modified) if modified else None
+
+def get_table_watermarks(tables):
+  return table_watermarks_data(table_watermarks_query(tables), tables)
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+# Venue/Artist.upcoming_shows_count and past_shows_count count the shows
+# starting after/before ShowCounterState.rolled_over_at. Inserts, moves and
+# deletes of shows adjust them on flush, roll_over_show_counters() moves the
+# shows that started since the last roll-over from upcoming to past. It runs
+# every SHOW_COUNTER_ROLLOVER_SECONDS on the job workers (see Jobs below)
+# or from cron with `flask roll-over-shows`, never in a read request.
+
+SHOW_OWNERS = (('venue_id', Venue), ('artist_id', Artist))
+
+def get_show_values(show, attr, old):
+  # current or pre-flush value of a show attribute
+  history = db.inspect(show).attrs[attr].history
+  if old:
+    values = history.deleted or history.unchanged
+  else:
+    values = history.added or history.unchanged
+  return values[0] if values else getattr(show, attr)
+
+def apply_show_counter_changes(session, changes):
+  # changes: (venue_id, artist_id, start_time, +1 for added or -1 for removed)
+  if not changes:
+    return
+
+  state = session.query(ShowCounterState).first()
+  if state is None:
+    # counters have not been initialised yet, see recount_show_counters()
+    return
+
+  deltas = {}
+  for venue_id, artist_id, start_time, sign in changes:
+    column = 'upcoming_shows_count' if start_time > state.rolled_over_at else 'past_shows_count'
+    for model, owner_id in ((Venue, venue_id), (Artist, artist_id)):
+      key = (model, int(owner_id), column)
+      deltas[key] = deltas.get(key, 0) + sign
+
+  # one executemany per counter column, batches touch many owners
+  updates = {}
+  for (model, owner_id, column), delta in deltas.items():
+    if delta:
+      updates.setdefault((model, column), []).append({'owner_id': owner_id, 'delta': delta})
+  for (model, column), params in updates.items():
+    session.execute(model.__table__.update()
+                    .where(model.id == db.bindparam('owner_id'))
+                    .values({column: getattr(model, column) + db.bindparam('delta')}),
+                    params)
+
+@event.listens_for(db.session, 'after_flush')
+def update_show_counters(session, flush_context):
+  changes = []
+  for show in session.new:
+    if isinstance(show, Show):
+      changes.append((show, False, 1))
+  for show in session.deleted:
+    if isinstance(show, Show):
+      changes.append((show, True, -1))
+  for show in session.dirty:
+    if isinstance(show, Show) and session.is_modified(show):
+      changes.append((show, True, -1))
+      changes.append((show, False, 1))
+
+  apply_show_counter_changes(session, [(
+    get_show_values(show, 'venue_id', old),
+    get_show_values(show, 'artist_id', old),
+    get_show_values(show, 'start_time', old),
+    sign
+  ) for show, old, sign in changes])
+
+def recount_show_counters(now=None):
+  # recomputes every counter from the Show table and resets the roll-over
+  # time, used to initialise the counters and to repair them
+  now = now or datetime.now()
+  for attr, model in SHOW_OWNERS:
+    owner = getattr(Show, attr)
+    upcoming = db.session.query(db.func.count(Show.id)) \
+      .filter(owner == model.id, Show.start_time > now).as_scalar()
+    past = db.session.query(db.func.count(Show.id)) \
+      .filter(owner == model.id, Show.start_time <= now).as_scalar()
+    db.session.execute(model.__table__.update().values(
+      upcoming_shows_count=upcoming, past_shows_count=past))
+
+  state = ShowCounterState.query.first() or ShowCounterState()
+  state.rolled_over_at = now
+  db.session.add(state)
+  touch_tables(db.session, ('Venue', 'Artist'))
+  db.session.info.setdefault('page_cache_keys', set()).add('venues')
+  db.session.commit()
+
+def roll_over_show_counters(now=None):
+  # moves shows that started since the last roll-over from the upcoming to
+  # the past counters, returns the number of shows moved
+  now = now or datetime.now()
+  state = ShowCounterState.query.with_for_update().first()
+  if state is None:
+    recount_show_counters(now)
+    return 0
+  if now <= state.rolled_over_at:
+    db.session.rollback()
+    return 0
+
+  for attr, model in SHOW_OWNERS:
+    owner = getattr(Show, attr)
+    rows = db.session.query(owner, db.func.count(Show.id)) \
+      .filter(Show.start_time > state.rolled_over_at, Show.start_time <= now) \
+      .group_by(owner) \
+      .all()
+    if rows:
+      db.session.execute(model.__table__.update()
+                         .where(model.id == db.bindparam('owner_id'))
+                         .values(upcoming_shows_count=model.upcoming_shows_count - db.bindparam('num_shows'),
+                                 past_shows_count=model.past_shows_count + db.bindparam('num_shows')),
+                         [{'owner_id': owner_id, 'num_shows': num_shows} for owner_id, num_shows in rows])
+    # every show has one venue and one artist, so both loops count the same
+    moved = sum(num_shows for _, num_shows in rows)
+
+  state.rolled_over_at = now
+  if moved:
+    db.session.info.setdefault('page_cache_keys', set()).add('venues')
+    touch_tables(db.session, ('Venue', 'Artist'))
+  db.session.commit()
+  return moved
+
+def check_show_counters():
+  # compares the counters with the Show table, returns the mismatching
+  # (table, id, stored upcoming, stored past, actual upcoming, actual past)
+  state = ShowCounterState.query.first()
+  if state is None:
+    return []
+  mismatches = []
+  for attr, model in SHOW_OWNERS:
+    owner = getattr(Show, attr)
+    upcoming = db.func.count(Show.id).filter(Show.start_time > state.rolled_over_at)
+    past = db.func.count(Show.id).filter(Show.start_time <= state.rolled_over_at)
+    rows = db.session.query(
+        model.id,
+        model.upcoming_shows_count,
+        model.past_shows_count,
+        upcoming,
+        past
+      ).outerjoin(Show, owner == model.id) \
+      .group_by(model.id) \
+      .all()
+    for row in rows:
+      if row[1] != row[3] or row[2] != row[4]:
+        mismatches.append((model.__tablename__,) + tuple(row))
+  return mismatches
+
+#----------------------------------------------------------------------------#
+# Locality.
+#----------------------------------------------------------------------------#
+
+# venues carry the coordinates of their city (or state) from the gazetteer
+# and the matching geohash, set whenever their city or state change. Radius
+# and box queries select the geohash ranges of the grid cells covering the
+# search box (ix_Venue_geohash), then test the exact box and an
+# equirectangular distance, close to the great circle distance at the radii
+# allowed. With GEO_INDEX = 'postgis' they use ST_DWithin and && on the GiST
+# index over venue_point() instead.
+
+def venue_location(city, state):
+  # the location columns of a venue in city/state, None when unknown
+  place = gazetteer.lookup(city, state)
+  if place is None:
+    return {"latitude": None, "longitude": None, "geohash": None}
+  return {"latitude": place[0], "longitude": place[1], "geohash": encode_geohash(*place)}
+
+@event.listens_for(db.session, 'before_flush')
+def geocode_venues(session, flush_context, instances):
+  for obj in list(session.new) + list(session.dirty):
+    if not isinstance(obj, Venue):
+      continue
+    attrs = db.inspect(obj).attrs
+    if obj in session.new or attrs.city.history.has_changes() or attrs.state.history.has_changes():
+      for key, value in venue_location(obj.city, obj.state).items():
+        setattr(obj, key, value)
+
+def venue_point():
+  # the expression of the ix_Venue_location_gist index
+  return db.func.geography(db.func.ST_SetSRID(
+    db.func.ST_MakePoint(Venue.longitude, Venue.latitude), 4326))
+
+def box_condition(south, west, north, east):
+  cells = geohash_ranges(south, west, north, east, app.config['GEO_MAX_CELLS'])
+  return db.and_(db.or_(*[Venue.geohash.between(low, high) for low, high in cells]),
+                 Venue.latitude.between(south, north),
+                 Venue.longitude.between(west, east))
+
+def near_filter(latitude, longitude, radius_km):
+  # (condition, ordering) of the venues within radius_km, nearest first
+  if app.config['GEO_INDEX'] == 'postgis':
+    origin = db.func.geography(db.func.ST_SetSRID(db.func.ST_MakePoint(longitude, latitude), 4326))
+    return (db.func.ST_DWithin(venue_point(), origin, radius_km * 1000),
+            db.func.ST_Distance(venue_point(), origin))
+
+  # degrees of latitude, with longitude scaled to the same length
+  scale = math.cos(math.radians(latitude))
+  limit = math.degrees(radius_km / EARTH_RADIUS_KM) ** 2
+  conditions = []
+  distances = []
+  for south, west, north, east, shift in radius_boxes(latitude, longitude, radius_km):
+    dx = (Venue.longitude + shift - longitude) * scale
+    dy = Venue.latitude - latitude
+    distances.append((box_condition(south, west, north, east), dx * dx + dy * dy))
+    conditions.append(db.and_(distances[-1][0], distances[-1][1] <= limit))
+  if len(distances) == 1:
+    return conditions[0], distances[0][1]
+  return db.or_(*conditions), db.case(*distances[:-1], else_=distances[-1][1])
+
+def within_filter(south, west, north, east):
+  # (condition, ordering) of the venues inside the box, west > east for
+  # boxes crossing the antimeridian
+  conditions = []
+  for south, west, north, east, shift in split_box(south, west, north, east):
+    if app.config['GEO_INDEX'] == 'postgis':
+      conditions.append(venue_point().op('&&')(db.func.geography(
+        db.func.ST_MakeEnvelope(west, south, east, north, 4326))))
+    else:
+      conditions.append(box_condition(south, west, north, east))
+  return db.or_(*conditions), Venue.id
+
+def venues_near_query(condition, ordering, limit):
+  return db.session.query(
+      Venue.id,
+      Venue.name,
+      Venue.city,
+      Venue.state,
+      Venue.latitude,
+      Venue.longitude,
+      Venue.upcoming_shows_count
+    ).filter(condition) \
+    .order_by(ordering, Venue.id) \
+    .limit(limit)
+
+def shows_near_query(condition, start, end, limit):
+  # upcoming shows at the venues matching condition, soonest first
+  query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Venue.id.label('venue_id'),
+      Venue.name.label('venue_name'),
+      Venue.latitude,
+      Venue.longitude,
+      Artist.id.label('artist_id'),
+      Artist.name.label('artist_name')
+    ).join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .filter(condition, Show.start_time >= start)
+  if end is not None:
+    query = query.filter(Show.start_time < end)
+  return query.order_by(Show.start_time, Show.id).limit(limit)
+
+def get_distance(row, origin, unit):
+  if origin is None or row.latitude is None:
+    return None
+  distance = distance_km(origin[0], origin[1], row.latitude, row.longitude)
+  return round(distance / KM_PER_MILE if unit == 'mi' else distance, 2)
+
+#----------------------------------------------------------------------------#
+# Jobs.
+#----------------------------------------------------------------------------#
+
+# the write handlers queue their follow-up work as jobs (see jobs.py). A job
+# may run twice when its worker dies before the job is marked done, so tasks
+# must not mind being repeated.
+
+job_queue.init_app(app, db, Job)
+job_queue.every('SHOW_COUNTER_ROLLOVER_SECONDS')(roll_over_show_counters)
+
+@job_queue.task('warm_pages')
+def warm_pages(paths):
+  # renders the pages into the page cache ahead of the next visitor
+  for path in paths:
+    with app.test_request_context(path):
+      app.full_dispatch_request()
+
+def queue_page_warming(paths):
+  # queues warm_pages in the current transaction. Only a shared cache
+  # backend lets the next visitor see what a worker rendered; with a
+  # per-process one the job would be a wasted render and a Job row.
+  if page_cache.backend.shared:
+    job_queue.enqueue('warm_pages', paths=paths)
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+# the app's own names for the two patterns the templates use
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+@functools.lru_cache(maxsize=64)
+def get_datetime_pattern(format, locale):
+  # parsed Babel pattern and locale, or None for Babel's own named formats
+  # ('short', 'long'), which format_datetime resolves per locale
+  format = DATETIME_FORMATS.get(format, format)
+  if format in ('short', 'long'):
+    return None
+  return babel.dates.parse_pattern(format), babel.Locale.parse(locale)
+
+def to_datetime(value):
+  # shows pass native datetimes, strings are still accepted
+  if isinstance(value, datetime):
+    return value
+  return dateutil.parser.parse(value)
+
+def format_datetime(value, format='medium', locale=None):
+  pattern = get_datetime_pattern(format, locale or babel.dates.LC_TIME)
+  if pattern is None:
+    return babel.dates.format_datetime(to_datetime(value), format, locale=locale or babel.dates.LC_TIME)
+  return pattern[0].apply(to_datetime(value), pattern[1])
+
+def format_datetimes(values, format='medium', locale=None):
+  # formats a whole list with one pattern lookup, equal values (shows
+  # starting at the same time) are formatted once
+  pattern = get_datetime_pattern(format, locale or babel.dates.LC_TIME)
+  if pattern is None:
+    return [format_datetime(value, format, locale) for value in values]
+  apply, locale = pattern[0].apply, pattern[1]
+  formatted = {}
+  result = []
+  for value in values:
+    text = formatted.get(value)
+    if text is None:
+      text = formatted[value] = apply(to_datetime(value), locale)
+    result.append(text)
+  return result
 
 app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.filters['datetimes'] = format_datetimes
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
+def get_validators(tables, *parts):
+  # (ETag, Last-Modified) of a response built from the given tables. The
+  # ETag covers the table versions, the deployed templates/assets and parts
+  # identifying the response, so it is known before anything is loaded.
+  versions, modified_at = get_table_watermarks(tables)
+  return make_etag(versions, *parts), modified_at
+
+def make_etag(versions, *parts):
+  return hashlib.sha1(repr((versions, asset_versions.build_id) + parts).encode('utf-8')).hexdigest()
+
+def is_not_modified(tag, modified_at):
+  if request.if_none_match:
+    return request.if_none_match.contains(tag)
+  since = request.if_modified_since
+  return (modified_at is not None and since is not None and
+          modified_at.replace(microsecond=0) <= since.replace(tzinfo=None))
+
+def conditional_response(tables, parts, build, mimetype='text/html', modified_at=None):
+  # answers with 304 when the client's copy is current, otherwise with the
+  # body from build(). modified_at is a lower bound for Last-Modified, for
+  # responses that also change with time.
+  tag, last_modified = get_validators(tables, *parts)
+  response = start_conditional_response(tag, last_modified, mimetype, modified_at)
+  if response.status_code != 304:
+    response.set_data(build())
+  return response
+
+def start_conditional_response(tag, last_modified, mimetype='text/html', modified_at=None):
+  # an empty response carrying the validators, already a 304 when the
+  # client's copy is current
+  if modified_at is not None and (last_modified is None or modified_at > last_modified):
+    last_modified = modified_at
+
+  response = Response(mimetype=mimetype)
+  response.set_etag(tag)
+  response.cache_control.no_cache = True
+  if last_modified is not None:
+    response.headers['Last-Modified'] = http_date(last_modified)
+  if is_not_modified(tag, last_modified):
+    response.status_code = 304
+  return response
+
+def render_cached_page(key, template, load, tables, now_dependent=False):
+  # serves pages from the page cache: load() builds the template context on
+  # a miss and the rendered HTML is reused unless there are flash messages
+  # to show on top of it. Pages carry validators from the watermarks of the
+  # tables they are built from, so revalidations are answered with 304
+  # before the cache or the database is looked at. Pages that filter on
+  # "now" (now_dependent) also carry the "now" bucket; the others change
+  # with time only through the counter roll-over, which touches their tables.
+  versions, last_modified = get_table_watermarks(tables)
+  if session.get('_flashes'):
+    entry = get_page_entry(key, versions, load)
+    return render_template(template, **entry['context'])
+
+  response = start_page_response(key, versions, last_modified, now_dependent)
+  if response.status_code != 304:
+    response.set_data(render_page_entry(key, template, get_page_entry(key, versions, load)))
+  return response
+
+def start_page_response(key, versions, last_modified, now_dependent):
+  if not now_dependent:
+    return start_conditional_response(make_etag(versions, key), last_modified)
+  bucket = page_cache.now_bucket()
+  return start_conditional_response(make_etag(versions, key, bucket), last_modified,
+                                    modified_at=get_bucket_start(bucket))
+
+def get_page_entry(key, versions, load):
+  # entries remember the table versions they were built from. One built
+  # from older data (a lagging replica, or a fill racing a write) is rebuilt
+  # once the versions read with the request have moved on.
+  entry = page_cache.get(key)
+  if entry is None or entry.get('versions') != versions:
+    entry = {'context': load(), 'html': None, 'versions': versions}
+    page_cache.set(key, entry)
+  return entry
+
+def get_bucket_start(bucket):
+  return datetime.utcfromtimestamp(bucket * page_cache.bucket_seconds)
+
+def render_page_entry(key, template, entry):
+  # HTML of a page cache entry. HTML rendered by an earlier deploy may link
+  # assets that have changed, so it is rendered again.
+  if entry['html'] is None or entry.get('build_id') != asset_versions.build_id:
+    html = render_template(template, **entry['context'])
+    if not app.config['PAGE_CACHE_HTML']:
+      return html
+    entry['html'] = html
+    entry['build_id'] = asset_versions.build_id
+    page_cache.set(key, entry)
+  return entry['html']
+
 @app.route('/')
 def index():
   return render_template('pages/home.html')
@@ -119,110 +859,261 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
-def venues():
-  # list for storing venue data
-  data = []
-
-  # get all the venues and create a set from the cities
-  venues = Venue.query.all()
-  print(venues)
-  venue_cities = set()
-  for venue in venues:
-      # add city/state tuples
-      venue_cities.add((venue.city, venue.state))
-
-  # for each unique city/state, add venues
-  for location in venue_cities:
-      data.append({
-          "city": location[0],
-          "state": location[1],
-          "venues": []
+def venue_areas_query():
+  # every venue with its stored number of upcoming shows in one query,
+  # ordered so that venues of the same city/state are adjacent
+  return db.session.query(
+      Venue.city,
+      Venue.state,
+      Venue.id,
+      Venue.name,
+      Venue.upcoming_shows_count
+    ).order_by(Venue.state, Venue.city, Venue.id)
+
+def get_venue_areas():
+  return venue_areas_data(venue_areas_query().all())
+
+def venue_areas_data(rows):
+  # group the rows into city/state areas in a single pass
+  areas = []
+  for city, state, venue_id, name, num_upcoming in rows:
+    if not areas or areas[-1]['city'] != city or areas[-1]['state'] != state:
+      areas.append({
+        "city": city,
+        "state": state,
+        "venues": []
       })
+    areas[-1]['venues'].append({
+      "id": venue_id,
+      "name": name,
+      "num_upcoming_shows": num_upcoming
+    })
 
-  # get number of upcoming shows for each venue
-  for venue in venues:
-      num_upcoming_shows = 0
-
-      shows = Show.query.filter_by(venue_id=venue.id).all()
-
-      # if the show start time is after now, add to upcoming
-      for show in shows:
-          if show.start_time > datetime.now():
-              num_upcoming_shows += 1
+  return areas
 
-      # for each entry, add venues to matching city/state
-      for entry in data:
-          if venue.city == entry['city'] and venue.state == entry['state']:
-              entry['venues'].append({
-                  "id": venue.id,
-                  "name": venue.name,
-                  "num_upcoming_shows": num_upcoming_shows
-              })
+@app.route('/venues')
+def venues():
+  # return venues page grouped by city/state
+  return render_cached_page('venues', 'pages/venues.html',
+                            lambda: {'areas': get_venue_areas()}, ('Venue',))
+
+def escape_like(term):
+  # make % and _ in user input match literally
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def genre_condition(model, genres, match='all'):
+  # venues/artists listing all (or, with match='any', some) of the genres:
+  # the @> and && array operators, served by the GIN indexes on genres
+  if db.engine.dialect.name == 'postgresql':
+    if match == 'any':
+      return model.genres.overlap(genres)
+    return model.genres.contains(genres)
+  # sqlite fallback: count the matching elements of the JSON list
+  values = db.func.json_each(model.genres).table_valued('value')
+  matched = db.select(db.func.count(db.distinct(values.c.value))) \
+    .where(values.c.value.in_(genres)).scalar_subquery()
+  return matched > 0 if match == 'any' else matched == len(set(genres))
+
+def genre_rows(source):
+  # a subquery with one row per genre of each row of source, unnest() on
+  # postgres and json_each() on sqlite
+  if db.engine.dialect.name == 'postgresql':
+    return db.select(db.func.unnest(source.c.genres).label('genre')).subquery()
+  values = db.func.json_each(source.c.genres).table_valued('value')
+  return db.select(values.c.value.label('genre')) \
+    .select_from(source.join(values, db.true())).subquery()
+
+def search_queries(model, search_term, page, per_page, genres=(), match='all'):
+  # (page query, count query) for a venue or artist search by partial name,
+  # or by "city, state" when the term contains a comma, optionally narrowed
+  # to genres. Results are ranked and paged, and carry their stored number
+  # of upcoming shows.
+  search_term = search_term.strip()
+
+  if ',' in search_term:
+    city, state = [part.strip() for part in search_term.split(',', 1)]
+    condition = db.and_(model.city.ilike(escape_like(city), escape='\\'),
+                        model.state.ilike(escape_like(state), escape='\\'))
+    ordering = [model.name]
+  else:
+    condition = model.name.ilike('%' + escape_like(search_term) + '%', escape='\\')
+    if db.engine.dialect.name == 'postgresql':
+      # the gin_trgm_ops indexes serve the ILIKE filter; the pg_trgm
+      # distance only ranks the matching rows, sorted after the filter (GIN
+      # cannot return rows in <-> order)
+      ordering = [model.name.op('<->')(search_term), model.name]
+    else:
+      # sqlite fallback: earlier matches rank higher
+      ordering = [db.func.instr(db.func.lower(model.name), search_term.lower()), model.name]
+  if genres:
+    condition = db.and_(condition, genre_condition(model, genres, match))
+
+  rows = db.session.query(
+      model.id,
+      model.name,
+      model.upcoming_shows_count
+    ).filter(condition) \
+    .order_by(*ordering) \
+    .limit(per_page) \
+    .offset((page - 1) * per_page)
+  count = db.session.query(db.func.count(model.id)).filter(condition)
+  return rows, count
+
+def search_entities(model, search_term, page=1, per_page=None, genres=(), match='all'):
+  per_page = per_page or app.config['SEARCH_RESULTS_PER_PAGE']
+  rows, count = search_queries(model, search_term, page, per_page, genres, match)
+  return search_results_data(rows.all(), count.scalar(), page, per_page)
+
+def search_results_data(rows, count, page, per_page):
+  return {
+    "count": count,
+    "page": page,
+    "per_page": per_page,
+    "data": [{
+      "id": row.id,
+      "name": row.name,
+      "num_upcoming_shows": row.upcoming_shows_count,
+    } for row in rows]
+  }
 
-  # return venues page with data
-  return render_template('pages/venues.html', areas=data)
+def get_search_page():
+  try:
+    return max(1, int(request.form.get('page', 1)))
+  except ValueError:
+    abort(400)
+
+def get_genre_filter(values):
+  # (genres, match) of a search or browse request
+  genres = sorted(set(split_list(values.getlist('genres'))))
+  match = values.get('match', 'all')
+  if match not in ('all', 'any'):
+    abort(400)
+  return genres, match
+
+def browse_query(model, genres=(), match='all', city=None, state=None, page=1, per_page=None):
+  # one page of the venues/artists filtered by genres and city/state, their
+  # total and the facet counts per genre and per city/state of the filtered
+  # set, as a single UNION ALL statement, so one round trip. Rows are
+  # (kind, id, name, city, state, count) with kind 'row', 'total', 'genre'
+  # (the genre in name) or 'area'.
+  conditions = []
+  if genres:
+    conditions.append(genre_condition(model, genres, match))
+  if city is not None:
+    conditions.append(model.city == city)
+  if state is not None:
+    conditions.append(model.state == state)
+  matches = db.select(model.id, model.name, model.city, model.state, model.genres,
+                      model.upcoming_shows_count).where(*conditions).cte('matches')
+
+  no_id = db.cast(db.null(), db.Integer)
+  no_text = db.cast(db.null(), db.String)
+  page_rows = db.select(matches.c.id, matches.c.name, matches.c.city, matches.c.state,
+                        matches.c.upcoming_shows_count) \
+    .order_by(matches.c.name, matches.c.id) \
+    .limit(per_page).offset((page - 1) * per_page).subquery()
+  tagged = genre_rows(matches)
+  return db.union_all(
+    db.select(db.literal('row').label('kind'), page_rows.c.id, page_rows.c.name, page_rows.c.city,
+              page_rows.c.state, page_rows.c.upcoming_shows_count.label('count')),
+    db.select(db.literal('total'), no_id, no_text, no_text, no_text, db.func.count()) \
+      .select_from(matches),
+    db.select(db.literal('genre'), no_id, tagged.c.genre, no_text, no_text, db.func.count()) \
+      .group_by(tagged.c.genre),
+    db.select(db.literal('area'), no_id, no_text, matches.c.city, matches.c.state, db.func.count()) \
+      .group_by(matches.c.city, matches.c.state),
+  ).order_by('kind', 'name', 'id', 'state', 'city')
+
+def browse_data(rows, page, per_page):
+  results = {
+    "count": 0,
+    "page": page,
+    "per_page": per_page,
+    "data": [],
+    "genres": [],
+    "areas": [],
+  }
+  for kind, item_id, name, city, state, count in rows:
+    if kind == 'row':
+      results['data'].append({"id": item_id, "name": name, "city": city, "state": state,
+                              "num_upcoming_shows": count})
+    elif kind == 'total':
+      results['count'] = count
+    elif kind == 'genre':
+      results['genres'].append({"genre": name, "count": count})
+    else:
+      results['areas'].append({"city": city, "state": state, "count": count})
+  return results
+
+def browse_entities(resource, model, tables):
+  # genre-faceted browsing: ?genres=Jazz&genres=Folk&match=any&city=..&state=..&page=..
+  genres, match = get_genre_filter(request.args)
+  city = request.args.get('city') or None
+  state = request.args.get('state') or None
+  try:
+    page = max(1, int(request.args.get('page', 1)))
+  except ValueError:
+    abort(400)
+  per_page = app.config['SEARCH_RESULTS_PER_PAGE']
+
+  def load():
+    statement = browse_query(model, genres, match, city, state, page, per_page)
+    return {
+      'resource': resource,
+      'results': browse_data(db.session.execute(statement).all(), page, per_page),
+      'filters': {'genres': genres, 'match': match, 'city': city, 'state': state},
+    }
+
+  key = 'browse:%s:%s' % (resource, json.dumps([genres, match, city, state, page]))
+  return render_cached_page(key, 'pages/browse.html', load, tables)
+
+@app.route('/venues/browse')
+def browse_venues():
+  return browse_entities('venues', Venue, ('Venue',))
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  # search on artists with partial string search. It is case-insensitive.
+  # search on venues with partial string search. It is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-
+  # search for "San Francisco, CA" returns the venues in that city
   search_term = request.form.get('search_term', '')
-
-  venues = Venue.query.filter(Venue.name.ilike('%' + search_term + '%')).all()
-
-  venue_data = []
-
-  for venue in venues:
-    venue_data.append({
-      "id": venue.id,
-      "name": venue.name,
-      "num_upcoming_shows": 0, # does not have any functionality here, but follows same procedure as seen before
-    })
-
-  response = {
-    "count": len(venues),
-    "data": venue_data
-  }
-
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
-
-def get_upcoming_shows_for_venue(shows):
-  upcoming_shows = []
-  for show in shows:
-    if show.start_time > datetime.now():
-      upcoming_shows.append({
-        "artist_id": show.artist_id,
-        "artist_name": Artist.query.filter_by(id=show.artist_id).first().name,
-        "artist_image_link": Artist.query.filter_by(id=show.artist_id).first().image_link,
-        "start_time": str(show.start_time)
-      })
-  return upcoming_shows
-
-def get_past_shows_for_venue(shows):
+  genres, match = get_genre_filter(request.form)
+  response = search_entities(Venue, search_term, get_search_page(), genres=genres, match=match)
+  return render_template('pages/search_venues.html', results=response, search_term=search_term,
+                         genres=genres, match=match)
+
+def split_shows(shows, to_data, now=None):
+  # split shows into past and upcoming in one pass against a single "now"
+  now = now or datetime.now()
   past_shows = []
-  for show in shows:
-    if show.start_time <= datetime.now():
-      past_shows.append({
-        "artist_id": show.artist_id,
-        "artist_name": Artist.query.filter_by(id=show.artist_id).first().name,
-        "artist_image_link": Artist.query.filter_by(id=show.artist_id).first().image_link,
-        "start_time": str(show.start_time)
-      })
-  return past_shows
-
-@app.route('/venues/<int:venue_id>')
-def show_venue(venue_id):
-  # shows the venue page with the given venue_id
-  # get venue by id
-  venue = Venue.query.get(venue_id)
-
-  # get shows by id
-  shows = Show.query.filter_by(venue_id=venue_id)
-
-  venue_data = {
+  upcoming_shows = []
+  for show in sorted(shows, key=lambda show: show.start_time):
+    if show.start_time > now:
+      upcoming_shows.append(to_data(show))
+    else:
+      past_shows.append(to_data(show))
+  return past_shows, upcoming_shows
+
+def venue_page_query(venue_id):
+  # the venue and all its shows joined to their artists, this costs two
+  # queries no matter how many shows the venue has
+  return Venue.query.options(
+    db.selectinload(Venue.shows).joinedload(Show.artist)
+  ).filter_by(id=venue_id)
+
+def get_venue_page(venue_id, now=None):
+  return venue_page_data(venue_page_query(venue_id).first_or_404(), now)
+
+def venue_page_data(venue, now=None):
+  past_shows, upcoming_shows = split_shows(venue.shows, lambda show: {
+    "artist_id": show.artist_id,
+    "artist_name": show.artist.name,
+    "artist_image_link": show.artist.image_link,
+    "start_time": show.start_time
+  }, now)
+
+  return {
     "id": venue.id,
     "name": venue.name,
     "genres": venue.genres,
@@ -235,13 +1126,18 @@ def show_venue(venue_id):
     "seeking_talent": venue.seeking_talent,
     "seeking_description": venue.seeking_description,
     "image_link": venue.image_link,
-    "past_shows": get_past_shows_for_venue(shows),
-    "upcoming_shows": get_upcoming_shows_for_venue(shows),
-    "past_shows_count": len(get_past_shows_for_venue(shows)),
-    "upcoming_shows_count": len(get_upcoming_shows_for_venue(shows))
+    "past_shows": past_shows,
+    "upcoming_shows": upcoming_shows,
+    "past_shows_count": len(past_shows),
+    "upcoming_shows_count": len(upcoming_shows)
   }
 
-  return render_template('pages/show_venue.html', venue=venue_data)
+@app.route('/venues/<int:venue_id>')
+def show_venue(venue_id):
+  # shows the venue page with the given venue_id
+  return render_cached_page('venue:%d' % venue_id, 'pages/show_venue.html',
+                            lambda: {'venue': get_venue_page(venue_id)},
+                            ('Venue', 'Artist', 'Show'))
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -261,7 +1157,7 @@ def create_venue_submission():
     state = request.form['state']
     address = request.form['address']
     phone = request.form['phone']
-    genres = request.form['genres']
+    genres = split_list(request.form.getlist('genres'))
     facebook_link = request.form['facebook_link']
     website = ""
     image_link = ""
@@ -275,6 +1171,7 @@ def create_venue_submission():
                   seeking_talent=seeking_talent,
                   seeking_description=seeking_description)
     db.session.add(venue)
+    queue_page_warming([url_for('venues')])
     db.session.commit()
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
   except:
@@ -290,86 +1187,71 @@ def create_venue_submission():
 def delete_venue(venue_id):
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   # clicking that button delete it from the db then redirect the user to the homepage
+  name = venue_id
   try:
     venue = Venue.query.get(venue_id) 
+    name = venue.name
     db.session.delete(venue)
+    queue_page_warming([url_for('venues')])
     db.session.commit()
-    flash('Venue ' + Venue.query.get(venue_id) + ' was successfully deleted.')
+    flash('Venue ' + name + ' was successfully deleted.')
   except:
-    flash('An error occurred. Venue ' + Venue.query.get(venue_id) + ' could not be deleted.')
     db.session.rollback()
+    flash('An error occurred. Venue ' + name + ' could not be deleted.')
   finally:
     db.session.close()
   return redirect(url_for('venues'))
 
 #  Artists
 #  ----------------------------------------------------------------
+def artist_list_query():
+  return db.session.query(Artist.id, Artist.name).order_by(Artist.id)
+
+def artist_list_data(rows):
+  return [{"id": artist_id, "name": name} for artist_id, name in rows]
+
+def get_artist_list():
+  return artist_list_data(artist_list_query())
+
 @app.route('/artists')
 def artists():
-  artists = Artist.query.all()
-  return render_template('pages/artists.html', artists=artists)
+  return render_cached_page('artists', 'pages/artists.html',
+                            lambda: {'artists': get_artist_list()}, ('Artist',))
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   # search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-
   search_term = request.form.get('search_term', '')
-
-  artists = Artist.query.filter(Artist.name.ilike('%' + search_term + '%')).all()
-
-  artist_data = []
-
-  for artist in artists:
-    artist_data.append({
-      "id": artist.id,
-      "name": artist.name,
-      "num_upcoming_shows": 0, # does not have any functionality here, but follows same procedure as seen before
-    })
-
-  response = {
-    "count": len(artists),
-    "data": artist_data
-  }
-
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
-
-def get_upcoming_shows_for_artist(shows):
-  upcoming_shows = []
-  for show in shows:
-    if show.start_time > datetime.now():
-      upcoming_shows.append({
-        'venue_id' : show.venue_id,
-        'venue_name' : Venue.query.filter_by(id=show.venue_id).first().name,
-        'venue_image_link': Venue.query.filter_by(id=show.venue_id).first().image_link,
-        'start_time': str(show.start_time)
-      })
-  return upcoming_shows
-
-def get_past_shows_for_artist(shows):
-  past_shows = []
-  for show in shows:
-    if show.start_time <= datetime.now():
-      past_shows.append({
-        'venue_id' : show.venue_id,
-        'venue_name' : Venue.query.filter_by(id=show.venue_id).first().name,
-        'venue_image_link': Venue.query.filter_by(id=show.venue_id).first().image_link,
-        'start_time': str(show.start_time)
-      })
-  return past_shows
-
-@app.route('/artists/<int:artist_id>')
-def show_artist(artist_id):
-  # shows the venue page with the given venue_id
-  
-  # get artist by id
-  artist = Artist.query.filter_by(id=artist_id).first()
-
-  # get all shows matching artist id
-  shows = Show.query.filter_by(artist_id=artist_id).all()
-
-  artist_data = {
+  genres, match = get_genre_filter(request.form)
+  response = search_entities(Artist, search_term, get_search_page(), genres=genres, match=match)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term,
+                         genres=genres, match=match)
+
+@app.route('/artists/browse')
+def browse_artists():
+  return browse_entities('artists', Artist, ('Artist',))
+
+def artist_page_query(artist_id):
+  # the artist and all its shows joined to their venues, this costs two
+  # queries no matter how many shows the artist has
+  return Artist.query.options(
+    db.selectinload(Artist.shows).joinedload(Show.venue)
+  ).filter_by(id=artist_id)
+
+def get_artist_page(artist_id, now=None):
+  return artist_page_data(artist_page_query(artist_id).first_or_404(), now)
+
+def artist_page_data(artist, now=None):
+  past_shows, upcoming_shows = split_shows(artist.shows, lambda show: {
+    'venue_id': show.venue_id,
+    'venue_name': show.venue.name,
+    'venue_image_link': show.venue.image_link,
+    'start_time': show.start_time
+  }, now)
+
+  return {
     "id": artist.id,
     "name": artist.name,
     "genres": artist.genres,
@@ -381,13 +1263,18 @@ def show_artist(artist_id):
     "seeking_venue": artist.seeking_venue,
     "seeking_description": artist.seeking_description,
     "image_link": artist.image_link,
-    "past_shows": get_past_shows_for_artist(shows),
-    "upcoming_shows": get_upcoming_shows_for_artist(shows),
-    "past_shows_count": len(get_past_shows_for_artist(shows)),
-    "upcoming_shows_count": len(get_upcoming_shows_for_artist(shows)),
+    "past_shows": past_shows,
+    "upcoming_shows": upcoming_shows,
+    "past_shows_count": len(past_shows),
+    "upcoming_shows_count": len(upcoming_shows),
   }
-  
-  return render_template('pages/show_artist.html', artist=artist_data)
+
+@app.route('/artists/<int:artist_id>')
+def show_artist(artist_id):
+  # shows the artist page with the given artist_id
+  return render_cached_page('artist:%d' % artist_id, 'pages/show_artist.html',
+                            lambda: {'artist': get_artist_page(artist_id)},
+                            ('Venue', 'Artist', 'Show'))
 
 #  Update
 #  ----------------------------------------------------------------
@@ -430,7 +1317,7 @@ def edit_artist_submission(artist_id):
     artist.city = request.form['city']
     artist.state = request.form['state']
     artist.phone = request.form['phone']
-    artist.genres = request.form['genres']
+    artist.genres = split_list(request.form.getlist('genres'))
     artist.facebook_link = request.form['facebook_link']
     artist.website = ""
     artist.image_link = ""
@@ -438,6 +1325,8 @@ def edit_artist_submission(artist_id):
     artist.seeking_description = ""
 
     # commit changes, flash message if successful
+    queue_page_warming([url_for('show_artist', artist_id=artist_id),
+                        url_for('artists')])
     db.session.commit()
     flash('Artist ' + request.form['name'] + ' was successfully updated!')
   except:
@@ -505,7 +1394,7 @@ def edit_venue_submission(venue_id):
     venue.state = request.form['state']
     venue.address = request.form['address']
     venue.phone = request.form['phone']
-    venue.genres = request.form['genres']
+    venue.genres = split_list(request.form.getlist('genres'))
     venue.facebook_link = request.form['facebook_link']
     venue.website = ""
     venue.image_link = ""
@@ -513,6 +1402,8 @@ def edit_venue_submission(venue_id):
     venue.seeking_description = ""
 
     # commit changes, flash message if successful
+    queue_page_warming([url_for('show_venue', venue_id=venue_id),
+                        url_for('venues')])
     db.session.commit()
     flash('Venue ' + request.form['name'] + ' was successfully updated!')
   except:
@@ -545,7 +1436,7 @@ def create_artist_submission():
     city = request.form['city']
     state = request.form['state']
     phone = request.form['phone']
-    genres = request.form['genres']
+    genres = split_list(request.form.getlist('genres'))
     facebook_link = request.form['facebook_link']
     website = ""
     image_link = ""
@@ -559,6 +1450,7 @@ def create_artist_submission():
                     seeking_venue=seeking_venue,
                     seeking_description=seeking_description)
     db.session.add(artist)
+    queue_page_warming([url_for('artists')])
     db.session.commit()
     flash('Artist ' + request.form['name'] + ' was successfully listed!')
   except:
@@ -574,14 +1466,17 @@ def create_artist_submission():
 def delete_artist(artist_id):
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   # clicking that button delete it from the db then redirect the user to the homepage
+  name = artist_id
   try:
     artist = Artist.query.get(artist_id) 
+    name = artist.name
     db.session.delete(artist)
+    queue_page_warming([url_for('artists')])
     db.session.commit()
-    flash('Artist ' + Artist.query.get(artist_id) + ' was successfully deleted.')
+    flash('Artist ' + name + ' was successfully deleted.')
   except:
-    flash('An error occurred. Artist ' + Artist.query.get(artist_id) + ' could not be deleted.')
     db.session.rollback()
+    flash('An error occurred. Artist ' + name + ' could not be deleted.')
   finally:
     db.session.close()
   return redirect(url_for('artists'))
@@ -589,27 +1484,235 @@ def delete_artist(artist_id):
 #  Shows
 #  ----------------------------------------------------------------
 
+def encode_show_cursor(start_time, show_id):
+  # cursors point at the last (start_time, id) of a page
+  return '%s_%d' % (start_time.isoformat(), show_id)
+
+def decode_show_cursor(cursor):
+  try:
+    start_time, show_id = cursor.rsplit('_', 1)
+    return dateutil.parser.parse(start_time), int(show_id)
+  except (ValueError, OverflowError):
+    abort(400)
+
+def shows_page_query(after, when, per_page, now=None):
+  # one page of shows with only the columns the show tiles render, joined in
+  # a single query and paginated by keyset on (start_time, id) so that deep
+  # pages cost the same as the first one. Fetches one row more than a page
+  # to know whether there is a next one.
+  now = now or datetime.now()
+
+  query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')
+    ).join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id)
+
+  if when == 'upcoming':
+    query = query.filter(Show.start_time > now)
+  elif when == 'past':
+    query = query.filter(Show.start_time <= now)
+
+  # past shows are listed most recent first
+  key = db.tuple_(Show.start_time, Show.id)
+  descending = when == 'past'
+  if after:
+    start_time, show_id = decode_show_cursor(after)
+    cursor = db.tuple_(start_time, show_id)
+    query = query.filter(key < cursor if descending else key > cursor)
+  if descending:
+    query = query.order_by(Show.start_time.desc(), Show.id.desc())
+  else:
+    query = query.order_by(Show.start_time, Show.id)
+
+  return query.limit(per_page + 1)
+
+def get_shows_page(after=None, when='all', per_page=None, now=None):
+  per_page = per_page or app.config['SHOWS_PER_PAGE']
+  return shows_page_data(shows_page_query(after, when, per_page, now).all(), per_page)
+
+def shows_page_data(rows, per_page):
+  # (show data, cursor of the next page or None)
+  next_cursor = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_cursor = encode_show_cursor(rows[-1].start_time, rows[-1].id)
+
+  show_data = [{
+    "id": row.id,
+    "venue_id": row.venue_id,
+    "venue_name": row.venue_name,
+    "artist_id": row.artist_id,
+    "artist_name": row.artist_name,
+    "artist_image_link": row.artist_image_link,
+    "start_time": row.start_time
+  } for row in rows]
+
+  return show_data, next_cursor
+
 @app.route('/shows')
 def shows():
-  # displays list of shows at /shows
+  # displays a page of shows at /shows, ?when=upcoming|past filters and
+  # ?after=<cursor> continues after the last show of the previous page
+  when = request.args.get('when', 'all')
+  if when not in ('all', 'upcoming', 'past'):
+    abort(400)
 
-  show_data = []
+  after = request.args.get('after')
 
-  # get all shows
-  shows = Show.query.all()
+  def load():
+    show_data, next_cursor = get_shows_page(after=after, when=when)
+    return {'shows': show_data, 'when': when, 'next_cursor': next_cursor}
 
-  # build up show json 
-  for show in shows:
-    show_data.append({
-      "venue_id": show.venue_id,
-      "venue_name": Venue.query.filter_by(id=show.venue_id).first().name,
-      "artist_id": show.artist_id,
-      "artist_name": Artist.query.filter_by(id=show.artist_id).first().name,
-      "artist_image_link": Artist.query.filter_by(id=show.artist_id).first().image_link,
-      "start_time": str(show.start_time)
+  return render_cached_page('shows:%s:%s' % (when, after or ''), 'pages/shows.html', load,
+                            ('Show', 'Venue', 'Artist'), now_dependent=when != 'all')
+
+#  Calendar
+#  ----------------------------------------------------------------
+
+CALENDAR_VIEWS = ('day', 'week', 'month')
+
+def get_max_show_duration():
+  return timedelta(hours=app.config['SHOW_MAX_HOURS'])
+
+def get_calendar_range(view, day):
+  # [start, end) of the day, week (from Monday) or month around day
+  start = datetime(day.year, day.month, day.day)
+  if view == 'day':
+    return start, start + timedelta(days=1)
+  if view == 'week':
+    start -= timedelta(days=start.weekday())
+    return start, start + timedelta(days=7)
+  start = start.replace(day=1)
+  return start, (start + timedelta(days=32)).replace(day=1)
+
+def calendar_query(start, end, venue_id=None, artist_id=None, limit=None):
+  # the shows overlapping [start, end), of one venue or artist or all. As no
+  # show lasts longer than SHOW_MAX_HOURS, the overlapping ones start in
+  # [start - SHOW_MAX_HOURS, end): a range scan on ix_Show_venue_id_start_time,
+  # ix_Show_artist_id_start_time or ix_Show_start_time_id. Fetches one row
+  # more than limit to know whether the list is complete.
+  query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.end_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name')
+    ).join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .filter(Show.start_time >= start - get_max_show_duration(),
+            Show.start_time < end,
+            Show.end_time > start)
+  if venue_id is not None:
+    query = query.filter(Show.venue_id == venue_id)
+  if artist_id is not None:
+    query = query.filter(Show.artist_id == artist_id)
+  return query.order_by(Show.start_time, Show.id).limit(limit + 1)
+
+def calendar_data(rows, start, end, limit):
+  # the days of the range with their shows; shows that began earlier are
+  # listed on the first day
+  days = []
+  day = start
+  while day < end:
+    days.append({"date": day, "shows": []})
+    day += timedelta(days=1)
+  for row in rows[:limit]:
+    index = max(0, (row.start_time - start).days)
+    days[index]['shows'].append({
+      "id": row.id,
+      "start_time": row.start_time,
+      "end_time": row.end_time,
+      "venue_id": row.venue_id,
+      "venue_name": row.venue_name,
+      "artist_id": row.artist_id,
+      "artist_name": row.artist_name,
     })
+  return {"days": days, "complete": len(rows) <= limit}
 
-  return render_template('pages/shows.html', shows=show_data)
+def render_calendar(scope, title, venue_id=None, artist_id=None):
+  # ?view=day|week|month (default week) around ?date=YYYY-MM-DD (default today)
+  view = request.args.get('view', 'week')
+  if view not in CALENDAR_VIEWS:
+    abort(400)
+  try:
+    day = dateutil.parser.parse(request.args['date']) if request.args.get('date') else datetime.now()
+  except (ValueError, OverflowError):
+    abort(400)
+  start, end = get_calendar_range(view, day)
+  limit = app.config['CALENDAR_MAX_SHOWS']
+
+  def load():
+    rows = calendar_query(start, end, venue_id, artist_id, limit).all()
+    return {
+      'calendar': calendar_data(rows, start, end, limit),
+      'title': title,
+      'view': view,
+      'start': start,
+      'end': end,
+      'previous': get_calendar_range(view, start - timedelta(days=1))[0],
+      'endpoint': request.endpoint,
+      'view_args': request.view_args,
+    }
+
+  return render_cached_page('calendar:%s:%s:%s' % (scope, view, start.date().isoformat()),
+                            'pages/calendar.html', load, ('Show', 'Venue', 'Artist'))
+
+@app.route('/calendar')
+def calendar():
+  return render_calendar('all', 'All shows')
+
+@app.route('/venues/<int:venue_id>/calendar')
+def venue_calendar(venue_id):
+  venue = db.session.query(Venue.name).filter_by(id=venue_id).first_or_404()
+  return render_calendar('venue:%d' % venue_id, venue.name, venue_id=venue_id)
+
+@app.route('/artists/<int:artist_id>/calendar')
+def artist_calendar(artist_id):
+  artist = db.session.query(Artist.name).filter_by(id=artist_id).first_or_404()
+  return render_calendar('artist:%d' % artist_id, artist.name, artist_id=artist_id)
+
+def find_show_conflicts(shows):
+  # for each of the shows (dicts of venue_id, artist_id, start_time,
+  # end_time and optionally the id of the show they replace) the bookings
+  # it overlaps, [] when it is free. Existing shows are loaded in one query,
+  # later shows are also checked against the earlier free ones. On postgres
+  # the exclusion constraints reject overlaps that slip in concurrently.
+  if not shows:
+    return []
+  max_duration = get_max_show_duration()
+  rows = db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time,
+                          Show.end_time) \
+    .filter(db.or_(Show.venue_id.in_(set(show['venue_id'] for show in shows)),
+                   Show.artist_id.in_(set(show['artist_id'] for show in shows))),
+            Show.start_time >= min(show['start_time'] for show in shows) - max_duration,
+            Show.start_time < max(show['end_time'] for show in shows))
+  bookings = Bookings(max_duration)
+  for row in rows:
+    bookings.add(row._asdict())
+
+  results = []
+  for show in shows:
+    conflicts = bookings.conflicts(show)
+    if not conflicts:
+      bookings.add(show)
+    results.append(conflicts)
+  return results
+
+def check_show_times(start_time, end_time):
+  # an error message, or None when the times are valid
+  if end_time <= start_time:
+    return 'end_time must be after start_time'
+  if end_time - start_time > get_max_show_duration():
+    return 'shows last at most %d hours' % app.config['SHOW_MAX_HOURS']
+  return None
 
 @app.route('/shows/create')
 def create_shows():
@@ -622,27 +1725,376 @@ def create_show_submission():
   # called upon submitting the new show listing form
   try:
     # input
-    artist_id = request.form['artist_id']
-    venue_id = request.form['venue_id']
-    start_time = request.form['start_time']
+    artist_id = int(request.form['artist_id'])
+    venue_id = int(request.form['venue_id'])
+    start_time = dateutil.parser.parse(request.form['start_time'])
+    end_time = get_show_end_time(start_time, dateutil.parser.parse(request.form['end_time'])
+                                 if request.form.get('end_time') else None)
+
+    # the venue and the artist must be free at that time
+    error = check_show_times(start_time, end_time)
+    if error is None:
+      conflicts = find_show_conflicts([{'venue_id': venue_id, 'artist_id': artist_id,
+                                        'start_time': start_time, 'end_time': end_time}])[0]
+      error = '; '.join(describe_conflict(kind, booked) for kind, booked in conflicts) or None
+    if error is not None:
+      flash('Show could not be listed: ' + error + '.')
+      return render_template('pages/home.html')
 
     # create new show with user data
     show = Show(artist_id=artist_id, venue_id=venue_id,
-                start_time=start_time)
+                start_time=start_time, end_time=end_time)
 
-    # add show and commit session
+    # add show and commit session, the pages listing it are warmed afterwards
     db.session.add(show)
+    queue_page_warming([url_for('shows'),
+                        url_for('show_venue', venue_id=venue_id),
+                        url_for('show_artist', artist_id=artist_id)])
     db.session.commit()
 
     # on successful db insert, flash success
     flash('Show was successfully listed!')
   except:
+    flash('An error occurred. Show could not be listed.')
     db.session.rollback()
     print(sys.exc_info())
   finally:
     db.session.close()
   return render_template('pages/home.html')
 
+@app.route('/shows/<int:show_id>', methods=['DELETE'])
+def delete_show(show_id):
+  # deleting a show also updates the show counters of its venue and artist
+  try:
+    show = Show.query.get(show_id)
+    db.session.delete(show)
+    queue_page_warming([url_for('shows'),
+                        url_for('show_venue', venue_id=show.venue_id),
+                        url_for('show_artist', artist_id=show.artist_id)])
+    db.session.commit()
+    flash('Show was successfully deleted.')
+  except:
+    flash('An error occurred. Show could not be deleted.')
+    db.session.rollback()
+  finally:
+    db.session.close()
+  return redirect(url_for('shows'))
+
+#  Bulk import
+#  ----------------------------------------------------------------
+
+def parse_bool(value, default):
+  if value is None or value == '':
+    return default
+  if isinstance(value, bool):
+    return value
+  return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 't')
+
+def validate_import_row(form_class, row):
+  # runs a row through the same form the web handlers use, returns the
+  # form or an error message
+  formdata = MultiDict()
+  for key, value in row.items():
+    if key == 'genres':
+      for genre in split_list(value):
+        formdata.add(key, genre)
+    elif value is not None:
+      formdata.add(key, str(value))
+  form = form_class(formdata=formdata, meta={'csrf': False})
+  if form.validate():
+    return form, None
+  return None, '; '.join('%s: %s' % (field, ', '.join(errors))
+                         for field, errors in sorted(form.errors.items()))
+
+def venue_import_record(form, row):
+  return {
+    "name": form.name.data,
+    "city": form.city.data,
+    "state": form.state.data,
+    "address": form.address.data,
+    "phone": form.phone.data or '',
+    "genres": form.genres.data,
+    "facebook_link": form.facebook_link.data,
+    "image_link": form.image_link.data or None,
+    "website": row.get('website') or None,
+    "seeking_talent": parse_bool(row.get('seeking_talent'), True),
+    "seeking_description": row.get('seeking_description') or None,
+    "upcoming_shows_count": 0,
+    "past_shows_count": 0,
+    # the inserts bypass geocode_venues
+    **venue_location(form.city.data, form.state.data),
+  }
+
+def artist_import_record(form, row):
+  return {
+    "name": form.name.data,
+    "city": form.city.data,
+    "state": form.state.data,
+    "phone": form.phone.data or None,
+    "genres": form.genres.data,
+    "facebook_link": form.facebook_link.data,
+    "image_link": form.image_link.data or None,
+    "website": row.get('website') or None,
+    "seeking_venue": parse_bool(row.get('seeking_venue'), False),
+    "seeking_description": row.get('seeking_description') or None,
+    "upcoming_shows_count": 0,
+    "past_shows_count": 0,
+  }
+
+def show_import_record(form, row):
+  return {
+    "artist_id": row['artist_id'],
+    "venue_id": row['venue_id'],
+    "start_time": form.start_time.data,
+    "end_time": get_show_end_time(form.start_time.data, form.end_time.data),
+  }
+
+# entity: (model, form used for validation, row to insert values)
+IMPORT_ENTITIES = {
+  'venues': (Venue, VenueForm, venue_import_record),
+  'artists': (Artist, ArtistForm, artist_import_record),
+  'shows': (Show, ShowForm, show_import_record),
+}
+
+def resolve_show_references(rows, report):
+  # shows refer to their artist/venue by id (artist_id, venue_id) or by
+  # name (artist_name, venue_name). All references of a batch are checked
+  # with one query per side; returns the rows that could be resolved.
+  for model, key in ((Artist, 'artist'), (Venue, 'venue')):
+    ids = set()
+    names = set()
+    for number, row, form in rows:
+      if str(row.get(key + '_id') or '').strip():
+        try:
+          ids.add(int(row[key + '_id']))
+        except ValueError:
+          pass
+      elif row.get(key + '_name'):
+        names.add(row[key + '_name'])
+
+    known = set()
+    by_name = {}
+    if ids or names:
+      condition = db.or_(model.id.in_(ids), model.name.in_(names))
+      for entity_id, name in db.session.query(model.id, model.name).filter(condition):
+        known.add(entity_id)
+        if name in names:
+          by_name.setdefault(name, []).append(entity_id)
+
+    resolved = []
+    for number, row, form in rows:
+      value = str(row.get(key + '_id') or '').strip()
+      if value:
+        if not value.isdigit() or int(value) not in known:
+          report.add(number, '%s_id: no %s with id %s' % (key, key, value))
+          continue
+        row[key + '_id'] = int(value)
+      else:
+        matches = by_name.get(row.get(key + '_name'), [])
+        if len(matches) != 1:
+          report.add(number, '%s_name: %s %s named %r' % (
+            key, 'no' if not matches else 'more than one', key, row.get(key + '_name')))
+          continue
+        row[key + '_id'] = matches[0]
+      resolved.append((number, row, form))
+    rows = resolved
+  return rows
+
+def reject_show_conflicts(rows, report):
+  # drops the shows with invalid times or overlapping a booking of their
+  # venue or artist, including earlier rows of the same import
+  checked = []
+  for number, row, form in rows:
+    start_time = form.start_time.data
+    error = check_show_times(start_time, get_show_end_time(start_time, form.end_time.data))
+    if error:
+      report.add(number, error)
+    else:
+      checked.append((number, row, form))
+  shows = [{'venue_id': row['venue_id'], 'artist_id': row['artist_id'],
+            'start_time': form.start_time.data,
+            'end_time': get_show_end_time(form.start_time.data, form.end_time.data)}
+           for number, row, form in checked]
+  free = []
+  for (number, row, form), conflicts in zip(checked, find_show_conflicts(shows)):
+    if conflicts:
+      report.add(number, '; '.join(describe_conflict(kind, booked) for kind, booked in conflicts))
+    else:
+      free.append((number, row, form))
+  return free
+
+def insert_import_records(model, records):
+  # postgres loads the batch with COPY, other databases with executemany
+  if db.engine.dialect.name == 'postgresql':
+    copy_rows(db.session.connection().connection, model.__tablename__,
+              list(records[0].keys()), records)
+  else:
+    db.session.execute(model.__table__.insert(), records)
+
+def after_import_records(entity, records):
+  # the inserts bypass the ORM, so keep counters, cached pages and table
+  # watermarks in step
+  if records:
+    touch_tables(db.session, WATERMARK_TABLES[IMPORT_ENTITIES[entity][0].__tablename__])
+  keys = db.session.info.setdefault('page_cache_keys', set())
+  if entity == 'venues':
+    keys.add('venues')
+  elif entity == 'artists':
+    keys.add('artists')
+  elif entity == 'shows':
+    keys.add('venues')
+    db.session.info.setdefault('page_cache_prefixes', set()).update(('shows:', 'calendar:'))
+    for record in records:
+      keys.add('venue:%d' % record['venue_id'])
+      keys.add('artist:%d' % record['artist_id'])
+    apply_show_counter_changes(db.session, [
+      (record['venue_id'], record['artist_id'], record['start_time'], 1)
+      for record in records])
+
+def import_entities(entity, stream, fmt, checkpoint=None, report=None, batch_size=None):
+  # streams rows from a CSV / JSON Lines file into the database in batches,
+  # one transaction per batch. With a checkpoint name the number of rows
+  # done is stored in the same transaction, so an interrupted import picks
+  # up after the last committed batch when it is run again.
+  model, form_class, to_record = IMPORT_ENTITIES[entity]
+  batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+  report = report or ErrorReport()
+
+  state = ImportCheckpoint.query.get(checkpoint) if checkpoint else None
+  skip = state.rows_done if state else 0
+  rows_done = skip
+  imported = 0
+
+  for batch in batched(read_rows(stream, fmt), batch_size):
+    last_row = batch[-1][0]
+    batch = [(number, row) for number, row in batch if number > skip]
+    if not batch:
+      continue
+
+    valid = []
+    for number, row in batch:
+      if '__error__' in row:
+        report.add(number, row['__error__'])
+        continue
+      form, error = validate_import_row(form_class, row)
+      if error:
+        report.add(number, error)
+      else:
+        valid.append((number, row, form))
+    if entity == 'shows':
+      valid = reject_show_conflicts(resolve_show_references(valid, report), report)
+    records = [(number, to_record(form, row)) for number, row, form in valid]
+
+    try:
+      if records:
+        insert_import_records(model, [record for number, record in records])
+    except SQLAlchemyError:
+      # find the offending rows one by one
+      db.session.rollback()
+      inserted = []
+      for number, record in records:
+        try:
+          with db.session.begin_nested():
+            db.session.execute(model.__table__.insert(), [record])
+          inserted.append((number, record))
+        except SQLAlchemyError as e:
+          report.add(number, str(getattr(e, 'orig', e)).strip())
+      records = inserted
+
+    after_import_records(entity, [record for number, record in records])
+    if checkpoint:
+      state = ImportCheckpoint.query.get(checkpoint) or ImportCheckpoint(name=checkpoint)
+      state.rows_done = last_row
+      state.updated_at = datetime.now()
+      db.session.add(state)
+    db.session.commit()
+    rows_done = last_row
+    imported += len(records)
+
+  return {
+    "entity": entity,
+    "imported": imported,
+    "failed": report.count,
+    "skipped": skip,
+    "rows": rows_done,
+    "errors": report.errors,
+  }
+
+@app.route('/import/<entity>', methods=['POST'])
+def import_submission(entity):
+  # bulk import of an uploaded CSV / JSON Lines file, see import_entities
+  if entity not in IMPORT_ENTITIES or 'file' not in request.files:
+    abort(400)
+  upload = request.files['file']
+  fmt = request.form.get('format') or detect_format(upload.filename)
+  if fmt not in FORMATS:
+    abort(400)
+  checkpoint = request.form.get('checkpoint')
+  try:
+    result = import_entities(entity, upload.stream, fmt,
+                             checkpoint=checkpoint and '%s:%s' % (entity, checkpoint))
+  except:
+    db.session.rollback()
+    print(sys.exc_info())
+    abort(500)
+  finally:
+    db.session.close()
+  return jsonify(result)
+
+#  Export
+#  ----------------------------------------------------------------
+
+# entity: columns in export order, matching what the bulk import reads
+EXPORT_COLUMNS = {
+  'venues': [Venue.id, Venue.name, Venue.city, Venue.state, Venue.address,
+             Venue.phone, Venue.genres, Venue.image_link, Venue.facebook_link,
+             Venue.website, Venue.seeking_talent, Venue.seeking_description],
+  'artists': [Artist.id, Artist.name, Artist.city, Artist.state, Artist.phone,
+              Artist.genres, Artist.image_link, Artist.facebook_link,
+              Artist.website, Artist.seeking_venue, Artist.seeking_description],
+  'shows': [Show.id, Show.artist_id, Show.venue_id, Show.start_time, Show.end_time],
+}
+
+def export_rows(entity):
+  # yields the rows of an entity as tuples in id order. stream_results asks
+  # for a server-side cursor, so only yield_per rows are held in memory and
+  # no lock beyond a plain read is taken.
+  columns = EXPORT_COLUMNS[entity]
+  query = db.session.query(*columns) \
+    .order_by(columns[0]) \
+    .execution_options(stream_results=True) \
+    .yield_per(app.config['EXPORT_BATCH_SIZE'])
+  for row in query:
+    yield tuple(row)
+
+def export_chunks(entity, fmt, compress=False):
+  columns = [column.key for column in EXPORT_COLUMNS[entity]]
+  chunks = encode_rows(export_rows(entity), columns, fmt)
+  return gzip_chunks(chunks) if compress else chunks
+
+@app.route('/export/<entity>.<fmt>')
+def export(entity, fmt):
+  # streams the whole table as CSV / JSON Lines, ?gzip=1 compresses it
+  if entity not in EXPORT_COLUMNS or fmt not in MIMETYPES:
+    abort(404)
+  compress = request.args.get('gzip') == '1'
+  filename = '%s.%s%s' % (entity, fmt, '.gz' if compress else '')
+  return Response(stream_with_context(export_chunks(entity, fmt, compress)),
+                  mimetype='application/gzip' if compress else MIMETYPES[fmt],
+                  headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+@app.route('/metrics')
+def metrics():
+  # runtime counters as JSON
+  return jsonify({
+    "page_cache": page_cache.stats(),
+    "fragment_cache": fragment_cache.stats(),
+    "db_pool": pool_metrics.stats(),
+    "endpoints": query_profiler.stats(),
+    "templates": template_profiler.stats(),
+    "jobs": job_queue.stats()
+  })
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -662,6 +2114,553 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# API.
+#----------------------------------------------------------------------------#
+
+# JSON API under /api/v1, read-only apart from the batch creation of shows
+# (POST /shows, see create_shows_batch). ?fields=id,name selects the columns to
+# load, lists are paginated by keyset on id with ?after=<id>&limit=<n>.
+# Venue and artist lists take ?genres=<genre>&match=any like /venues/browse.
+# /venues/near and /shows/near find venues and upcoming shows by location.
+# ETags are derived from the table watermarks (see conditional_response), so
+# an unchanged resource is answered with 304 after a single small query.
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# resource: (model, {field: column}, watermark tables)
+API_RESOURCES = {
+  'venues': (Venue, dict((column.key, column) for column in EXPORT_COLUMNS['venues'] + [
+    Venue.upcoming_shows_count, Venue.past_shows_count, Venue.latitude,
+    Venue.longitude]), ('Venue',)),
+  'artists': (Artist, dict((column.key, column) for column in EXPORT_COLUMNS['artists'] + [
+    Artist.upcoming_shows_count, Artist.past_shows_count]), ('Artist',)),
+  'shows': (Show, dict([(column.key, column) for column in EXPORT_COLUMNS['shows']] + [
+    ('venue_name', Venue.name), ('artist_name', Artist.name),
+    ('artist_image_link', Artist.image_link)]), ('Show', 'Venue', 'Artist')),
+}
+
+def dump_json(payload):
+  if orjson is not None:
+    return orjson.dumps(payload)
+  return json.dumps(payload, separators=(',', ':'), default=lambda value: value.isoformat())
+
+def get_api_fields(resource):
+  # the requested fields, id first; all fields without ?fields=
+  model, fields, tables = API_RESOURCES[resource]
+  names = [name for name in request.args.get('fields', '').split(',') if name]
+  if not names:
+    return list(fields)
+  unknown = [name for name in names if name not in fields]
+  if unknown:
+    abort(400, 'unknown fields: %s' % ', '.join(unknown))
+  return ['id'] + [name for name in names if name != 'id']
+
+def get_api_query(resource, names):
+  # selects only the requested columns, joining venue/artist for shows
+  model, fields, tables = API_RESOURCES[resource]
+  columns = [fields[name].label(name) for name in names]
+  query = db.session.query(*columns).select_from(model)
+  if model is Show:
+    if any(fields[name].class_ is Venue for name in names):
+      query = query.join(Venue, Venue.id == Show.venue_id)
+    if any(fields[name].class_ is Artist for name in names):
+      query = query.join(Artist, Artist.id == Show.artist_id)
+  return query
+
+def api_response(resource, load):
+  # the ETag covers the request URL, so it matches byte-identical bodies
+  return conditional_response(API_RESOURCES[resource][2], (request.full_path,),
+                              lambda: dump_json(load()), mimetype='application/json')
+
+def parse_api_limit():
+  try:
+    limit = int(request.args.get('limit', app.config['API_PAGE_SIZE']))
+  except ValueError:
+    abort(400, 'limit must be a number')
+  return max(1, min(limit, app.config['API_MAX_PAGE_SIZE']))
+
+@api.route('/<resource>')
+def list_resource(resource):
+  # one page of venues, artists or shows in id order
+  if resource not in API_RESOURCES:
+    abort(404)
+  model = API_RESOURCES[resource][0]
+  names = get_api_fields(resource)
+  limit = parse_api_limit()
+  after = request.args.get('after')
+  if after is not None and not after.isdigit():
+    abort(400, 'after must be an id')
+  genres, match = get_genre_filter(request.args)
+  if genres and model is Show:
+    abort(400, 'shows have no genres')
+
+  def load():
+    query = get_api_query(resource, names)
+    if after is not None:
+      query = query.filter(model.id > int(after))
+    if genres:
+      query = query.filter(genre_condition(model, genres, match))
+    rows = query.order_by(model.id).limit(limit + 1).all()
+    next_cursor = str(rows[limit - 1].id) if len(rows) > limit else None
+    return {
+      "data": [dict(zip(names, row)) for row in rows[:limit]],
+      "next": next_cursor,
+    }
+
+  return api_response(resource, load)
+
+@api.route('/<resource>/<int:item_id>')
+def get_resource(resource, item_id):
+  if resource not in API_RESOURCES:
+    abort(404)
+  model = API_RESOURCES[resource][0]
+  names = get_api_fields(resource)
+
+  def load():
+    row = get_api_query(resource, names).filter(model.id == item_id).first()
+    if row is None:
+      abort(404, 'no %s with id %d' % (resource[:-1], item_id))
+    return {"data": dict(zip(names, row))}
+
+  return api_response(resource, load)
+
+def parse_float(name, low, high):
+  try:
+    value = float(request.args[name])
+  except (KeyError, ValueError):
+    abort(400, '%s must be a number' % name)
+  if not low <= value <= high:
+    abort(400, '%s must be between %s and %s' % (name, low, high))
+  return value
+
+def get_near_filter():
+  # (condition, ordering, origin, unit) of ?lat=&lon= or ?city=&state=, with
+  # ?radius= in ?unit=mi (default) or km, or of ?bbox=west,south,east,north
+  unit = request.args.get('unit', 'mi')
+  if unit not in ('mi', 'km'):
+    abort(400, 'unit must be mi or km')
+  if 'bbox' in request.args:
+    try:
+      west, south, east, north = [float(value) for value in request.args['bbox'].split(',')]
+    except ValueError:
+      abort(400, 'bbox must be west,south,east,north')
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+      abort(400, 'bbox is out of range')
+    return within_filter(south, west, north, east) + (None, unit)
+
+  if 'city' in request.args or 'state' in request.args:
+    origin = gazetteer.lookup(request.args.get('city'), request.args.get('state'))
+    if origin is None:
+      abort(400, 'unknown place')
+  else:
+    origin = (parse_float('lat', -90, 90), parse_float('lon', -180, 180))
+  per_unit = KM_PER_MILE if unit == 'mi' else 1
+  radius = 20
+  if 'radius' in request.args:
+    radius = parse_float('radius', 0, app.config['GEO_MAX_RADIUS_KM'] / per_unit)
+  return near_filter(origin[0], origin[1], radius * per_unit) + (origin, unit)
+
+def parse_api_time(name, default):
+  if not request.args.get(name):
+    return default
+  try:
+    return dateutil.parser.parse(request.args[name])
+  except (ValueError, OverflowError):
+    abort(400, '%s must be a date/time' % name)
+
+@api.route('/venues/near')
+def venues_near():
+  # venues within a radius (nearest first) or inside a box
+  condition, ordering, origin, unit = get_near_filter()
+  limit = parse_api_limit()
+
+  def load():
+    return {"data": [{
+      "id": row.id,
+      "name": row.name,
+      "city": row.city,
+      "state": row.state,
+      "latitude": row.latitude,
+      "longitude": row.longitude,
+      "num_upcoming_shows": row.upcoming_shows_count,
+      "distance": get_distance(row, origin, unit),
+    } for row in venues_near_query(condition, ordering, limit)], "unit": unit}
+
+  return api_response('venues', load)
+
+@api.route('/shows/near')
+def shows_near():
+  # upcoming shows (or those between ?start= and ?end=) at the venues
+  # within a radius or inside a box, soonest first
+  condition, ordering, origin, unit = get_near_filter()
+  limit = parse_api_limit()
+  start = parse_api_time('start', None)
+  end = parse_api_time('end', None)
+  bucket = page_cache.now_bucket()
+
+  def load():
+    rows = shows_near_query(condition, start or datetime.now(), end, limit)
+    return {"data": [{
+      "id": row.id,
+      "start_time": row.start_time,
+      "venue_id": row.venue_id,
+      "venue_name": row.venue_name,
+      "artist_id": row.artist_id,
+      "artist_name": row.artist_name,
+      "distance": get_distance(row, origin, unit),
+    } for row in rows], "unit": unit}
+
+  # without ?start= the window moves with the "now" bucket
+  return conditional_response(API_RESOURCES['shows'][2], (request.full_path, start or bucket),
+                              lambda: dump_json(load()), mimetype='application/json',
+                              modified_at=None if start else get_bucket_start(bucket))
+
+def parse_show_item(item):
+  # (show, None) for a valid item of a show batch, (None, error) otherwise
+  if not isinstance(item, dict):
+    return None, 'each show must be an object'
+  show = {}
+  for key in ('venue_id', 'artist_id'):
+    value = item.get(key)
+    if isinstance(value, bool) or not str(value).isdigit():
+      return None, '%s must be an id' % key
+    show[key] = int(value)
+  for key in ('start_time', 'end_time'):
+    value = item.get(key)
+    if value is None and key == 'end_time':
+      continue
+    try:
+      show[key] = dateutil.parser.isoparse(value)
+    except (TypeError, ValueError, OverflowError):
+      return None, '%s must be an ISO 8601 date/time' % key
+    if show[key].tzinfo is not None:
+      return None, '%s must be a local time without offset' % key
+  show['end_time'] = get_show_end_time(show['start_time'], show.get('end_time'))
+  return show, check_show_times(show['start_time'], show['end_time'])
+
+def find_show_references(shows):
+  # the (kind, id) of the venues and artists of the shows that exist, one
+  # query for both sides
+  venues = db.session.query(db.literal('venue').label('kind'), Venue.id) \
+    .filter(Venue.id.in_(set(show['venue_id'] for show in shows)))
+  artists = db.session.query(db.literal('artist').label('kind'), Artist.id) \
+    .filter(Artist.id.in_(set(show['artist_id'] for show in shows)))
+  return set((kind, entity_id) for kind, entity_id in venues.union_all(artists))
+
+def insert_show_records(records):
+  # inserts the shows with one statement, a multi-row VALUES on postgres and
+  # executemany elsewhere; returns their ids by (venue_id, start_time),
+  # which no two shows share as a venue holds one show at a time. Like the
+  # bulk import this bypasses the ORM, see after_import_records.
+  table = Show.__table__
+  if db.engine.dialect.name == 'postgresql':
+    rows = db.session.execute(table.insert().values(records)
+                              .returning(table.c.id, table.c.venue_id, table.c.start_time))
+  else:
+    db.session.execute(table.insert(), records)
+    rows = db.session.query(Show.id, Show.venue_id, Show.start_time) \
+      .filter(Show.venue_id.in_(set(record['venue_id'] for record in records)),
+              Show.start_time.in_(set(record['start_time'] for record in records)))
+  return dict(((venue_id, start_time), show_id) for show_id, venue_id, start_time in rows)
+
+def add_show_batch(items, atomic=False):
+  # validates, checks and inserts a batch of shows in the current
+  # transaction, returns the result of each item. With atomic, a single
+  # rejected item leaves all of them uncreated.
+  results = [None] * len(items)
+  shows = []
+  for index, item in enumerate(items):
+    show, error = parse_show_item(item)
+    if error:
+      results[index] = {"status": "rejected", "error": error}
+    else:
+      shows.append((index, show))
+
+  if shows:
+    known = find_show_references([show for index, show in shows])
+    free = []
+    for index, show in shows:
+      missing = ['no %s with id %d' % (kind, show[kind + '_id']) for kind in ('venue', 'artist')
+                 if (kind, show[kind + '_id']) not in known]
+      if missing:
+        results[index] = {"status": "rejected", "error": '; '.join(missing)}
+      else:
+        free.append((index, show))
+    shows = []
+    for (index, show), conflicts in zip(free, find_show_conflicts([show for index, show in free])):
+      if conflicts:
+        results[index] = {"status": "rejected", "error": '; '.join(
+          describe_conflict(kind, booked) for kind, booked in conflicts)}
+      else:
+        shows.append((index, show))
+  if atomic and len(shows) < len(items):
+    shows = []
+
+  records = [(index, dict((key, show[key]) for key in ('venue_id', 'artist_id', 'start_time', 'end_time')))
+             for index, show in shows]
+  ids = {}
+  if records:
+    try:
+      with db.session.begin_nested():
+        ids = insert_show_records([record for index, record in records])
+    except IntegrityError as e:
+      # a booking committed since the conflict check, caught by the
+      # exclusion constraints on postgres
+      if atomic:
+        error = str(getattr(e, 'orig', e)).strip()
+        for index, record in records:
+          results[index] = {"status": "rejected", "error": error}
+        records = []
+      else:
+        # find the offending shows one by one
+        inserted = []
+        for index, record in records:
+          try:
+            with db.session.begin_nested():
+              ids.update(insert_show_records([record]))
+            inserted.append((index, record))
+          except IntegrityError as e:
+            results[index] = {"status": "rejected", "error": str(getattr(e, 'orig', e)).strip()}
+        records = inserted
+
+  # after the savepoints, whose rollbacks discard the pending invalidations
+  if records:
+    after_import_records('shows', [record for index, record in records])
+  for index, record in records:
+    results[index] = {"status": "created", "id": ids[(record['venue_id'], record['start_time'])]}
+  return [dict({"index": index}, **(result or {"status": "skipped"}))
+          for index, result in enumerate(results)]
+
+def get_idempotency_key(key):
+  # the stored request for the key, None when unknown or expired
+  if not key:
+    return None
+  stored = IdempotencyKey.query.get(key)
+  expires = timedelta(hours=app.config['API_IDEMPOTENCY_HOURS'])
+  if stored is None or stored.created_at < datetime.utcnow() - expires:
+    return None
+  return stored
+
+def replay_response(stored, request_hash):
+  if stored.request_hash != request_hash:
+    abort(422, 'Idempotency-Key was used for a different request')
+  response = Response(dump_json(stored.response), status=stored.status_code,
+                      mimetype='application/json')
+  response.headers['Idempotent-Replayed'] = 'true'
+  return response
+
+@api.route('/shows', methods=['POST'])
+def create_shows_batch():
+  # creates up to API_MAX_BATCH_SHOWS shows in one transaction from
+  # {"shows": [{"venue_id", "artist_id", "start_time", "end_time"}, ...]},
+  # end_time optional, times ISO 8601. Each show is created or rejected on
+  # its own, or with "atomic": true all of them or none. With an
+  # Idempotency-Key header a retry of the request is answered with the
+  # response of the first one instead of being run again.
+  key = request.headers.get('Idempotency-Key')
+  if key is not None and not 0 < len(key) <= 255:
+    abort(400, 'Idempotency-Key must be 1 to 255 characters')
+  payload = request.get_json(silent=True)
+  if not isinstance(payload, dict) or not isinstance(payload.get('shows'), list):
+    abort(400, 'expected {"shows": [...]}')
+  items = payload['shows']
+  if not 0 < len(items) <= app.config['API_MAX_BATCH_SHOWS']:
+    abort(400, 'a batch holds 1 to %d shows' % app.config['API_MAX_BATCH_SHOWS'])
+  request_hash = hashlib.sha256(request.get_data()).hexdigest()
+
+  stored = get_idempotency_key(key)
+  if stored is not None:
+    return replay_response(stored, request_hash)
+
+  try:
+    results = add_show_batch(items, atomic=parse_bool(payload.get('atomic'), False))
+    created = [result for result in results if result['status'] == 'created']
+    body = {
+      "created": len(created),
+      "rejected": sum(1 for result in results if result['status'] == 'rejected'),
+      "results": results,
+    }
+    status_code = 201 if created else 422
+    if created:
+      paths = set([url_for('shows')])
+      for item, result in zip(items, results):
+        if result['status'] == 'created':
+          paths.add(url_for('show_venue', venue_id=int(item['venue_id'])))
+          paths.add(url_for('show_artist', artist_id=int(item['artist_id'])))
+      queue_page_warming(sorted(paths))
+    if key:
+      # in the transaction of the shows, so they exist exactly when the key does
+      db.session.merge(IdempotencyKey(key=key, request_hash=request_hash,
+                                      status_code=status_code, response=body,
+                                      created_at=datetime.utcnow()))
+    db.session.commit()
+  except IntegrityError:
+    # a concurrent request with the same key committed first
+    db.session.rollback()
+    stored = get_idempotency_key(key)
+    if stored is None:
+      raise
+    return replay_response(stored, request_hash)
+  except:
+    db.session.rollback()
+    raise
+  finally:
+    db.session.close()
+  return Response(dump_json(body), status=status_code, mimetype='application/json')
+
+# registered per code too, the app's own 404 page would win otherwise
+@api.errorhandler(400)
+@api.errorhandler(404)
+@api.errorhandler(422)
+@api.errorhandler(HTTPException)
+def api_error(error):
+  response = jsonify({"error": error.description})
+  response.status_code = error.code
+  return response
+
+app.register_blueprint(api)
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('roll-over-shows')
+def roll_over_shows_command():
+  """Move started shows from the upcoming to the past counters."""
+  click.echo('%d shows rolled over' % roll_over_show_counters())
+
+@app.cli.command('check-counters')
+@click.option('--fix', is_flag=True, help='Recount all counters if any are wrong.')
+def check_counters_command(fix):
+  """Verify the Venue/Artist show counters against the Show table."""
+  mismatches = check_show_counters()
+  for table, owner_id, upcoming, past, actual_upcoming, actual_past in mismatches:
+    click.echo('%s %d: upcoming %d (actual %d), past %d (actual %d)' % (
+      table, owner_id, upcoming, actual_upcoming, past, actual_past))
+  if not mismatches:
+    click.echo('show counters are consistent')
+  elif fix:
+    recount_show_counters()
+    click.echo('show counters recounted')
+  else:
+    sys.exit(1)
+
+@app.cli.command('import')
+@click.argument('entity', type=click.Choice(sorted(IMPORT_ENTITIES)))
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS),
+              help='Input format, by default taken from the file extension.')
+@click.option('--errors', type=click.Path(dir_okay=False),
+              help='Write the rejected rows with their errors to this CSV file.')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an earlier run.')
+def import_command(entity, source, fmt, errors, batch_size, restart):
+  """Bulk import venues, artists or shows from a CSV / JSON Lines file."""
+  checkpoint = '%s:%s' % (entity, os.path.abspath(source))
+  if restart:
+    ImportCheckpoint.query.filter_by(name=checkpoint).delete()
+    db.session.commit()
+
+  report = ErrorReport(errors)
+  try:
+    with open(source, 'rb') as stream:
+      result = import_entities(entity, stream, fmt or detect_format(source),
+                               checkpoint=checkpoint, report=report,
+                               batch_size=batch_size)
+  finally:
+    report.close()
+
+  click.echo('%(imported)d %(entity)s imported, %(failed)d rows rejected, '
+             '%(skipped)d rows skipped from an earlier run' % result)
+  for error in result['errors'][:10]:
+    click.echo('row %(row)d: %(error)s' % error)
+
+@app.cli.command('export')
+@click.argument('entity', type=click.Choice(sorted(EXPORT_COLUMNS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(MIMETYPES)), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', type=click.File('wb'), default='-',
+              help='File to write to, standard output by default.')
+def export_command(entity, fmt, compress, output):
+  """Stream all venues, artists or shows as CSV / JSON Lines."""
+  for chunk in export_chunks(entity, fmt, compress):
+    output.write(chunk)
+
+@app.cli.command('geocode-venues')
+@click.option('--all', 'everything', is_flag=True,
+              help='Also place venues that already have coordinates.')
+def geocode_venues_command(everything):
+  """Place venues by city/state from the gazetteer."""
+  query = db.session.query(Venue.id, Venue.city, Venue.state)
+  if not everything:
+    query = query.filter(Venue.latitude.is_(None))
+  placed = unknown = 0
+  for batch in batched(query.order_by(Venue.id).all(), app.config['IMPORT_BATCH_SIZE']):
+    mappings = [dict(id=venue_id, **venue_location(city, state))
+                for venue_id, city, state in batch]
+    db.session.bulk_update_mappings(Venue, mappings)
+    touch_tables(db.session, ('Venue',))
+    db.session.commit()
+    unknown += sum(1 for mapping in mappings if mapping['latitude'] is None)
+    placed += len(mappings)
+  click.echo('%d venues geocoded, %d of them in places missing from the gazetteer' % (
+    placed, unknown))
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Exit once no job is due.')
+def run_jobs_command(once):
+  """Run queued background jobs until stopped."""
+  # jobs queued by the jobs themselves are left to this loop
+  job_queue.in_process = False
+  try:
+    job_queue.work(once=once)
+  except KeyboardInterrupt:
+    pass
+  click.echo('%(completed)d jobs done, %(retried)d to be retried, %(failed)d failed' %
+             job_queue.stats())
+
+@app.cli.command('jobs')
+@click.option('--retry-failed', is_flag=True, help='Queue the failed jobs again.')
+@click.option('--prune-days', type=int, default=None,
+              help='Delete the jobs done more than this many days ago.')
+def jobs_command(retry_failed, prune_days):
+  """Show the background job queue."""
+  if retry_failed:
+    retried = Job.query.filter_by(status='failed').update(
+      {'status': 'queued', 'attempts': 0, 'run_at': datetime.utcnow()},
+      synchronize_session=False)
+    db.session.commit()
+    click.echo('%d failed jobs queued again' % retried)
+  if prune_days is not None:
+    pruned = job_queue.prune(done_days=prune_days)
+    click.echo('%d finished jobs deleted' % pruned)
+  depth, lag = job_queue.depth()
+  click.echo(', '.join('%d %s' % (count, status) for status, count in depth.items()) +
+             ', oldest due job waiting %.1f s' % lag)
+  for job in Job.query.filter_by(status='failed').order_by(Job.id.desc()).limit(10):
+    error = (job.last_error or '').strip().splitlines()
+    click.echo('job %d (%s) failed after %d attempts: %s' % (
+      job.id, job.name, job.attempts, error[-1] if error else ''))
+
+@app.cli.command('prune-idempotency-keys')
+def prune_idempotency_keys_command():
+  """Delete the expired Idempotency-Keys of the write API."""
+  expires = datetime.utcnow() - timedelta(hours=app.config['API_IDEMPOTENCY_HOURS'])
+  pruned = IdempotencyKey.query.filter(IdempotencyKey.created_at < expires) \
+    .delete(synchronize_session=False)
+  db.session.commit()
+  click.echo('%d expired idempotency keys deleted' % pruned)
+
+@app.cli.command('build-assets')
+def build_assets_command():
+  """Bundle, minify, fingerprint and precompress the static CSS/JS."""
+  manifest = build_assets(app.static_folder)
+  for name, entry in sorted(manifest.items()):
+    click.echo('%s -> %s: %d files, %d bytes from %d, %d gzipped' % (
+      name, entry['file'], len(entry['sources']), entry['size'],
+      entry['source_size'], entry['gzip_size']))
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,323 @@
+#----------------------------------------------------------------------------#
+# ASGI entry point with an async read path.
+#
+#   uvicorn asgi:application --workers 4
+#
+# GET /venues, /artists, /shows, the venue/artist pages and the venue/artist
+# searches are served on the event loop: their queries (the same ones the
+# Flask views build, see venue_areas_query() and friends in app.py) run on an
+# async engine (asyncpg for postgres, aiosqlite for sqlite), so a slow query
+# does not hold a worker thread. Everything else, and any read the async path
+# cannot answer (pending flash messages, errors), is handed to the Flask app
+# in a thread pool. Needs `pip install uvicorn asyncpg` (or aiosqlite).
+#----------------------------------------------------------------------------#
+
+import asyncio
+import io
+import sys
+from datetime import datetime
+
+from flask import render_template, request, session
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from werkzeug.exceptions import HTTPException, NotFound
+
+from app import (app, page_cache, Artist, Venue, artist_list_data,
+                 artist_list_query, artist_page_data, artist_page_query,
+                 get_genre_filter, get_search_page, render_page_entry, search_queries,
+                 search_results_data, shows_page_data, shows_page_query,
+                 start_page_response, table_watermarks_data,
+                 table_watermarks_query, venue_areas_data, venue_areas_query,
+                 venue_page_data, venue_page_query)
+from db_pool import get_pool_options, pool_metrics
+from jobs import job_queue
+
+# sync driver: async driver
+ASYNC_DRIVERS = {
+  'postgresql': 'postgresql+asyncpg',
+  'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def get_async_url(config):
+  # ASYNC_DATABASE_URI, or SQLALCHEMY_DATABASE_URI with the async driver
+  if config['ASYNC_DATABASE_URI']:
+    return make_url(config['ASYNC_DATABASE_URI'])
+  url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+  backend = url.drivername.split('+')[0]
+  if backend not in ASYNC_DRIVERS:
+    raise ValueError('no async driver for %s' % url.drivername)
+  return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_engine_for(config):
+  url = get_async_url(config)
+  options = get_pool_options(config, url.drivername)
+  # the async engine brings its own adapted pool class
+  options.pop('poolclass', None)
+  if 'connect_args' in options:
+    options['connect_args'] = {'server_settings': {
+      'statement_timeout': str(config['DB_STATEMENT_TIMEOUT_MS'])}}
+  engine = create_async_engine(url, **options)
+  pool_metrics.watch(engine.sync_engine, 'async')
+  return engine
+
+
+def build_environ(scope, body):
+  # WSGI environ of an ASGI http scope
+  headers = scope['headers']
+  server = scope.get('server') or ('localhost', 80)
+  environ = {
+    'REQUEST_METHOD': scope['method'],
+    'SCRIPT_NAME': scope.get('root_path', ''),
+    'PATH_INFO': scope['path'],
+    'QUERY_STRING': scope['query_string'].decode('latin-1'),
+    'SERVER_NAME': server[0],
+    'SERVER_PORT': str(server[1]),
+    'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+    'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+    'wsgi.version': (1, 0),
+    'wsgi.url_scheme': scope.get('scheme', 'http'),
+    'wsgi.input': io.BytesIO(body),
+    'wsgi.errors': sys.stderr,
+    'wsgi.multithread': True,
+    'wsgi.multiprocess': True,
+    'wsgi.run_once': False,
+    'CONTENT_LENGTH': str(len(body)),
+  }
+  for name, value in headers:
+    name = name.decode('latin-1').upper().replace('-', '_')
+    value = value.decode('latin-1')
+    if name == 'CONTENT_TYPE':
+      environ['CONTENT_TYPE'] = value
+    elif name != 'CONTENT_LENGTH':
+      key = 'HTTP_' + name
+      environ[key] = environ[key] + ',' + value if key in environ else value
+  return environ
+
+
+class AsyncReadApp(object):
+  # ASGI application: the read views below, the Flask app for the rest
+
+  def __init__(self, flask_app, engine):
+    self.flask_app = flask_app
+    self.engine = engine
+    self.sessions = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    self.views = {
+      'venues': self.venues,
+      'artists': self.artists,
+      'shows': self.shows,
+      'show_venue': self.show_venue,
+      'show_artist': self.show_artist,
+      'search_venues': self.search_venues,
+      'search_artists': self.search_artists,
+    }
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] == 'lifespan':
+      await self.lifespan(receive, send)
+      return
+    if scope['type'] != 'http':
+      return
+
+    body = b''
+    while True:
+      message = await receive()
+      body += message.get('body', b'')
+      if not message.get('more_body'):
+        break
+    environ = build_environ(scope, body)
+
+    response = None
+    adapter = self.flask_app.url_map.bind_to_environ(environ)
+    try:
+      endpoint, view_args = adapter.match()
+    except HTTPException:
+      endpoint = None
+    if endpoint in self.views:
+      try:
+        response = await self.views[endpoint](environ, **view_args)
+      except HTTPException:
+        response = None
+    if response is None:
+      await self.call_wsgi(environ, send)
+    else:
+      await self.send_response(response, send)
+
+  async def lifespan(self, receive, send):
+    while True:
+      message = await receive()
+      if message['type'] == 'lifespan.startup':
+        # the counter roll-over and the queued jobs, see jobs.py
+        job_queue.start()
+        await send({'type': 'lifespan.startup.complete'})
+      elif message['type'] == 'lifespan.shutdown':
+        await self.engine.dispose()
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+  # helpers
+
+  def build_query(self, fn, *args):
+    # the Flask views' queries as executable statements. Contexts are never
+    # held across an await: they are per thread, not per task.
+    with self.flask_app.app_context():
+      return fn(*args).statement
+
+  async def render_page(self, environ, key, template, tables, load, now_dependent=False):
+    # async twin of render_cached_page: validators first, then the page
+    # cache, then load(session) for the template context
+    async with self.sessions() as db_session:
+      statement = self.build_query(table_watermarks_query, tables)
+      versions, modified_at = table_watermarks_data((await db_session.execute(statement)).all(), tables)
+
+      with self.flask_app.request_context(environ):
+        if session.get('_flashes'):
+          return None
+        response = start_page_response(key, versions, modified_at, now_dependent)
+        if response.status_code == 304:
+          return response
+        entry = page_cache.get(key)
+
+      # see get_page_entry
+      if entry is None or entry.get('versions') != versions:
+        entry = {'context': await load(db_session), 'html': None, 'versions': versions}
+        page_cache.set(key, entry)
+
+    with self.flask_app.request_context(environ):
+      response.set_data(render_page_entry(key, template, entry))
+    return response
+
+  # views
+
+  async def venues(self, environ):
+    async def load(db_session):
+      result = await db_session.execute(self.build_query(venue_areas_query))
+      return {'areas': venue_areas_data(result.all())}
+
+    return await self.render_page(environ, 'venues', 'pages/venues.html', ('Venue',), load)
+
+  async def artists(self, environ):
+    async def load(db_session):
+      result = await db_session.execute(self.build_query(artist_list_query))
+      return {'artists': artist_list_data(result.all())}
+
+    return await self.render_page(environ, 'artists', 'pages/artists.html', ('Artist',), load)
+
+  async def shows(self, environ):
+    with self.flask_app.request_context(environ):
+      when = request.args.get('when', 'all')
+      after = request.args.get('after')
+    if when not in ('all', 'upcoming', 'past'):
+      return None
+    per_page = self.flask_app.config['SHOWS_PER_PAGE']
+
+    async def load(db_session):
+      statement = self.build_query(shows_page_query, after, when, per_page)
+      show_data, next_cursor = shows_page_data((await db_session.execute(statement)).all(), per_page)
+      return {'shows': show_data, 'when': when, 'next_cursor': next_cursor}
+
+    return await self.render_page(environ, 'shows:%s:%s' % (when, after or ''), 'pages/shows.html',
+                                  ('Show', 'Venue', 'Artist'), load, now_dependent=when != 'all')
+
+  async def show_detail(self, environ, kind, query, to_data, item_id):
+    async def load(db_session):
+      result = await db_session.execute(self.build_query(query, item_id))
+      item = result.scalars().first()
+      if item is None:
+        # the Flask view renders the 404 page
+        raise NotFound()
+      return {kind: to_data(item, datetime.now())}
+
+    return await self.render_page(environ, '%s:%d' % (kind, item_id), 'pages/show_%s.html' % kind,
+                                  ('Venue', 'Artist', 'Show'), load)
+
+  async def show_venue(self, environ, venue_id):
+    return await self.show_detail(environ, 'venue', venue_page_query, venue_page_data, venue_id)
+
+  async def show_artist(self, environ, artist_id):
+    return await self.show_detail(environ, 'artist', artist_page_query, artist_page_data, artist_id)
+
+  async def search(self, environ, model, template):
+    with self.flask_app.request_context(environ):
+      # the layout pops pending flashes, which only the Flask app saves
+      if session.get('_flashes'):
+        return None
+      search_term = request.form.get('search_term', '')
+      page = get_search_page()
+      genres, match = get_genre_filter(request.form)
+    per_page = self.flask_app.config['SEARCH_RESULTS_PER_PAGE']
+
+    with self.flask_app.app_context():
+      rows, count = search_queries(model, search_term, page, per_page, genres, match)
+      rows, count = rows.statement, count.statement
+    async with self.sessions() as db_session:
+      results = search_results_data((await db_session.execute(rows)).all(),
+                                    (await db_session.execute(count)).scalar(), page, per_page)
+
+    with self.flask_app.request_context(environ):
+      return self.flask_app.response_class(
+        render_template(template, results=results, search_term=search_term,
+                        genres=genres, match=match), mimetype='text/html')
+
+  async def search_venues(self, environ):
+    return await self.search(environ, Venue, 'pages/search_venues.html')
+
+  async def search_artists(self, environ):
+    return await self.search(environ, Artist, 'pages/search_artists.html')
+
+  # responses
+
+  async def send_response(self, response, send):
+    body = response.get_data()
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.headers.items() if name.lower() != 'content-length']
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+  async def call_wsgi(self, environ, send):
+    # runs the Flask app in one pool thread from start to end (its contexts
+    # are per thread) and streams what it yields through a bounded queue
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=16)
+
+    def put(item):
+      asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def start_response(status, headers, exc_info=None):
+      put(('start', int(status.split(' ', 1)[0]), [
+        (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]))
+      return lambda data: put(('body', data))
+
+    def run():
+      try:
+        result = self.flask_app(environ, start_response)
+        try:
+          for chunk in result:
+            if chunk:
+              put(('body', chunk))
+        finally:
+          if hasattr(result, 'close'):
+            result.close()
+        put(('end', None))
+      except BaseException as e:
+        put(('error', e))
+
+    future = loop.run_in_executor(None, run)
+    while True:
+      kind, *item = await queue.get()
+      if kind == 'start':
+        await send({'type': 'http.response.start', 'status': item[0], 'headers': item[1]})
+      elif kind == 'body':
+        await send({'type': 'http.response.body', 'body': item[0], 'more_body': True})
+      elif kind == 'end':
+        await send({'type': 'http.response.body', 'body': b''})
+        break
+      else:
+        raise item[0]
+    await future
+
+
+application = AsyncReadApp(app, create_engine_for(app.config))
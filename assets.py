@@ -0,0 +1,220 @@
+#----------------------------------------------------------------------------#
+# Fingerprinted static asset URLs. Templates link assets through
+# asset_url('css/main.css'), which appends a hash of the file contents
+# (?v=<hash>). Requests carrying the current hash are served with a one year
+# immutable Cache-Control, so browsers never revalidate them; a changed file
+# gets a new URL.
+#
+# build_assets() (flask build-assets) concatenates and minifies the files of
+# each bundle into static/dist/<bundle>.<hash>.<ext> with .gz/.br variants
+# and a manifest; bundle_urls() links the built bundle when there is one and
+# the source files otherwise.
+#----------------------------------------------------------------------------#
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import request, send_from_directory, url_for
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+# seconds a fingerprinted asset may be cached
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# bundle: files under static/ in load order, as linked by layouts/main.html
+BUNDLES = {
+  'site.css': ['css/bootstrap.min.css', 'css/layout.main.css', 'css/main.css',
+               'css/main.responsive.css', 'css/main.quickfix.css'],
+  'head.js': ['js/libs/modernizr-2.8.2.min.js', 'js/libs/moment.min.js', 'js/script.js'],
+  'footer.js': ['js/libs/bootstrap-3.1.1.min.js', 'js/plugins.js'],
+}
+
+# one level below static/ like css/, so relative url()s in the CSS still work
+DIST_FOLDER = 'dist'
+MANIFEST = DIST_FOLDER + '/manifest.json'
+
+# served in this order of preference when the client accepts them
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def minify_css(text):
+  text = re.sub(r'/\*(?!!).*?\*/', '', text, flags=re.S)
+  text = re.sub(r'\s+', ' ', text)
+  text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+  return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+  # conservative: drops whole-line comments, indentation and blank lines,
+  # which is safe without a parser. Files already minified are left alone.
+  lines = []
+  for line in text.splitlines():
+    line = line.strip()
+    if line and not line.startswith('//'):
+      lines.append(line)
+  return '\n'.join(lines)
+
+
+def build_bundle(static_folder, files):
+  parts = []
+  for filename in files:
+    with open(os.path.join(static_folder, filename), encoding='utf-8') as f:
+      text = f.read()
+    if '.min.' not in filename:
+      text = minify_css(text) if filename.endswith('.css') else minify_js(text)
+    parts.append(text)
+  # the ; keeps a file without a trailing semicolon from running into the next
+  return ('\n' if files[0].endswith('.css') else ';\n').join(parts).encode('utf-8')
+
+
+def write_precompressed(path, data):
+  # mtime=0 keeps the .gz identical between builds of the same content
+  with open(path + '.gz', 'wb') as f:
+    with gzip.GzipFile(filename='', mode='wb', fileobj=f, compresslevel=9, mtime=0) as out:
+      out.write(data)
+  if brotli is not None:
+    with open(path + '.br', 'wb') as f:
+      f.write(brotli.compress(data, quality=11))
+
+
+def build_assets(static_folder, bundles=BUNDLES):
+  # writes every bundle under static/dist and returns the manifest. Bundles
+  # from earlier builds are kept, pages cached by clients may still link them.
+  os.makedirs(os.path.join(static_folder, DIST_FOLDER), exist_ok=True)
+  manifest = {}
+  for name, files in sorted(bundles.items()):
+    data = build_bundle(static_folder, files)
+    stem, ext = os.path.splitext(name)
+    filename = '%s/%s.%s%s' % (DIST_FOLDER, stem, hashlib.md5(data).hexdigest()[:12], ext)
+    path = os.path.join(static_folder, filename)
+    with open(path, 'wb') as f:
+      f.write(data)
+    write_precompressed(path, data)
+    manifest[name] = {
+      "file": filename,
+      "sources": files,
+      "size": len(data),
+      "gzip_size": os.path.getsize(path + '.gz'),
+      "source_size": sum(os.path.getsize(os.path.join(static_folder, source)) for source in files),
+    }
+  with open(os.path.join(static_folder, MANIFEST), 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+  return manifest
+
+
+def get_build_id(folders):
+  # fingerprint of the files under the given folders from their names and
+  # contents, taken at start-up. Part of the page ETags, so that a deploy
+  # with changed templates or assets does not leave stale pages in caches,
+  # while hosts and restarts serving the same files agree on it.
+  digest = hashlib.md5()
+  for folder in folders:
+    for root, dirs, files in os.walk(folder):
+      dirs.sort()
+      for name in sorted(files):
+        path = os.path.join(root, name)
+        digest.update(('%s\n' % os.path.relpath(path, folder).replace(os.sep, '/')).encode('utf-8'))
+        with open(path, 'rb') as f:
+          digest.update(hashlib.md5(f.read()).digest())
+  return digest.hexdigest()[:12]
+
+
+class AssetVersions(object):
+
+  def __init__(self, app=None):
+    # filename: (mtime, hash)
+    self.hashes = {}
+    self.static_folder = None
+    self.build_id = None
+    # (mtime, contents) of the bundle manifest
+    self.manifest = (None, {})
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    self.static_folder = app.static_folder
+    self.build_id = app.config.get('BUILD_ID') or get_build_id(
+      [app.static_folder, os.path.join(app.root_path, app.template_folder)])
+    app.jinja_env.globals['asset_url'] = self.url
+    app.jinja_env.globals['bundle_urls'] = self.bundle_urls
+    app.view_functions['static'] = self.make_static_view(app.view_functions['static'])
+    app.after_request(self.after_request)
+
+  def version(self, filename):
+    # short content hash of a static file, None if it does not exist. The
+    # mtime check keeps edits visible without a restart.
+    path = os.path.join(self.static_folder, filename)
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      return None
+    cached = self.hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+      with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:12]
+      cached = self.hashes[filename] = (mtime, digest)
+    return cached[1]
+
+  def url(self, filename):
+    version = self.version(filename)
+    if version is None:
+      return url_for('static', filename=filename)
+    return url_for('static', filename=filename, v=version)
+
+  def get_manifest(self):
+    path = os.path.join(self.static_folder, MANIFEST)
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      return {}
+    if self.manifest[0] != mtime:
+      with open(path) as f:
+        self.manifest = (mtime, json.load(f))
+    return self.manifest[1]
+
+  def bundle_urls(self, name):
+    # the built bundle, or its source files before the first build
+    entry = self.get_manifest().get(name)
+    if entry is not None and entry['sources'] == BUNDLES.get(name, entry['sources']):
+      return [url_for('static', filename=entry['file'])]
+    return [self.url(filename) for filename in BUNDLES[name]]
+
+  def make_static_view(self, static_view):
+    # serves the precompressed variant of a built bundle that the client
+    # accepts, nothing is compressed per request
+    def send_static(filename):
+      if not filename.startswith(DIST_FOLDER + '/'):
+        return static_view(filename=filename)
+      path = os.path.join(self.static_folder, filename)
+      for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+          response = send_from_directory(self.static_folder, filename + suffix,
+                                         mimetype=mimetypes.guess_type(filename)[0])
+          response.headers['Content-Encoding'] = encoding
+          break
+      else:
+        response = static_view(filename=filename)
+      response.vary.add('Accept-Encoding')
+      return response
+    return send_static
+
+  def after_request(self, response):
+    if request.endpoint != 'static' or response.status_code not in (200, 304):
+      return response
+    filename = request.view_args['filename']
+    version = request.args.get('v')
+    if filename.startswith(DIST_FOLDER + '/') or (version and version == self.version(filename)):
+      response.cache_control.public = True
+      response.cache_control.max_age = IMMUTABLE_MAX_AGE
+      response.cache_control.immutable = True
+    return response
+
+
+asset_versions = AssetVersions()
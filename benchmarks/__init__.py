@@ -0,0 +1,3 @@
+# Benchmarks and database checks for the Fyyur app. Run them from the
+# project root, e.g.
+#   python -m benchmarks.venues
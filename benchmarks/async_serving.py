@@ -0,0 +1,136 @@
+#----------------------------------------------------------------------------#
+# Throughput of the read endpoints under concurrency: the Flask app on a
+# threaded WSGI server against asgi.py on uvicorn, on the same database.
+# Both servers run as separate processes; the client opens one connection
+# per request from an asyncio loop, so it can keep hundreds in flight.
+#
+#   python -m benchmarks.async_serving --venues 1000 --shows 20000
+#----------------------------------------------------------------------------#
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+from app import db
+from benchmarks.common import setup_database, seed
+from benchmarks.routes import summarize
+
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+def start_server(mode, port, env):
+  if mode == 'wsgi':
+    command = [sys.executable, '-c',
+               'import logging, sys; from werkzeug.serving import run_simple; from app import app; '
+               'logging.getLogger("werkzeug").setLevel(logging.ERROR); '
+               'run_simple("127.0.0.1", int(sys.argv[1]), app, threaded=True)', str(port)]
+  else:
+    command = [sys.executable, '-m', 'uvicorn', 'asgi:application',
+               '--port', str(port), '--log-level', 'warning', '--no-access-log']
+  process = subprocess.Popen(command, env=env)
+  deadline = time.time() + 30
+  while time.time() < deadline:
+    try:
+      socket.create_connection(('127.0.0.1', port), timeout=1).close()
+      return process
+    except OSError:
+      time.sleep(0.2)
+  process.kill()
+  raise RuntimeError('%s server did not start' % mode)
+
+
+async def fetch(port, method, path, form):
+  body = urlencode(form).encode() if form else b''
+  reader, writer = await asyncio.open_connection('127.0.0.1', port)
+  head = '%s %s HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n' % (method, path)
+  if form:
+    head += 'Content-Type: application/x-www-form-urlencoded\r\nContent-Length: %d\r\n' % len(body)
+  writer.write(head.encode() + b'\r\n' + body)
+  await writer.drain()
+  status_line = await reader.readline()
+  await reader.read()
+  writer.close()
+  return int(status_line.split()[1])
+
+
+async def load(port, jobs, concurrency):
+  semaphore = asyncio.Semaphore(concurrency)
+  latencies = []
+  errors = 0
+
+  async def run(job):
+    nonlocal errors
+    async with semaphore:
+      begin = time.perf_counter()
+      try:
+        status = await fetch(port, *job)
+      except OSError:
+        status = 599
+      latencies.append((time.perf_counter() - begin) * 1000)
+      if status >= 400:
+        errors += 1
+
+  start = time.perf_counter()
+  await asyncio.gather(*(run(job) for job in jobs))
+  return summarize(latencies, time.perf_counter() - start, 0, errors)
+
+
+def make_jobs(args, rnd):
+  jobs = []
+  for _ in range(args.requests):
+    kind = rnd.randrange(4)
+    if kind == 0:
+      jobs.append(('GET', '/venues/%d' % rnd.randint(1, args.venues), None))
+    elif kind == 1:
+      jobs.append(('GET', '/artists/%d' % rnd.randint(1, args.artists), None))
+    elif kind == 2:
+      jobs.append(('POST', '/venues/search', {'search_term': 'Venue %d' % rnd.randint(1, 99)}))
+    else:
+      jobs.append(('GET', '/venues', None))
+  return jobs
+
+
+def main():
+  parser = argparse.ArgumentParser(description='WSGI against ASGI for the read endpoints.')
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--artists', type=int, default=1000)
+  parser.add_argument('--shows', type=int, default=20000)
+  parser.add_argument('--requests', type=int, default=2000)
+  parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 64, 256])
+  args = parser.parse_args()
+
+  ctx = setup_database()
+  seed(venues=args.venues, artists=args.artists, shows=args.shows)
+  url = str(db.engine.url)
+  db.session.remove()
+  ctx.pop()
+
+  env = dict(os.environ, DATABASE_URL=url)
+  print('%-6s %12s %10s %10s %10s %10s %8s' % ('mode', 'concurrency', 'rps', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+  for mode in ('wsgi', 'asgi'):
+    port = free_port()
+    process = start_server(mode, port, env)
+    try:
+      for concurrency in args.concurrency:
+        jobs = make_jobs(args, random.Random(concurrency))
+        result = asyncio.run(load(port, jobs, concurrency))
+        print('%-6s %12d %10.1f %10.1f %10.1f %10.1f %8d' % (
+          mode, concurrency, result['throughput_rps'], result['p50_ms'],
+          result['p95_ms'], result['p99_ms'], result['errors']))
+    finally:
+      process.terminate()
+      process.wait()
+
+
+if __name__ == '__main__':
+  main()
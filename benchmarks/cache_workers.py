@@ -0,0 +1,86 @@
+#----------------------------------------------------------------------------#
+# Runs several worker processes against the same pages and compares the
+# database query rate of per-process (memory) and shared (sqlite) caches.
+# With a shared cache one worker's miss warms the page for all the others,
+# so the query rate drops as workers are added.
+#
+#   python -m benchmarks.cache_workers [seconds per run]
+#----------------------------------------------------------------------------#
+
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+import app as fyyur
+from cache import PageCache, MemoryBackend, SQLiteBackend
+from benchmarks.common import setup_database, seed, count_queries
+
+VENUES = 500
+ARTISTS = 500
+WORKERS = [1, 2, 4, 8]
+SHARED_PATH = os.path.join(tempfile.gettempdir(), 'fyyur_bench_cache.sqlite')
+
+
+def make_backend(name):
+  if name == 'sqlite':
+    return SQLiteBackend(SHARED_PATH, maxsize=100000)
+  return MemoryBackend(maxsize=100000)
+
+
+def worker(backend_name, duration, seed_value, results):
+  # forked workers must not reuse the parent's pooled connections
+  fyyur.db.engine.dispose()
+  fyyur.page_cache = PageCache(make_backend(backend_name))
+  client = fyyur.app.test_client()
+  rnd = random.Random(seed_value)
+  urls = ['/venues', '/shows'] + \
+    ['/venues/%d' % i for i in range(1, VENUES + 1)] + \
+    ['/artists/%d' % i for i in range(1, ARTISTS + 1)]
+
+  requests = 0
+  with fyyur.app.app_context(), count_queries() as counter:
+    deadline = time.time() + duration
+    while time.time() < deadline:
+      client.get(rnd.choice(urls))
+      requests += 1
+  results.put((requests, counter['queries']))
+
+
+def run(backend_name, workers, duration):
+  if backend_name == 'sqlite':
+    make_backend('sqlite').clear()
+  results = multiprocessing.Queue()
+  processes = [multiprocessing.Process(target=worker, args=(backend_name, duration, i, results))
+               for i in range(workers)]
+  for process in processes:
+    process.start()
+  totals = [results.get() for _ in processes]
+  for process in processes:
+    process.join()
+  requests = sum(total[0] for total in totals)
+  queries = sum(total[1] for total in totals)
+  return requests, queries
+
+
+def main(duration):
+  multiprocessing.set_start_method('fork')
+  ctx = setup_database()
+  seed(venues=VENUES, artists=ARTISTS, shows=VENUES * 5)
+  fyyur.db.session.remove()
+
+  print('%8s %8s %10s %10s %12s %12s' % (
+    'backend', 'workers', 'requests', 'queries', 'queries/s', 'queries/req'))
+  for backend_name in ('memory', 'sqlite'):
+    for workers in WORKERS:
+      requests, queries = run(backend_name, workers, duration)
+      print('%8s %8d %10d %10d %12.1f %12.3f' % (
+        backend_name, workers, requests, queries,
+        queries / duration, queries / max(requests, 1)))
+  ctx.pop()
+
+
+if __name__ == '__main__':
+  main(float(sys.argv[1]) if len(sys.argv) > 1 else 10)
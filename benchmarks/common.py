@@ -0,0 +1,115 @@
+#----------------------------------------------------------------------------#
+# Shared helpers for the benchmarks: database setup, synthetic data and
+# query counting.
+#----------------------------------------------------------------------------#
+
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import app, db, Venue, Artist, Show, recount_show_counters
+
+# set FYYUR_BENCH_DATABASE_URI to benchmark against postgres, by default
+# a throwaway sqlite file is used
+DEFAULT_URI = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'fyyur_bench.db')
+
+GENRES = ['Jazz', 'Reggae', 'Swing', 'Classical', 'Folk', 'Rock n Roll', 'Blues']
+STATES = ['CA', 'NY', 'TX', 'WA', 'IL', 'FL', 'OR', 'MA']
+
+BATCH_SIZE = 5000
+
+
+def setup_database():
+  # point the app at the benchmark database and start from empty tables
+  app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'FYYUR_BENCH_DATABASE_URI', DEFAULT_URI)
+  app.config['SQLALCHEMY_ECHO'] = False
+  ctx = app.app_context()
+  ctx.push()
+  if db.engine.dialect.name == 'postgresql':
+    # the trigram indexes on Venue/Artist need the extension
+    db.session.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    db.session.commit()
+  db.drop_all()
+  db.create_all()
+  return ctx
+
+
+def _insert(table, rows):
+  for start in range(0, len(rows), BATCH_SIZE):
+    db.session.execute(table.insert(), rows[start:start + BATCH_SIZE])
+  db.session.commit()
+
+
+def seed(venues, artists=0, shows=0, cities=None, seed=0):
+  # insert synthetic venues, artists and shows with batched inserts,
+  # half of the shows lie in the past and half in the future
+  rnd = random.Random(seed)
+  cities = cities or max(1, venues // 20)
+  now = datetime.now()
+
+  _insert(Venue.__table__, [{
+    'id': i,
+    'name': 'Venue %d' % i,
+    'city': 'City %d' % (i % cities),
+    'state': STATES[i % len(STATES)],
+    'address': '%d Main Street' % i,
+    'phone': '123-123-1234',
+    'genres': rnd.sample(GENRES, 2),
+    'image_link': 'https://example.com/venue/%d.jpg' % i,
+    'seeking_talent': True,
+  } for i in range(1, venues + 1)])
+
+  _insert(Artist.__table__, [{
+    'id': i,
+    'name': 'Artist %d' % i,
+    'city': 'City %d' % (i % cities),
+    'state': STATES[i % len(STATES)],
+    'phone': '123-123-1234',
+    'genres': rnd.sample(GENRES, 2),
+    'image_link': 'https://example.com/artist/%d.jpg' % i,
+    'seeking_venue': False,
+  } for i in range(1, artists + 1)])
+
+  if artists and venues:
+    _insert(Show.__table__, [{
+      'id': i,
+      'artist_id': rnd.randint(1, artists),
+      'venue_id': rnd.randint(1, venues),
+      'start_time': now + timedelta(hours=rnd.randint(-24 * 365, 24 * 365)),
+    } for i in range(1, shows + 1)])
+
+  # the batched inserts bypass the ORM hooks that maintain the counters
+  recount_show_counters()
+
+
+@contextmanager
+def count_queries():
+  # counts the statements sent to the database inside the block
+  counter = {'queries': 0}
+
+  def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counter['queries'] += 1
+
+  event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+  try:
+    yield counter
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def measure(fn, repeat=5):
+  # runs fn repeat times, returns (best ms, queries of one run)
+  timings = []
+  for _ in range(repeat):
+    db.session.expunge_all()
+    with count_queries() as counter:
+      start = time.perf_counter()
+      fn()
+      timings.append((time.perf_counter() - start) * 1000)
+  return min(timings), counter['queries']
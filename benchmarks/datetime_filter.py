@@ -0,0 +1,62 @@
+#----------------------------------------------------------------------------#
+# Compares ways of formatting the start times of a page of shows with the
+# datetime filter: the old string round trip, the filter on native datetimes
+# and the list filter used by the templates.
+#
+#   python -m benchmarks.datetime_filter [number of shows]
+#----------------------------------------------------------------------------#
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+from app import format_datetime, format_datetimes
+
+
+def format_datetime_parsed(value, format='full'):
+  # the filter before it took datetimes: parse the str() of the value and
+  # let Babel parse the pattern on every call
+  date = dateutil.parser.parse(value)
+  return babel.dates.format_datetime(date, "EEEE MMMM, d, y 'at' h:mma")
+
+
+def best_ms(fn, repeat=5):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    elapsed = (time.perf_counter() - start) * 1000
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def main(size):
+  rng = random.Random(0)
+  start = datetime(2026, 1, 1, 20)
+  # shows start on the hour or half hour, so times repeat like in real data
+  times = [start + timedelta(minutes=30 * rng.randrange(365 * 48)) for _ in range(size)]
+  strings = [str(value) for value in times]
+
+  expected = [format_datetime_parsed(value) for value in strings]
+  assert [format_datetime(value, 'full') for value in times] == expected
+  assert format_datetimes(times, 'full') == expected
+
+  cases = [
+    ('str + dateutil + babel', lambda: [format_datetime_parsed(value) for value in strings]),
+    ('filter, datetimes', lambda: [format_datetime(value, 'full') for value in times]),
+    ('filter, strings', lambda: [format_datetime(value, 'full') for value in strings]),
+    ('list filter', lambda: format_datetimes(times, 'full')),
+  ]
+  print('%d shows' % size)
+  print('%-24s %10s %12s' % ('', 'ms', 'us per show'))
+  for name, fn in cases:
+    ms = best_ms(fn)
+    print('%-24s %10.1f %12.2f' % (name, ms, ms * 1000 / size))
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,41 @@
+#----------------------------------------------------------------------------#
+# Checks that the venue and artist detail pages run a constant number of
+# queries however many shows they list, and reports their latency.
+#
+#   python -m benchmarks.detail_pages [show counts...]
+#----------------------------------------------------------------------------#
+
+import sys
+
+from app import app, db, get_venue_page, get_artist_page
+from benchmarks.common import setup_database, seed, measure
+
+# entity + shows joined to the counterpart entity
+MAX_QUERIES = 2
+
+
+def main(sizes):
+  ctx = setup_database()
+  failed = False
+  print('%10s %10s %10s %10s %10s' % ('shows', 'venue ms', 'queries', 'artist ms', 'queries'))
+  for size in sizes:
+    db.drop_all()
+    db.create_all()
+    # a single venue and artist so that every show lands on both pages
+    seed(venues=1, artists=1, shows=size)
+
+    venue_ms, venue_queries = measure(lambda: get_venue_page(1))
+    artist_ms, artist_queries = measure(lambda: get_artist_page(1))
+    print('%10d %10.1f %10d %10.1f %10d' % (
+      size, venue_ms, venue_queries, artist_ms, artist_queries))
+
+    if venue_queries > MAX_QUERIES or artist_queries > MAX_QUERIES:
+      failed = True
+  ctx.pop()
+
+  if failed:
+    sys.exit('detail pages ran more than %d queries' % MAX_QUERIES)
+
+
+if __name__ == '__main__':
+  main([int(arg) for arg in sys.argv[1:]] or [10, 200, 2000])
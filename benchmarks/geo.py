@@ -0,0 +1,96 @@
+#----------------------------------------------------------------------------#
+# "Near" queries on the geohash index against a scan of all venues. Venues
+# are spread around the gazetteer's cities; every answer is checked against
+# the great circle distance computed in Python.
+#
+#   python -m benchmarks.geo [number of venues]
+#----------------------------------------------------------------------------#
+
+import random
+import sys
+from datetime import datetime
+
+from app import db, Venue, near_filter, within_filter, venues_near_query, shows_near_query
+from benchmarks.common import setup_database, seed, measure
+from geo import KM_PER_MILE, distance_km, encode_geohash, gazetteer
+
+RADII_MILES = [5, 20, 100]
+
+
+def place_venues(size, rnd):
+  # venues within ~30 km of a gazetteer city
+  cities = [place for (city, state), place in gazetteer.load().items() if city]
+  rows = []
+  for venue_id in range(1, size + 1):
+    latitude, longitude = rnd.choice(cities)
+    latitude += rnd.uniform(-0.3, 0.3)
+    longitude += rnd.uniform(-0.3, 0.3)
+    rows.append({'venue_id': venue_id, 'latitude': latitude, 'longitude': longitude,
+                 'geohash': encode_geohash(latitude, longitude)})
+  table = Venue.__table__
+  statement = table.update().where(table.c.id == db.bindparam('venue_id')).values(
+    latitude=db.bindparam('latitude'), longitude=db.bindparam('longitude'),
+    geohash=db.bindparam('geohash'))
+  for start in range(0, len(rows), 5000):
+    db.session.execute(statement, rows[start:start + 5000])
+  db.session.commit()
+  return dict((row['venue_id'], (row['latitude'], row['longitude'])) for row in rows)
+
+
+def scan_near(latitude, longitude, radius_km):
+  # no index: every venue's distance in Python
+  rows = db.session.query(Venue.id, Venue.latitude, Venue.longitude).all()
+  return set(venue_id for venue_id, lat, lon in rows
+             if distance_km(latitude, longitude, lat, lon) <= radius_km)
+
+
+def main(size):
+  ctx = setup_database()
+  seed(venues=size, artists=max(1, size // 10), shows=size * 2)
+  rnd = random.Random(1)
+  places = place_venues(size, rnd)
+  origins = [place for (city, state), place in sorted(gazetteer.load().items()) if city]
+  origins = rnd.sample(origins, 10)
+
+  failed = False
+  print('%10s %10s %10s %12s %10s' % ('radius mi', 'venues', 'scan ms', 'geohash ms', 'check'))
+  for radius in RADII_MILES:
+    radius_km = radius * KM_PER_MILE
+    found = 0
+    scan_total = indexed_total = 0.0
+    ok = True
+    for latitude, longitude in origins:
+      condition, ordering = near_filter(latitude, longitude, radius_km)
+      scan_ms, _ = measure(lambda: scan_near(latitude, longitude, radius_km), repeat=1)
+      indexed_ms, _ = measure(lambda: venues_near_query(condition, ordering, size).all())
+      scan_total += scan_ms
+      indexed_total += indexed_ms
+      expected = scan_near(latitude, longitude, radius_km)
+      result = set(row.id for row in venues_near_query(condition, ordering, size))
+      # the equirectangular test may differ at the very edge of the circle
+      edge = set(venue_id for venue_id in expected ^ result
+                 if abs(distance_km(latitude, longitude, *places[venue_id]) - radius_km) > 0.01 * radius_km)
+      ok = ok and not edge
+      found += len(result)
+    failed = failed or not ok
+    print('%10d %10d %10.1f %12.1f %10s' % (
+      radius, found // len(origins), scan_total / len(origins), indexed_total / len(origins),
+      'ok' if ok else 'FAIL'))
+
+  latitude, longitude = origins[0]
+  condition, ordering = within_filter(latitude - 0.5, longitude - 0.5, latitude + 0.5, longitude + 0.5)
+  box_ms, _ = measure(lambda: venues_near_query(condition, ordering, size).all())
+  print('1 degree box: %.1f ms' % box_ms)
+
+  condition, ordering = near_filter(latitude, longitude, 20 * KM_PER_MILE)
+  now = datetime.now()
+  shows_ms, queries = measure(lambda: shows_near_query(condition, now, None, 50).all())
+  print('shows within 20 miles: %.1f ms, %d queries' % (shows_ms, queries))
+  ctx.pop()
+
+  if failed:
+    sys.exit('near queries disagree with the great circle distance')
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,92 @@
+#----------------------------------------------------------------------------#
+# Checks that the hot Show queries are served by indexes. The statements are
+# captured from the real page loaders and run again under EXPLAIN, the check
+# fails if any of them scans the whole Show table.
+#
+#   python -m benchmarks.query_plans
+#----------------------------------------------------------------------------#
+
+import re
+import sys
+
+from sqlalchemy import event
+
+from app import app, db, Show, get_venue_page, get_artist_page, get_shows_page, encode_show_cursor
+from benchmarks.common import setup_database, seed
+
+# postgres: 'Seq Scan on "Show"', sqlite: 'SCAN Show' without an index
+FULL_SCAN = {
+  'postgresql': re.compile(r'Seq Scan on "Show"'),
+  'sqlite': re.compile(r'SCAN (TABLE )?Show(?! USING)'),
+}
+EXPLAIN = {
+  'postgresql': 'EXPLAIN ',
+  'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+def capture(fn):
+  # returns the (statement, parameters) that fn sends to the database
+  statements = []
+
+  def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements.append((statement, parameters))
+
+  db.session.expunge_all()
+  event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+  try:
+    fn()
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+  return [(statement, parameters) for statement, parameters in statements
+          if '"Show"' in statement or ' Show' in statement]
+
+
+def explain(statement, parameters):
+  dialect = db.engine.dialect.name
+  connection = db.engine.raw_connection()
+  try:
+    cursor = connection.cursor()
+    cursor.execute(EXPLAIN[dialect] + statement, parameters)
+    return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+  finally:
+    connection.close()
+
+
+def main():
+  ctx = setup_database()
+  seed(venues=2000, artists=2000, shows=100000)
+  if db.engine.dialect.name == 'postgresql':
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+
+  middle = Show.query.order_by(Show.start_time, Show.id).offset(50000).first()
+  cursor = encode_show_cursor(middle.start_time, middle.id)
+
+  checks = [
+    ('venue page', lambda: get_venue_page(1)),
+    ('artist page', lambda: get_artist_page(1)),
+    ('shows feed', lambda: get_shows_page()),
+    ('shows feed, deep page', lambda: get_shows_page(after=cursor)),
+    ('upcoming shows', lambda: get_shows_page(when='upcoming')),
+    ('past shows', lambda: get_shows_page(when='past', after=cursor)),
+  ]
+
+  failed = False
+  full_scan = FULL_SCAN[db.engine.dialect.name]
+  for name, fn in checks:
+    for statement, parameters in capture(fn):
+      plan = explain(statement, parameters)
+      ok = not full_scan.search(plan)
+      failed = failed or not ok
+      print('%-4s %s' % ('ok' if ok else 'FAIL', name))
+      if not ok:
+        print('     ' + plan.replace('\n', '\n     '))
+  ctx.pop()
+
+  if failed:
+    sys.exit('some hot queries scan the whole Show table')
+
+
+if __name__ == '__main__':
+  main()
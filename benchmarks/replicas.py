@@ -0,0 +1,112 @@
+#----------------------------------------------------------------------------#
+# Checks the read-replica routing with two local databases: a primary and a
+# replica that is a copy of it taken before a write, so reads that reach the
+# replica cannot see the write.
+#
+#   python -m benchmarks.replicas
+#
+# Set FYYUR_BENCH_DATABASE_URI and FYYUR_BENCH_REPLICA_URI to use other
+# databases; the replica is only copied from the primary for sqlite files.
+#----------------------------------------------------------------------------#
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPLICA_URI = os.environ.get(
+  'FYYUR_BENCH_REPLICA_URI',
+  'sqlite:///' + os.path.join(tempfile.gettempdir(), 'fyyur_bench_replica.db'))
+# the replica binds are read when the app is imported
+os.environ['FYYUR_DB_REPLICA_URLS'] = REPLICA_URI
+
+from sqlalchemy import event
+
+from app import app, db, Venue
+from benchmarks.common import setup_database, seed
+
+PIN_SECONDS = 1.0
+
+
+class EngineCounter(object):
+  # statements run per engine
+  def __init__(self, engines):
+    self.counts = dict.fromkeys(engines, 0)
+    for name, engine in engines.items():
+      event.listen(engine, 'before_cursor_execute', self.listener(name))
+
+  def listener(self, name):
+    def count(*args):
+      self.counts[name] += 1
+    return count
+
+  def take(self):
+    counts = dict(self.counts)
+    for name in self.counts:
+      self.counts[name] = 0
+    return counts
+
+
+def main():
+  app.config['WTF_CSRF_ENABLED'] = False
+  # background jobs would run their own statements while the engines are counted
+  app.config['JOBS_WORKERS'] = 0
+  app.config['DB_REPLICA_PIN_SECONDS'] = PIN_SECONDS
+  ctx = setup_database()
+  seed(venues=20, artists=20, shows=100)
+  primary = db.engine
+  replica = db.get_engine(bind='replica0')
+  db.session.remove()
+
+  if primary.url.drivername == 'sqlite' and replica.url.drivername == 'sqlite':
+    replica.dispose()
+    shutil.copyfile(primary.url.database, replica.url.database)
+  counter = EngineCounter({'primary': primary, 'replica': replica})
+  writer = app.test_client()
+  reader = app.test_client()
+  failures = 0
+
+  def check(name, ok):
+    nonlocal failures
+    print('%-4s %s' % ('ok' if ok else 'FAIL', name))
+    failures += 0 if ok else 1
+
+  counter.take()
+  reader.get('/venues/1')
+  counts = counter.take()
+  check('GET reads from the replica', counts['replica'] > 0 and counts['primary'] == 0)
+
+  writer.post('/venues/create', data={
+    'name': 'Replica Check Venue', 'city': 'City 1', 'state': 'CA',
+    'address': '1 Main Street', 'phone': '123-123-1234', 'genres': 'Jazz',
+    'facebook_link': 'https://www.facebook.com/check'})
+  counts = counter.take()
+  check('POST writes to the primary', counts['primary'] > 0 and counts['replica'] == 0)
+  venue_id = db.session.query(db.func.max(Venue.id)).scalar()
+  db.session.remove()
+  counter.take()
+
+  response = writer.get('/venues/%d' % venue_id)
+  counts = counter.take()
+  check('the writer reads its write from the primary',
+        response.status_code == 200 and counts['replica'] == 0)
+
+  response = reader.get('/venues/%d' % venue_id)
+  counts = counter.take()
+  check('other clients keep reading the replica',
+        response.status_code == 404 and counts['primary'] == 0)
+
+  time.sleep(PIN_SECONDS)
+  writer.get('/artists')
+  counts = counter.take()
+  check('the writer goes back to the replica after %.1fs' % PIN_SECONDS,
+        counts['replica'] > 0 and counts['primary'] == 0)
+
+  ctx.pop()
+  if failures:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,220 @@
+#----------------------------------------------------------------------------#
+# Load test for every Fyyur route, through the Flask test client and through
+# a real threaded WSGI server. Reports p50/p95/p99 latency, throughput and
+# queries per request as JSON; pass --compare with an earlier report to see
+# the change per route.
+#
+#   python -m benchmarks.routes --venues 1000 --shows 10000 --output before.json
+#   python -m benchmarks.routes --venues 1000 --shows 10000 --compare before.json
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import logging
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from werkzeug.serving import make_server
+
+from app import app, db
+from benchmarks.common import setup_database, seed, count_queries
+
+
+def get_routes(venues, artists, rnd):
+  # (name, method, path factory, form data factory)
+  def venue_id():
+    return rnd.randint(1, venues)
+
+  def artist_id():
+    return rnd.randint(1, artists)
+
+  def venue_form():
+    return {'name': 'Bench Venue', 'city': 'City 1', 'state': 'CA',
+            'address': '1 Main Street', 'phone': '123-123-1234',
+            'genres': 'Jazz', 'facebook_link': 'https://www.facebook.com/bench'}
+
+  def artist_form():
+    return {'name': 'Bench Artist', 'city': 'City 1', 'state': 'CA',
+            'phone': '123-123-1234', 'genres': 'Jazz',
+            'facebook_link': 'https://www.facebook.com/bench'}
+
+  def show_form():
+    start_time = datetime.now() + timedelta(days=rnd.randint(1, 365))
+    return {'artist_id': artist_id(), 'venue_id': venue_id(),
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+  return [
+    ('GET /venues', 'GET', lambda: '/venues', None),
+    ('GET /artists', 'GET', lambda: '/artists', None),
+    ('GET /shows', 'GET', lambda: '/shows', None),
+    ('GET /shows?when=upcoming', 'GET', lambda: '/shows?when=upcoming', None),
+    ('POST /venues/search', 'POST', lambda: '/venues/search',
+     lambda: {'search_term': 'Venue %d' % rnd.randint(1, 99)}),
+    ('POST /artists/search', 'POST', lambda: '/artists/search',
+     lambda: {'search_term': 'Artist %d' % rnd.randint(1, 99)}),
+    ('GET /venues/<id>', 'GET', lambda: '/venues/%d' % venue_id(), None),
+    ('GET /artists/<id>', 'GET', lambda: '/artists/%d' % artist_id(), None),
+    ('POST /venues/create', 'POST', lambda: '/venues/create', venue_form),
+    ('POST /artists/create', 'POST', lambda: '/artists/create', artist_form),
+    ('POST /shows/create', 'POST', lambda: '/shows/create', show_form),
+    ('POST /venues/<id>/edit', 'POST', lambda: '/venues/%d/edit' % venue_id(), venue_form),
+    ('POST /artists/<id>/edit', 'POST', lambda: '/artists/%d/edit' % artist_id(), artist_form),
+  ]
+
+
+def percentile(values, fraction):
+  # nearest-rank percentile of a sorted list
+  if not values:
+    return 0.0
+  index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+  return values[index]
+
+
+def summarize(latencies, elapsed, queries, errors):
+  latencies = sorted(latencies)
+  return {
+    'requests': len(latencies),
+    'errors': errors,
+    'p50_ms': round(percentile(latencies, 0.50), 3),
+    'p95_ms': round(percentile(latencies, 0.95), 3),
+    'p99_ms': round(percentile(latencies, 0.99), 3),
+    'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+    'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    'queries_per_request': round(queries / len(latencies), 2) if latencies else 0.0,
+  }
+
+
+def run_test_client(routes, requests):
+  client = app.test_client()
+  results = {}
+  for name, method, path, form in routes:
+    latencies = []
+    errors = 0
+    with count_queries() as counter:
+      start = time.perf_counter()
+      for _ in range(requests):
+        begin = time.perf_counter()
+        response = client.open(path(), method=method, data=form() if form else None)
+        latencies.append((time.perf_counter() - begin) * 1000)
+        if response.status_code >= 400:
+          errors += 1
+      elapsed = time.perf_counter() - start
+    results[name] = summarize(latencies, elapsed, counter['queries'], errors)
+  return results
+
+
+def run_wsgi(routes, requests, concurrency):
+  # keep the access log out of the report
+  logging.getLogger('werkzeug').setLevel(logging.ERROR)
+  server = make_server('127.0.0.1', 0, app, threaded=True)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  base_url = 'http://127.0.0.1:%d' % server.server_port
+  lock = threading.Lock()
+
+  def fetch(method, path, form):
+    data = urlencode(form).encode() if form is not None else None
+    begin = time.perf_counter()
+    try:
+      with urlopen(Request(base_url + path, data=data, method=method)) as response:
+        response.read()
+      ok = True
+    except HTTPError:
+      ok = False
+    return (time.perf_counter() - begin) * 1000, ok
+
+  results = {}
+  try:
+    for name, method, path, form in routes:
+      # build the requests up front, the random generator is not thread safe
+      with lock:
+        jobs = [(method, path(), form() if form else None) for _ in range(requests)]
+      with count_queries() as counter, ThreadPoolExecutor(concurrency) as pool:
+        start = time.perf_counter()
+        outcomes = list(pool.map(lambda job: fetch(*job), jobs))
+        elapsed = time.perf_counter() - start
+      results[name] = summarize([ms for ms, _ in outcomes], elapsed, counter['queries'],
+                                sum(1 for _, ok in outcomes if not ok))
+  finally:
+    server.shutdown()
+  return results
+
+
+def git_revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                   stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def compare(report, baseline):
+  print('%-28s %-12s %12s %12s %9s %12s' % ('route', 'mode', 'p95 before', 'p95 after', 'change', 'queries'))
+  for mode, routes in report['results'].items():
+    for name, after in routes.items():
+      before = baseline['results'].get(mode, {}).get(name)
+      if not before:
+        continue
+      change = (after['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+      print('%-28s %-12s %12.2f %12.2f %+8.1f%% %5.1f -> %4.1f' % (
+        name, mode, before['p95_ms'], after['p95_ms'], change,
+        before['queries_per_request'], after['queries_per_request']))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Load test for every Fyyur route.')
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--artists', type=int, default=1000)
+  parser.add_argument('--shows', type=int, default=10000)
+  parser.add_argument('--requests', type=int, default=200, help='requests per route')
+  parser.add_argument('--concurrency', type=int, default=8, help='client threads for the WSGI run')
+  parser.add_argument('--mode', choices=['test-client', 'wsgi', 'both'], default='both')
+  parser.add_argument('--output', help='write the JSON report to this file')
+  parser.add_argument('--compare', help='JSON report of an earlier run to compare with')
+  args = parser.parse_args()
+
+  app.config['WTF_CSRF_ENABLED'] = False
+  ctx = setup_database()
+  seed(venues=args.venues, artists=args.artists, shows=args.shows)
+  db.session.remove()
+  rnd = random.Random(0)
+  routes = get_routes(args.venues, args.artists, rnd)
+
+  report = {
+    'revision': git_revision(),
+    'database': db.engine.dialect.name,
+    'venues': args.venues,
+    'artists': args.artists,
+    'shows': args.shows,
+    'requests_per_route': args.requests,
+    'concurrency': args.concurrency,
+    'results': {},
+  }
+  if args.mode in ('test-client', 'both'):
+    report['results']['test-client'] = run_test_client(routes, args.requests)
+  if args.mode in ('wsgi', 'both'):
+    report['results']['wsgi'] = run_wsgi(routes, args.requests, args.concurrency)
+  ctx.pop()
+
+  output = json.dumps(report, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, 'w') as f:
+      f.write(output + '\n')
+  if args.compare:
+    with open(args.compare) as f:
+      compare(report, json.load(f))
+  elif not args.output:
+    print(output)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,39 @@
+#----------------------------------------------------------------------------#
+# Compares the ranked, paged search against the old unbounded ILIKE path.
+# On postgres run the migrations first so that the trigram indexes exist.
+#
+#   python -m benchmarks.search [number of venues]
+#----------------------------------------------------------------------------#
+
+import sys
+
+from app import app, db, Venue, search_entities
+from benchmarks.common import setup_database, seed, measure
+
+TERMS = ['Venue 4', 'nue 12', 'City 3, CA', 'xyz']
+
+
+def legacy_search(search_term):
+  # the implementation of search_venues() before the search subsystem
+  venues = Venue.query.filter(Venue.name.ilike('%' + search_term + '%')).all()
+  return {
+    "count": len(venues),
+    "data": [{"id": venue.id, "name": venue.name, "num_upcoming_shows": 0}
+             for venue in venues]
+  }
+
+
+def main(size):
+  ctx = setup_database()
+  seed(venues=size, artists=max(1, size // 10), shows=size * 3)
+
+  print('%14s %10s %10s %10s' % ('term', 'legacy ms', 'ranked ms', 'queries'))
+  for term in TERMS:
+    legacy_ms, _ = measure(lambda: legacy_search(term))
+    ranked_ms, queries = measure(lambda: search_entities(Venue, term))
+    print('%14s %10.1f %10.1f %10d' % (term, legacy_ms, ranked_ms, queries))
+  ctx.pop()
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
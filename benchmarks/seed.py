@@ -0,0 +1,30 @@
+#----------------------------------------------------------------------------#
+# Seeds the benchmark database with synthetic venues, artists and shows.
+# Drops and recreates all tables of FYYUR_BENCH_DATABASE_URI first.
+#
+#   python -m benchmarks.seed --venues 10000 --artists 10000 --shows 100000
+#----------------------------------------------------------------------------#
+
+import argparse
+
+from benchmarks.common import setup_database, seed
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--artists', type=int, default=1000)
+  parser.add_argument('--shows', type=int, default=10000)
+  parser.add_argument('--cities', type=int, default=None)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  ctx = setup_database()
+  seed(venues=args.venues, artists=args.artists, shows=args.shows,
+       cities=args.cities, seed=args.seed)
+  ctx.pop()
+  print('seeded %d venues, %d artists, %d shows' % (args.venues, args.artists, args.shows))
+
+
+if __name__ == '__main__':
+  main()
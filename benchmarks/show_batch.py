@@ -0,0 +1,58 @@
+#----------------------------------------------------------------------------#
+# Creating a tour of shows through POST /api/v1/shows in one request against
+# one /shows/create form post per show, and the replay of the batch under
+# its Idempotency-Key.
+#
+#   python -m benchmarks.show_batch [shows per tour]
+#----------------------------------------------------------------------------#
+
+import random
+import sys
+from datetime import datetime, timedelta
+
+from app import app, db, Show, check_show_counters
+from benchmarks.common import setup_database, seed, measure
+
+
+def make_tour(size, rnd, start):
+  # one artist playing a different venue every day
+  artist_id = rnd.randint(1, 1000)
+  return [{
+    'venue_id': rnd.randint(1, 1000),
+    'artist_id': artist_id,
+    'start_time': (start + timedelta(days=day, hours=rnd.randint(0, 3))).isoformat(),
+  } for day in range(size)]
+
+
+def main(size):
+  ctx = setup_database()
+  seed(venues=1000, artists=1000, shows=20000)
+  app.config['JOBS_WORKERS'] = 0
+  app.config['WTF_CSRF_ENABLED'] = False
+  client = app.test_client()
+  rnd = random.Random(0)
+  # far enough ahead to not collide with the seeded shows
+  start = datetime.now().replace(hour=18, minute=0, second=0, microsecond=0) + timedelta(days=3650)
+
+  tour = make_tour(size, rnd, start)
+  forms_ms, form_queries = measure(lambda: [
+    client.post('/shows/create', data=dict(show, start_time=show['start_time'].replace('T', ' ')))
+    for show in tour], repeat=1)
+
+  tour = make_tour(size, rnd, start + timedelta(days=2 * size))
+  batch_ms, batch_queries = measure(lambda: client.post(
+    '/api/v1/shows', json={'shows': tour}, headers={'Idempotency-Key': 'tour'}), repeat=1)
+  replay_ms, replay_queries = measure(lambda: client.post(
+    '/api/v1/shows', json={'shows': tour}, headers={'Idempotency-Key': 'tour'}), repeat=1)
+
+  print('%d shows' % size)
+  print('%20s %10.1f ms %6d queries' % ('one form per show', forms_ms, form_queries))
+  print('%20s %10.1f ms %6d queries' % ('batch', batch_ms, batch_queries))
+  print('%20s %10.1f ms %6d queries' % ('replayed batch', replay_ms, replay_queries))
+  print('%d shows in total, counters %s' % (
+    Show.query.count(), 'consistent' if not check_show_counters() else 'WRONG'))
+  ctx.pop()
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,86 @@
+#----------------------------------------------------------------------------#
+# Calendar range queries over millions of shows: the bounded range on
+# start_time (calendar_query) against the plain overlap test
+# start_time < end AND end_time > start, which the index can only bound on
+# one side. Also times the overlap check of a batch of new shows.
+#
+#   python -m benchmarks.show_calendar --shows 1000000
+#----------------------------------------------------------------------------#
+
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from app import (app, db, Show, Venue, Artist, calendar_query, find_show_conflicts,
+                 get_calendar_range, get_show_end_time)
+from benchmarks.common import setup_database, seed, measure
+
+
+def overlap_query(start, end, venue_id=None, artist_id=None, limit=None):
+  # the same shows without the lower bound on start_time
+  query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.end_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name')
+    ).join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .filter(Show.start_time < end, Show.end_time > start)
+  if venue_id is not None:
+    query = query.filter(Show.venue_id == venue_id)
+  if artist_id is not None:
+    query = query.filter(Show.artist_id == artist_id)
+  return query.order_by(Show.start_time, Show.id).limit(limit + 1)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Calendar range queries.')
+  parser.add_argument('--venues', type=int, default=5000)
+  parser.add_argument('--artists', type=int, default=5000)
+  parser.add_argument('--shows', type=int, default=1000000)
+  parser.add_argument('--samples', type=int, default=20)
+  args = parser.parse_args()
+
+  ctx = setup_database()
+  seed(venues=args.venues, artists=args.artists, shows=args.shows)
+  if db.engine.dialect.name == 'postgresql':
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+  rnd = random.Random(0)
+  now = datetime.now()
+  limit = app.config['CALENDAR_MAX_SHOWS']
+
+  print('%8s %6s %10s %12s %12s' % ('scope', 'view', 'shows', 'bounded ms', 'overlap ms'))
+  for scope in ('all', 'venue', 'artist'):
+    for view in ('day', 'week', 'month'):
+      found = 0
+      bounded_total = overlap_total = 0.0
+      for _ in range(args.samples):
+        start, end = get_calendar_range(view, now + timedelta(days=rnd.randint(-300, 300)))
+        venue_id = rnd.randint(1, args.venues) if scope == 'venue' else None
+        artist_id = rnd.randint(1, args.artists) if scope == 'artist' else None
+        bounded_ms, _ = measure(lambda: calendar_query(start, end, venue_id, artist_id, limit).all(), repeat=3)
+        overlap_ms, _ = measure(lambda: overlap_query(start, end, venue_id, artist_id, limit).all(), repeat=3)
+        bounded_total += bounded_ms
+        overlap_total += overlap_ms
+        found += min(limit, len(calendar_query(start, end, venue_id, artist_id, limit).all()))
+      print('%8s %6s %10d %12.2f %12.2f' % (
+        scope, view, found // args.samples, bounded_total / args.samples,
+        overlap_total / args.samples))
+
+  shows = []
+  for _ in range(100):
+    start_time = now + timedelta(days=rnd.randint(1, 300), hours=rnd.randint(0, 23))
+    shows.append({'venue_id': rnd.randint(1, args.venues), 'artist_id': rnd.randint(1, args.artists),
+                  'start_time': start_time, 'end_time': get_show_end_time(start_time)})
+  conflicts_ms, queries = measure(lambda: find_show_conflicts(shows))
+  print('overlap check of 100 new shows: %.1f ms, %d queries, %d conflicts' % (
+    conflicts_ms, queries, sum(1 for found in find_show_conflicts(shows) if found)))
+  ctx.pop()
+
+
+if __name__ == '__main__':
+  main()
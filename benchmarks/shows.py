@@ -0,0 +1,34 @@
+#----------------------------------------------------------------------------#
+# Compares the latency of the first and of deep /shows pages.
+#
+#   python -m benchmarks.shows [number of shows]
+#----------------------------------------------------------------------------#
+
+import sys
+
+from app import app, db, Show, get_shows_page, encode_show_cursor
+from benchmarks.common import setup_database, seed, measure
+
+
+def main(size):
+  ctx = setup_database()
+  seed(venues=1000, artists=1000, shows=size)
+  per_page = app.config['SHOWS_PER_PAGE']
+
+  print('%10s %10s %10s' % ('page', 'ms', 'queries'))
+  pages = [1, 10, 100, 1000, 5000]
+  for page in pages:
+    offset = (page - 1) * per_page
+    if offset >= size:
+      break
+    after = None
+    if offset:
+      last = Show.query.order_by(Show.start_time, Show.id).offset(offset - 1).first()
+      after = encode_show_cursor(last.start_time, last.id)
+    ms, queries = measure(lambda: get_shows_page(after=after))
+    print('%10d %10.1f %10d' % (page, ms, queries))
+  ctx.pop()
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,60 @@
+#----------------------------------------------------------------------------#
+# Compares the current /venues query against the old per-venue loop.
+#
+#   python -m benchmarks.venues [venue counts...]
+#----------------------------------------------------------------------------#
+
+import sys
+from datetime import datetime
+
+from app import app, db, Venue, Show, get_venue_areas
+from benchmarks.common import setup_database, seed, measure
+
+
+def legacy_venue_areas():
+  # the implementation of venues() before the grouped query
+  data = []
+  venues = Venue.query.all()
+  venue_cities = set()
+  for venue in venues:
+    venue_cities.add((venue.city, venue.state))
+  for location in venue_cities:
+    data.append({"city": location[0], "state": location[1], "venues": []})
+  for venue in venues:
+    num_upcoming_shows = 0
+    shows = Show.query.filter_by(venue_id=venue.id).all()
+    for show in shows:
+      if show.start_time > datetime.now():
+        num_upcoming_shows += 1
+    for entry in data:
+      if venue.city == entry['city'] and venue.state == entry['state']:
+        entry['venues'].append({
+          "id": venue.id,
+          "name": venue.name,
+          "num_upcoming_shows": num_upcoming_shows
+        })
+  return data
+
+
+def main(sizes):
+  ctx = setup_database()
+  print('%10s %12s %10s %12s %10s' % ('venues', 'legacy ms', 'queries', 'current ms', 'queries'))
+  for size in sizes:
+    db.drop_all()
+    db.create_all()
+    seed(venues=size, artists=max(1, size // 10), shows=size * 3)
+
+    # the legacy loop is far too slow beyond 10k venues
+    if size <= 10000:
+      legacy_ms, legacy_queries = measure(legacy_venue_areas, repeat=1)
+    else:
+      legacy_ms, legacy_queries = float('nan'), size + 1
+    current_ms, current_queries = measure(get_venue_areas)
+
+    print('%10d %12.1f %10d %12.1f %10d' % (
+      size, legacy_ms, legacy_queries, current_ms, current_queries))
+  ctx.pop()
+
+
+if __name__ == '__main__':
+  main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,223 @@
+#----------------------------------------------------------------------------#
+# Page cache and its storage backends.
+#----------------------------------------------------------------------------#
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheBackend(object):
+  # Storage interface used by PageCache. Keys are strings, values are any
+  # picklable object, entries expire after ttl seconds. shared backends are
+  # seen by all worker processes.
+
+  shared = False
+
+  def get(self, key):
+    raise NotImplementedError
+
+  def set(self, key, value):
+    raise NotImplementedError
+
+  def delete(self, key):
+    raise NotImplementedError
+
+  def delete_prefix(self, prefix):
+    raise NotImplementedError
+
+  def clear(self):
+    raise NotImplementedError
+
+  def stats(self):
+    raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+  # Bounded LRU + TTL cache private to the current process.
+
+  def __init__(self, maxsize=1024, ttl=300):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        expires_at, value = entry
+        if expires_at > time.time():
+          self._entries.move_to_end(key)
+          self.hits += 1
+          return value
+        del self._entries[key]
+      self.misses += 1
+      return None
+
+  def set(self, key, value):
+    with self._lock:
+      self._entries[key] = (time.time() + self.ttl, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def delete(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def delete_prefix(self, prefix):
+    with self._lock:
+      for key in [key for key in self._entries if key.startswith(prefix)]:
+        del self._entries[key]
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self):
+    with self._lock:
+      return {
+        "backend": "memory",
+        "size": len(self._entries),
+        "maxsize": self.maxsize,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+      }
+
+
+class SQLiteBackend(CacheBackend):
+  # Bounded LRU + TTL cache in a local sqlite file shared by every worker
+  # process on the machine. Deletes are seen by all processes at once, so
+  # invalidating after a commit in one worker invalidates it everywhere.
+  # Hit/miss/eviction counters are per process.
+
+  shared = True
+
+  def __init__(self, path, maxsize=1024, ttl=300):
+    self.path = path
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._local = threading.local()
+    with self._connection() as conn:
+      conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                   'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                   'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+      conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at)')
+
+  def _connection(self):
+    # one connection per thread (and per process, after a fork)
+    conn = getattr(self._local, 'conn', None)
+    if conn is None or self._local.pid != os.getpid():
+      conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+      conn.execute('PRAGMA journal_mode=WAL')
+      conn.execute('PRAGMA synchronous=NORMAL')
+      self._local.conn = conn
+      self._local.pid = os.getpid()
+    return conn
+
+  def get(self, key):
+    conn = self._connection()
+    now = time.time()
+    row = conn.execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+    if row is not None:
+      if row[1] > now:
+        conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return pickle.loads(row[0])
+      conn.execute('DELETE FROM cache WHERE key = ? AND expires_at <= ?', (key, now))
+    self.misses += 1
+    return None
+
+  def set(self, key, value):
+    conn = self._connection()
+    now = time.time()
+    conn.execute('INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) '
+                 'VALUES (?, ?, ?, ?)',
+                 (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + self.ttl, now))
+    evicted = conn.execute('DELETE FROM cache WHERE key IN ('
+                           'SELECT key FROM cache ORDER BY accessed_at '
+                           'LIMIT max(0, (SELECT count(*) FROM cache) - ?))',
+                           (self.maxsize,)).rowcount
+    self.evictions += max(evicted, 0)
+
+  def delete(self, key):
+    self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+  def delete_prefix(self, prefix):
+    self._connection().execute('DELETE FROM cache WHERE substr(key, 1, ?) = ?',
+                               (len(prefix), prefix))
+
+  def clear(self):
+    self._connection().execute('DELETE FROM cache')
+
+  def stats(self):
+    size = self._connection().execute('SELECT count(*) FROM cache').fetchone()[0]
+    return {
+      "backend": "sqlite",
+      "size": size,
+      "maxsize": self.maxsize,
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+    }
+
+
+def create_backend(config):
+  # builds the backend selected by CACHE_BACKEND
+  if config['CACHE_BACKEND'] == 'sqlite':
+    return SQLiteBackend(config['CACHE_SQLITE_PATH'],
+                         maxsize=config['PAGE_CACHE_SIZE'],
+                         ttl=config['PAGE_CACHE_TTL'])
+  if config['CACHE_BACKEND'] == 'memory':
+    return MemoryBackend(maxsize=config['PAGE_CACHE_SIZE'],
+                         ttl=config['PAGE_CACHE_TTL'])
+  raise ValueError('unknown CACHE_BACKEND %r' % config['CACHE_BACKEND'])
+
+
+class PageCache(object):
+  # Cache for page data on top of a CacheBackend.
+  #
+  # Every entry remembers the "now" bucket (now // bucket_seconds) it was
+  # built in and is only served within that bucket, so pages that split
+  # shows into past/upcoming never lag behind the clock by more than one
+  # bucket. Writes are expected to call invalidate() for the keys they touch.
+
+  def __init__(self, backend, bucket_seconds=60):
+    self.backend = backend
+    self.bucket_seconds = bucket_seconds
+
+  def now_bucket(self):
+    return int(time.time() // self.bucket_seconds)
+
+  def get(self, key):
+    entry = self.backend.get(key)
+    if entry is None or entry[0] != self.now_bucket():
+      return None
+    return entry[1]
+
+  def set(self, key, value):
+    self.backend.set(key, (self.now_bucket(), value))
+
+  def invalidate(self, key):
+    self.backend.delete(key)
+
+  def invalidate_prefix(self, prefix):
+    self.backend.delete_prefix(prefix)
+
+  def clear(self):
+    self.backend.clear()
+
+  def stats(self):
+    return self.backend.stats()
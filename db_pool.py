@@ -0,0 +1,185 @@
+#----------------------------------------------------------------------------#
+# Database connection pool: engine options and pool metrics.
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+def get_pool_options(config, drivername):
+  # create_engine() options from the DB_POOL_* / DB_STATEMENT_TIMEOUT_MS
+  # settings. sqlite keeps the pooling chosen by Flask-SQLAlchemy.
+  if drivername.startswith('sqlite'):
+    return {}
+
+  options = {
+    'poolclass': InstrumentedQueuePool,
+    'pool_size': config['DB_POOL_SIZE'],
+    'max_overflow': config['DB_POOL_MAX_OVERFLOW'],
+    'pool_timeout': config['DB_POOL_TIMEOUT'],
+    'pool_recycle': config['DB_POOL_RECYCLE'],
+    'pool_pre_ping': config['DB_POOL_PRE_PING'],
+  }
+  if drivername.startswith('postgresql') and config['DB_STATEMENT_TIMEOUT_MS']:
+    options['connect_args'] = {
+      'options': '-c statement_timeout=%d' % config['DB_STATEMENT_TIMEOUT_MS']
+    }
+  return options
+
+
+class PoolMetrics(object):
+  # Per engine counters for connection checkouts: how long requests waited
+  # for a connection, how often the pool had to overflow and how often it
+  # timed out. Slow waits, overflows and timeouts are also logged.
+  #
+  # Connections opened and closed, checkouts and checkins come from the
+  # public pool events of every watched engine, the primary and each
+  # replica alike. The pool events fire only once a connection was handed
+  # out, so the time spent waiting for one and the timeouts are measured by
+  # InstrumentedQueuePool around Pool.connect() instead.
+
+  def __init__(self):
+    self.logger = None
+    self.slow_wait_ms = 100
+    self.engines = {}
+    self._lock = threading.Lock()
+    self.reset()
+
+  def init_app(self, app):
+    self.logger = app.logger
+    self.slow_wait_ms = app.config['DB_POOL_SLOW_WAIT_MS']
+
+  def reset(self):
+    with self._lock:
+      self.counters = dict((name, self.new_counters(self.counters[name]['open']))
+                           for name in getattr(self, 'counters', {}))
+
+  def new_counters(self, open=0):
+    return {
+      'open': open,
+      'connects': 0,
+      'checkouts': 0,
+      'checkins': 0,
+      'overflows': 0,
+      'timeouts': 0,
+      'slow_waits': 0,
+      'wait_ms_total': 0.0,
+      'wait_ms_max': 0.0,
+      'waits': 0,
+    }
+
+  def watch(self, engine, name):
+    # reports the pool of engine as name; called for every engine handed
+    # out, so it has to be cheap once the engine is watched
+    if self.engines.get(name) is engine:
+      return
+    with self._lock:
+      if self.engines.get(name) is engine:
+        return
+      self.engines[name] = engine
+      self.counters[name] = self.new_counters()
+    pool = engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+      pool.metrics_name = name
+    event.listen(pool, 'connect', lambda *args: self.record_connect(name))
+    event.listen(pool, 'close', lambda *args: self.record_close(name))
+    event.listen(pool, 'detach', lambda *args: self.record_close(name))
+    event.listen(pool, 'checkout', lambda *args: self.record_event(name, 'checkouts'))
+    event.listen(pool, 'checkin', lambda *args: self.record_event(name, 'checkins'))
+
+  def record_connect(self, name):
+    # a connection opened beyond pool_size is an overflow. The pool's own
+    # overflow() moves under other threads between any two reads of it, so
+    # the decision is taken on our count of open connections, under our lock
+    pool = self.engines[name].pool
+    with self._lock:
+      counters = self.counters[name]
+      counters['open'] += 1
+      counters['connects'] += 1
+      overflowed = isinstance(pool, QueuePool) and counters['open'] > pool.size()
+      if overflowed:
+        counters['overflows'] += 1
+    if self.logger and overflowed:
+      self.logger.info('database pool %s overflowed', name)
+
+  def record_close(self, name):
+    with self._lock:
+      self.counters[name]['open'] -= 1
+
+  def record_event(self, name, counter):
+    with self._lock:
+      self.counters[name][counter] += 1
+
+  def record_wait(self, name, wait_ms):
+    with self._lock:
+      counters = self.counters[name]
+      counters['waits'] += 1
+      counters['wait_ms_total'] += wait_ms
+      counters['wait_ms_max'] = max(counters['wait_ms_max'], wait_ms)
+      if wait_ms >= self.slow_wait_ms:
+        counters['slow_waits'] += 1
+    if self.logger and wait_ms >= self.slow_wait_ms:
+      self.logger.warning('waited %.1f ms for a %s database connection', wait_ms, name)
+
+  def record_timeout(self, name, wait_ms):
+    with self._lock:
+      self.counters[name]['timeouts'] += 1
+    if self.logger:
+      self.logger.error('timed out after %.1f ms waiting for a %s database connection',
+                        wait_ms, name)
+
+  def stats(self):
+    # {engine name: counters and, for queue pools, the pool's gauges}
+    with self._lock:
+      counters = dict((name, dict(values)) for name, values in self.counters.items())
+      engines = dict(self.engines)
+    stats = {}
+    for name, values in sorted(counters.items()):
+      waits = values.pop('waits')
+      stats[name] = dict(values,
+        wait_ms_total=round(values['wait_ms_total'], 3),
+        wait_ms_avg=round(values['wait_ms_total'] / waits, 3) if waits else 0.0,
+        wait_ms_max=round(values['wait_ms_max'], 3))
+      pool = engines[name].pool
+      if isinstance(pool, QueuePool):
+        stats[name].update({
+          "size": pool.size(),
+          "checked_in": pool.checkedin(),
+          "checked_out": pool.checkedout(),
+          "overflow": max(pool.overflow(), 0),
+        })
+    return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+  # QueuePool that times Pool.connect(), the wait for a connection
+  # including a pre-ping, and reports it and timeouts to pool_metrics.
+  # SQLAlchemy has no event for a checkout that starts waiting or one that
+  # gives up, hence the subclass; everything else is counted by the pool
+  # events in PoolMetrics.watch().
+
+  metrics_name = None
+
+  def connect(self):
+    start = time.perf_counter()
+    try:
+      connection = super(InstrumentedQueuePool, self).connect()
+    except exc.TimeoutError:
+      if self.metrics_name:
+        pool_metrics.record_timeout(self.metrics_name, (time.perf_counter() - start) * 1000)
+      raise
+    if self.metrics_name:
+      pool_metrics.record_wait(self.metrics_name, (time.perf_counter() - start) * 1000)
+    return connection
+
+  def recreate(self):
+    # engine.dispose() replaces the pool, the new one keeps reporting
+    pool = super(InstrumentedQueuePool, self).recreate()
+    pool.metrics_name = self.metrics_name
+    return pool
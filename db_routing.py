@@ -0,0 +1,71 @@
+#----------------------------------------------------------------------------#
+# Read-replica routing. GET/HEAD requests read from one of the replica binds
+# ('replica0', 'replica1', ... in SQLALCHEMY_BINDS, see DB_REPLICA_URIS),
+# everything else goes to the primary. Flushes, INSERT/UPDATE/DELETE and
+# SELECT ... FOR UPDATE always go to the primary and keep the rest of the
+# request there. A client that wrote is pinned to the primary for
+# DB_REPLICA_PIN_SECONDS so that it reads its own writes.
+#----------------------------------------------------------------------------#
+
+import random
+import time
+
+from flask import request, session
+from flask_sqlalchemy import SignallingSession
+
+
+def is_write(clause):
+  return clause is not None and (getattr(clause, 'is_dml', False) or
+                                 getattr(clause, '_for_update_arg', None) is not None)
+
+
+class RoutingSession(SignallingSession):
+  # session.info['replica'] names the bind reads go to, set per request by
+  # ReplicaRouter; without it the session behaves like SignallingSession
+
+  def __init__(self, db, **options):
+    self.db = db
+    super(RoutingSession, self).__init__(db, **options)
+
+  def get_bind(self, mapper=None, clause=None, **kw):
+    if self._flushing or is_write(clause):
+      self.info['wrote'] = True
+      self.info.pop('replica', None)
+    replica = self.info.get('replica')
+    if replica is None:
+      return super(RoutingSession, self).get_bind(mapper, clause)
+    return self.db.get_engine(self.app, bind=replica)
+
+
+class ReplicaRouter(object):
+
+  def __init__(self):
+    self.db = None
+    self.config = {}
+    self.replicas = []
+
+  def init_app(self, app, db):
+    self.db = db
+    self.config = app.config
+    self.replicas = sorted(bind for bind in app.config['SQLALCHEMY_BINDS'] or {}
+                           if bind.startswith('replica'))
+    if not self.replicas:
+      return
+    app.before_request(self.start_request)
+    app.after_request(self.finish_request)
+
+  def start_request(self):
+    if request.method not in ('GET', 'HEAD'):
+      return
+    if session.get('primary_until', 0) > time.time():
+      return
+    # one replica for the whole request, so its reads are consistent
+    self.db.session.info['replica'] = random.choice(self.replicas)
+
+  def finish_request(self, response):
+    if self.db.session.info.get('wrote'):
+      session['primary_until'] = time.time() + self.config['DB_REPLICA_PIN_SECONDS']
+    return response
+
+
+replica_router = ReplicaRouter()
@@ -0,0 +1,71 @@
+#----------------------------------------------------------------------------#
+# Streaming helpers for the catalog export: rows to CSV / JSON Lines chunks
+# and incremental gzip. The output uses the same layout as the bulk import
+# reads (see importer.py).
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+
+FORMATS = ('csv', 'jsonl')
+MIMETYPES = {
+  'csv': 'text/csv',
+  'jsonl': 'application/x-ndjson',
+}
+
+# what the import's forms parse (DateTimeField's default format), whole seconds
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# bytes collected before a chunk is handed on
+CHUNK_SIZE = 64 * 1024
+
+
+def to_json_value(value):
+  if isinstance(value, datetime):
+    return value.strftime(DATETIME_FORMAT)
+  if isinstance(value, date):
+    return value.isoformat()
+  return value
+
+
+def to_csv_value(value):
+  if value is None:
+    return ''
+  if isinstance(value, (list, tuple)):
+    return ';'.join(str(item) for item in value)
+  if isinstance(value, datetime):
+    return value.strftime(DATETIME_FORMAT)
+  return value
+
+
+def encode_rows(rows, columns, fmt):
+  # yields utf-8 chunks of about CHUNK_SIZE bytes for an iterable of tuples
+  buffer = io.StringIO()
+  if fmt == 'csv':
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+  for row in rows:
+    if fmt == 'csv':
+      writer.writerow([to_csv_value(value) for value in row])
+    else:
+      buffer.write(json.dumps({column: to_json_value(value) for column, value in zip(columns, row)}))
+      buffer.write('\n')
+    if buffer.tell() >= CHUNK_SIZE:
+      yield buffer.getvalue().encode('utf-8')
+      buffer.seek(0)
+      buffer.truncate()
+  if buffer.tell():
+    yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+  # gzip-compresses a stream of byte chunks without buffering it
+  compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  for chunk in chunks:
+    data = compressor.compress(chunk)
+    if data:
+      yield data
+  yield compressor.flush()
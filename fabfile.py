@@ -7,12 +7,19 @@ from fabric.contrib.console import confirm
 def test():
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m pytest -q && python -m benchmarks.detail_pages"
+            " && python -m benchmarks.query_plans"
+            " && python -m benchmarks.replicas",
+            capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def assets():
+    local("FLASK_APP=app.py flask build-assets")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -24,6 +31,7 @@ def push():
 
 def prepare():
     test()
+    assets()
     commit()
     push()
 
@@ -47,6 +55,7 @@ def heroku_test():
 def deploy():
     pull()
     test()
+    assets()
     commit()
     heroku()
     heroku_test()
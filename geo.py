@@ -0,0 +1,148 @@
+#----------------------------------------------------------------------------#
+# Offline geocoding and the geohash grid behind the "near" queries.
+#
+# Venues are placed by city/state from a bundled gazetteer (a CSV of
+# city,state,latitude,longitude; rows without a city are the state
+# centroids used when the city is unknown), nothing is sent to a web
+# service. Their position is also stored as a geohash: latitude and
+# longitude quantized to GEOHASH_BITS bits each and interleaved, longitude
+# first. Every geohash prefix is a square-ish grid cell and the codes of a
+# cell form one contiguous integer range, so the cells covering a search
+# box become a few BETWEEN conditions on a plain B-tree index.
+#----------------------------------------------------------------------------#
+
+import csv
+import math
+import re
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_MILE = 1.609344
+# bits per axis, the interleaved code of 2 * 26 bits fits a BIGINT
+GEOHASH_BITS = 26
+
+
+def normalize_place(name):
+  # 'St. Louis', 'saint louis' and ' Saint  Louis' are the same place
+  name = re.sub(r'\s+', ' ', (name or '').strip().lower().replace('.', ' ')).strip()
+  return re.sub(r'^(st|ste) ', 'saint ', name)
+
+
+class Gazetteer(object):
+  # (city, state) -> (latitude, longitude), loaded on first use
+
+  def __init__(self):
+    self.path = None
+    self.places = None
+
+  def init_app(self, app):
+    self.path = app.config['GEO_GAZETTEER_PATH']
+    self.places = None
+
+  def load(self):
+    places = {}
+    with open(self.path, newline='', encoding='utf-8') as stream:
+      for row in csv.DictReader(stream):
+        key = (normalize_place(row['city']), row['state'].strip().upper())
+        places[key] = (float(row['latitude']), float(row['longitude']))
+    self.places = places
+    return places
+
+  def lookup(self, city, state):
+    # the city's coordinates, the state's centroid for unknown cities or
+    # None for unknown states
+    places = self.places if self.places is not None else self.load()
+    state = (state or '').strip().upper()
+    return places.get((normalize_place(city), state)) or places.get(('', state))
+
+
+gazetteer = Gazetteer()
+
+
+def spread_bits(value):
+  # 0b1011 -> 0b1000101, room for the bits of the other axis
+  value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+  value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+  value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+  value = (value | (value << 2)) & 0x3333333333333333
+  value = (value | (value << 1)) & 0x5555555555555555
+  return value
+
+
+def quantize(value, low, high, bits=GEOHASH_BITS):
+  cell = int((value - low) / (high - low) * (1 << bits))
+  return min(max(cell, 0), (1 << bits) - 1)
+
+
+def interleave(x, y):
+  return (spread_bits(x) << 1) | spread_bits(y)
+
+
+def encode_geohash(latitude, longitude):
+  return interleave(quantize(longitude, -180.0, 180.0), quantize(latitude, -90.0, 90.0))
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+  # great circle distance (haversine)
+  lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+  a = (math.sin((lat2 - lat1) / 2) ** 2 +
+       math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def split_box(south, west, north, east):
+  # boxes crossing the antimeridian (west > east) become two boxes. Boxes
+  # are (south, west, north, east, shift), shift being the degrees to add to
+  # a longitude inside the box to bring it next to the box's origin.
+  if west <= east:
+    return [(south, west, north, east, 0.0)]
+  return [(south, west, north, 180.0, 0.0), (south, -180.0, north, east, 360.0)]
+
+
+def radius_boxes(latitude, longitude, radius_km):
+  # the boxes enclosing a circle, see split_box
+  angle = radius_km / EARTH_RADIUS_KM
+  south = latitude - math.degrees(angle)
+  north = latitude + math.degrees(angle)
+  if south <= -90.0 or north >= 90.0 or angle >= math.pi / 2:
+    # the circle covers a pole
+    return [(max(south, -90.0), -180.0, min(north, 90.0), 180.0, 0.0)]
+  delta = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(latitude)))))
+  west, east = longitude - delta, longitude + delta
+  if west < -180.0:
+    return [(south, west + 360.0, north, 180.0, -360.0), (south, -180.0, north, east, 0.0)]
+  if east > 180.0:
+    return [(south, west, north, 180.0, 0.0), (south, -180.0, north, east - 360.0, 360.0)]
+  return [(south, west, north, east, 0.0)]
+
+
+def geohash_ranges(south, west, north, east, max_cells=16):
+  # [(low, high)] inclusive geohash ranges of the grid cells covering the
+  # box, at the finest level that needs at most max_cells cells
+  x_low, x_high = quantize(west, -180.0, 180.0), quantize(east, -180.0, 180.0)
+  y_low, y_high = quantize(south, -90.0, 90.0), quantize(north, -90.0, 90.0)
+  level = GEOHASH_BITS
+  while level > 0:
+    shift = GEOHASH_BITS - level
+    width = (x_high >> shift) - (x_low >> shift) + 1
+    height = (y_high >> shift) - (y_low >> shift) + 1
+    if width * height <= max_cells:
+      break
+    level -= 1
+  shift = GEOHASH_BITS - level
+  span = 1 << (2 * shift)
+
+  ranges = []
+  for x in range(x_low >> shift, (x_high >> shift) + 1):
+    for y in range(y_low >> shift, (y_high >> shift) + 1):
+      low = interleave(x, y) * span
+      ranges.append((low, low + span - 1))
+  ranges.sort()
+
+  # neighbouring cells are often adjacent on the curve too
+  merged = [ranges[0]]
+  for low, high in ranges[1:]:
+    if low == merged[-1][1] + 1:
+      merged[-1] = (merged[-1][0], high)
+    else:
+      merged.append((low, high))
+  return merged
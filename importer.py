@@ -0,0 +1,122 @@
+#----------------------------------------------------------------------------#
+# Streaming helpers for the bulk import: reading CSV / JSON Lines input,
+# batching, error reports and postgres COPY.
+#----------------------------------------------------------------------------#
+
+import codecs
+import csv
+import io
+import json
+from datetime import datetime
+from itertools import islice
+
+FORMATS = ('csv', 'jsonl')
+
+
+class ImportFileError(Exception):
+  # the import source cannot be read
+  pass
+
+
+def detect_format(filename, default='csv'):
+  if filename and filename.lower().endswith(('.jsonl', '.ndjson')):
+    return 'jsonl'
+  if filename and filename.lower().endswith('.csv'):
+    return 'csv'
+  return default
+
+
+def read_rows(stream, fmt):
+  # yields (row number, dict) from a binary or text stream without reading
+  # it all into memory. List values in CSV are separated by ";".
+  if fmt not in FORMATS:
+    raise ImportFileError('unknown import format %r' % fmt)
+  if isinstance(stream.read(0), bytes):
+    stream = codecs.getreader('utf-8')(stream)
+
+  if fmt == 'csv':
+    for number, row in enumerate(csv.DictReader(stream), 1):
+      yield number, {key: value for key, value in row.items() if key is not None}
+  else:
+    number = 0
+    for line in stream:
+      if not line.strip():
+        continue
+      number += 1
+      try:
+        row = json.loads(line)
+      except ValueError as e:
+        row = {'__error__': 'invalid JSON: %s' % e}
+      yield number, row
+
+
+def batched(iterable, size):
+  iterator = iter(iterable)
+  while True:
+    batch = list(islice(iterator, size))
+    if not batch:
+      return
+    yield batch
+
+
+def split_list(value):
+  # genres arrive as a JSON list or a ";" separated string
+  if value is None:
+    return []
+  if isinstance(value, (list, tuple)):
+    return [str(item).strip() for item in value if str(item).strip()]
+  return [item.strip() for item in str(value).split(';') if item.strip()]
+
+
+class ErrorReport(object):
+  # collects rejected rows: written to a CSV file as they come in when a
+  # path is given, otherwise only the first `keep` are kept in memory
+
+  def __init__(self, path=None, keep=100):
+    self.count = 0
+    self.keep = keep
+    self.errors = []
+    self._file = open(path, 'w', newline='') if path else None
+    self._writer = csv.writer(self._file) if self._file else None
+    if self._writer:
+      self._writer.writerow(['row', 'error'])
+
+  def add(self, number, message):
+    self.count += 1
+    if self._writer:
+      self._writer.writerow([number, message])
+    if len(self.errors) < self.keep:
+      self.errors.append({'row': number, 'error': message})
+
+  def close(self):
+    if self._file:
+      self._file.close()
+
+
+def format_copy_value(value):
+  if value is None:
+    return '\\N'
+  if isinstance(value, bool):
+    return 't' if value else 'f'
+  if isinstance(value, datetime):
+    return value.isoformat(' ')
+  if isinstance(value, (list, tuple)):
+    # postgres array literal
+    return '{%s}' % ','.join('"%s"' % str(item).replace('\\', '\\\\').replace('"', '\\"')
+                             for item in value)
+  return str(value)
+
+
+def copy_rows(dbapi_connection, table, columns, rows):
+  # loads rows (dicts) into table with COPY ... FROM STDIN (psycopg2)
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  for row in rows:
+    writer.writerow([format_copy_value(row.get(column)) for column in columns])
+  buffer.seek(0)
+  cursor = dbapi_connection.cursor()
+  try:
+    cursor.copy_expert('COPY "%s" (%s) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')' % (
+      table, ', '.join(columns)), buffer)
+  finally:
+    cursor.close()
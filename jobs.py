@@ -0,0 +1,286 @@
+#----------------------------------------------------------------------------#
+# Background jobs. Write handlers queue their follow-up work (page cache
+# warming, counter maintenance, notifications, ...) as rows of the Job table
+# in their own transaction, so a job exists exactly when the write it
+# follows up on committed, and answer without waiting for it. A pool of
+# worker threads in each web process picks jobs up as soon as the
+# transaction commits; `flask run-jobs` runs the same loop as a separate
+# worker. Failed jobs are retried with exponential backoff, jobs whose worker
+# died are taken over once their lease runs out. The same workers run the
+# periodic maintenance registered with every(), off the request path,
+# including the removal of old finished jobs.
+#----------------------------------------------------------------------------#
+
+import logging
+import random
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+class JobQueue(object):
+
+  def __init__(self):
+    self.app = None
+    self.db = None
+    self.model = None
+    self.config = {}
+    self.logger = None
+    self.tasks = {}
+    self.periodic = []
+    self.next_runs = {}
+    self.threads = []
+    self.wakeup = threading.Event()
+    self.stopping = threading.Event()
+    self.in_process = True
+    self._lock = threading.Lock()
+    self.reset()
+
+  def init_app(self, app, db, model):
+    self.app = app
+    self.db = db
+    self.model = model
+    self.config = app.config
+    self.logger = app.logger
+    event.listen(db.session, 'after_commit', self.after_commit)
+    event.listen(db.session, 'after_soft_rollback', self.after_rollback)
+    # web processes start their workers with the first request
+    app.before_first_request(self.start)
+    self.every('JOBS_PRUNE_SECONDS')(self.prune)
+
+  def reset(self):
+    with self._lock:
+      self.completed = 0
+      self.retried = 0
+      self.failed = 0
+      self.run_ms_total = 0.0
+
+  def task(self, name):
+    # registers the decorated function as the handler of jobs named name,
+    # called with the job's payload as keyword arguments
+    def register(function):
+      self.tasks[name] = function
+      return function
+    return register
+
+  def every(self, setting):
+    # registers the decorated function to run every app.config[setting]
+    # seconds in each process running workers; it must not mind running
+    # in several processes at once
+    def register(function):
+      self.periodic.append((setting, function))
+      return function
+    return register
+
+  def run_periodic(self):
+    now = time.time()
+    with self._lock:
+      due = [function for setting, function in self.periodic
+             if self.next_runs.get(function, 0) <= now]
+      for setting, function in self.periodic:
+        if function in due:
+          self.next_runs[function] = now + self.config[setting]
+    for function in due:
+      with self.app.app_context():
+        try:
+          function()
+        except Exception:
+          self.logger.exception('periodic %s failed', function.__name__)
+        finally:
+          self.db.session.remove()
+
+  def enqueue(self, name, delay=0, **payload):
+    # adds the job to the current transaction; payloads must be JSON
+    if name not in self.tasks:
+      raise KeyError('no task %r' % name)
+    now = datetime.utcnow()
+    job = self.model(name=name, payload=payload, status='queued', attempts=0,
+                     run_at=now + timedelta(seconds=delay), created_at=now)
+    self.db.session.add(job)
+    self.db.session.info['jobs_queued'] = True
+    return job
+
+  def after_commit(self, session):
+    if session.info.pop('jobs_queued', False):
+      self.start()
+      self.wakeup.set()
+
+  def after_rollback(self, session, previous_transaction):
+    session.info.pop('jobs_queued', None)
+
+  def start(self):
+    # starts the in-process workers, once per process
+    if not self.in_process or self.threads or not self.config.get('JOBS_WORKERS'):
+      return
+    with self._lock:
+      if self.threads:
+        return
+      for number in range(self.config['JOBS_WORKERS']):
+        thread = threading.Thread(target=self.work, name='job-worker-%d' % number)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+  def work(self, once=False):
+    # runs jobs until stopped, or until the queue is empty with once
+    while not self.stopping.is_set():
+      self.run_periodic()
+      try:
+        ran = self.run_next()
+      except Exception:
+        # the database is away, try again later
+        self.logger.exception('job worker failed')
+        ran = False
+      if ran:
+        continue
+      if once:
+        return
+      self.wakeup.wait(self.config['JOBS_POLL_SECONDS'])
+      self.wakeup.clear()
+
+  def ready_condition(self, now):
+    Job = self.model
+    return self.db.or_(
+      self.db.and_(Job.status == 'queued', Job.run_at <= now),
+      self.db.and_(Job.status == 'running', Job.locked_until < now))
+
+  def claim(self):
+    # the id of the next job due, now running under this worker's lease;
+    # None when there is none, False when another worker took it first
+    Job = self.model
+    session = self.db.session
+    now = datetime.utcnow()
+    query = session.query(Job.id).filter(self.ready_condition(now)) \
+      .order_by(Job.run_at, Job.id).limit(1)
+    if self.db.engine.dialect.name == 'postgresql':
+      # workers skip each other's rows instead of queueing on the row lock
+      query = query.with_for_update(skip_locked=True)
+    row = query.first()
+    if row is None:
+      session.rollback()
+      return None
+    claimed = session.query(Job).filter(Job.id == row.id, self.ready_condition(now)).update({
+      Job.status: 'running',
+      Job.attempts: Job.attempts + 1,
+      Job.locked_until: now + timedelta(seconds=self.config['JOBS_LEASE_SECONDS'])
+    }, synchronize_session=False)
+    session.commit()
+    return row.id if claimed else False
+
+  def run_next(self):
+    # claims and runs one job; False when no job was due
+    with self.app.app_context():
+      try:
+        job_id = self.claim()
+        if job_id is None:
+          return False
+        if job_id is False:
+          return True
+        self.run(job_id)
+        return True
+      finally:
+        self.db.session.remove()
+
+  def run(self, job_id):
+    session = self.db.session
+    job = session.query(self.model).get(job_id)
+    name, payload, attempts = job.name, job.payload, job.attempts
+    start = time.perf_counter()
+    try:
+      task = self.tasks.get(name)
+      if task is None:
+        raise LookupError('no task %r' % name)
+      task(**payload)
+      # in the task's transaction, its writes and the job finish together
+      session.query(self.model).filter_by(id=job_id).update({
+        'status': 'done', 'locked_until': None, 'last_error': None,
+        'finished_at': datetime.utcnow()
+      }, synchronize_session=False)
+      session.commit()
+      error = None
+    except Exception:
+      session.rollback()
+      error = traceback.format_exc()
+    with self._lock:
+      self.run_ms_total += (time.perf_counter() - start) * 1000
+      if error is None:
+        self.completed += 1
+    if error is not None:
+      self.fail(job_id, name, attempts, error)
+
+  def get_backoff(self, attempts):
+    # seconds until the next attempt, doubling per attempt with jitter so
+    # that jobs failing together do not retry together
+    delay = min(self.config['JOBS_BACKOFF_SECONDS'] * 2 ** (attempts - 1),
+                self.config['JOBS_BACKOFF_MAX_SECONDS'])
+    return random.uniform(delay / 2.0, delay)
+
+  def fail(self, job_id, name, attempts, error):
+    values = {'locked_until': None, 'last_error': error[-4000:]}
+    if attempts >= self.config['JOBS_MAX_ATTEMPTS']:
+      values.update(status='failed', finished_at=datetime.utcnow())
+    else:
+      values.update(status='queued',
+                    run_at=datetime.utcnow() + timedelta(seconds=self.get_backoff(attempts)))
+    session = self.db.session
+    session.query(self.model).filter_by(id=job_id).update(values, synchronize_session=False)
+    session.commit()
+    with self._lock:
+      if values['status'] == 'failed':
+        self.failed += 1
+      else:
+        self.retried += 1
+    self.logger.log(logging.ERROR if values['status'] == 'failed' else logging.WARNING,
+                    'job %d (%s) failed on attempt %d:\n%s', job_id, name, attempts, error)
+
+  def prune(self, done_days=None, failed_days=None):
+    # deletes the jobs done more than JOBS_KEEP_DAYS and those failed more
+    # than JOBS_KEEP_FAILED_DAYS ago, returns how many
+    Job = self.model
+    now = datetime.utcnow()
+    done_days = self.config['JOBS_KEEP_DAYS'] if done_days is None else done_days
+    failed_days = self.config['JOBS_KEEP_FAILED_DAYS'] if failed_days is None else failed_days
+    pruned = self.db.session.query(Job).filter(self.db.or_(
+      self.db.and_(Job.status == 'done', Job.finished_at < now - timedelta(days=done_days)),
+      self.db.and_(Job.status == 'failed', Job.finished_at < now - timedelta(days=failed_days)))
+    ).delete(synchronize_session=False)
+    self.db.session.commit()
+    return pruned
+
+  def depth(self):
+    # {status: number of jobs} and the seconds the oldest due job has waited
+    Job = self.model
+    now = datetime.utcnow()
+    rows = self.db.session.query(
+      Job.status, func.count(Job.id),
+      func.min(self.db.case((Job.run_at <= now, Job.run_at)))
+    ).group_by(Job.status).all()
+    counts = dict((status, 0) for status in STATUSES)
+    oldest = None
+    for status, count, due_since in rows:
+      counts[status] = count
+      if status == 'queued' and due_since is not None:
+        oldest = due_since
+    return counts, (now - oldest).total_seconds() if oldest else 0.0
+
+  def stats(self):
+    counts, lag = self.depth()
+    with self._lock:
+      return {
+        "depth": counts,
+        "lag_seconds": round(lag, 3),
+        "workers": len(self.threads),
+        "completed": self.completed,
+        "retried": self.retried,
+        "failed": self.failed,
+        "run_ms_avg": round(self.run_ms_total / (self.completed + self.retried + self.failed), 3)
+                      if self.completed + self.retried + self.failed else 0.0,
+      }
+
+
+job_queue = JobQueue()
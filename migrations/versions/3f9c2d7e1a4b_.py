@@ -0,0 +1,35 @@
+"""add trigram search indexes
+
+Revision ID: 3f9c2d7e1a4b
+Revises: b48f94fe5c7c
+Create Date: 2026-10-18 10:12:04.118232
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2d7e1a4b'
+down_revision = 'b48f94fe5c7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('Venue', 'Artist'):
+        op.create_index('ix_%s_name_trgm' % table, table, ['name'], unique=False,
+                        postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'})
+        op.create_index('ix_%s_city_trgm' % table, table, ['city'], unique=False,
+                        postgresql_using='gin',
+                        postgresql_ops={'city': 'gin_trgm_ops'})
+        op.create_index('ix_%s_state' % table, table, ['state'], unique=False)
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_index('ix_%s_state' % table, table_name=table)
+        op.drop_index('ix_%s_city_trgm' % table, table_name=table)
+        op.drop_index('ix_%s_name_trgm' % table, table_name=table)
@@ -0,0 +1,31 @@
+"""add Show indexes for venue, artist and start_time lookups
+
+Revision ID: 8d41e6b2c9f0
+Revises: 3f9c2d7e1a4b
+Create Date: 2026-10-18 11:02:37.504118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41e6b2c9f0'
+down_revision = '3f9c2d7e1a4b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+    op.create_index('ix_Show_start_time_brin', 'Show', ['start_time'], unique=False,
+                    postgresql_using='brin')
+
+
+def downgrade():
+    op.drop_index('ix_Show_start_time_brin', table_name='Show')
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
@@ -0,0 +1,70 @@
+"""normalize genres and add GIN indexes for genre filters
+
+Revision ID: 9e2f7b4c1a06
+Revises: 5b2d9a7c3e81
+Create Date: 2026-10-18 15:02:37.640219
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2f7b4c1a06'
+down_revision = '5b2d9a7c3e81'
+branch_labels = None
+depends_on = None
+
+# the choices of the genres fields in forms.py
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk',
+          'Funk', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz',
+          'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll',
+          'Soul', 'Other']
+CANONICAL = dict((genre.lower(), genre) for genre in GENRES)
+
+GenreList = postgresql.ARRAY(sa.String()).with_variant(sa.JSON(), 'sqlite')
+
+
+def normalize_genres(value):
+    # the create/edit handlers stored request.form['genres'], a single
+    # string, which the ARRAY column split into characters ('Jazz' became
+    # {J,a,z,z}). Such lists are joined back, then every entry is split on
+    # ';' and ',', stripped, matched case-insensitively to the form choices
+    # and deduplicated.
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    elif value and all(len(item) <= 1 for item in value):
+        value = [''.join(value)]
+    genres = []
+    for item in value:
+        for genre in re.split('[;,]', item.strip('{}')):
+            genre = genre.strip().strip('"')
+            genre = CANONICAL.get(genre.lower(), genre)
+            if genre and genre not in genres:
+                genres.append(genre)
+    return genres
+
+
+def upgrade():
+    connection = op.get_bind()
+    for name in ('Venue', 'Artist'):
+        table = sa.table(name, sa.column('id', sa.Integer), sa.column('genres', GenreList))
+        rows = connection.execute(sa.select(table.c.id, table.c.genres)).fetchall()
+        for row_id, genres in rows:
+            normalized = normalize_genres(genres)
+            if normalized != genres:
+                connection.execute(table.update().where(table.c.id == row_id)
+                                   .values(genres=normalized))
+        op.create_index('ix_%s_genres' % name, name, ['genres'], unique=False,
+                        postgresql_using='gin')
+
+
+def downgrade():
+    # the normalized genres are kept
+    for name in ('Artist', 'Venue'):
+        op.drop_index('ix_%s_genres' % name, table_name=name)
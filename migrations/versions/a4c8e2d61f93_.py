@@ -0,0 +1,48 @@
+"""add venue coordinates, geohash index and PostGIS location index
+
+Revision ID: a4c8e2d61f93
+Revises: 9e2f7b4c1a06
+Create Date: 2026-10-18 15:48:10.227481
+
+Existing venues are placed afterwards with `flask geocode-venues`. The GiST
+index is only created where the PostGIS extension is available, set
+FYYUR_GEO_INDEX=postgis to use it.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c8e2d61f93'
+down_revision = '9e2f7b4c1a06'
+branch_labels = None
+depends_on = None
+
+
+def has_postgis():
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(sa.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'postgis'")).first() is not None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geohash', sa.BigInteger(), nullable=True))
+    op.create_index('ix_Venue_geohash', 'Venue', ['geohash'], unique=False)
+    if has_postgis():
+        op.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+        # must match venue_point() in app.py
+        op.execute('CREATE INDEX "ix_Venue_location_gist" ON "Venue" USING gist '
+                   '(geography(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)))')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS "ix_Venue_location_gist"')
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    op.drop_column('Venue', 'geohash')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
@@ -0,0 +1,61 @@
+"""add Show.end_time and exclusion constraints against double bookings
+
+Revision ID: b7d3f0a95c28
+Revises: a4c8e2d61f93
+Create Date: 2026-10-18 16:31:52.904316
+
+Existing shows get the default length of two hours (SHOW_DEFAULT_MINUTES).
+On postgres, venues and artists booked for overlapping shows have to be
+sorted out before the exclusion constraints can be added; the upgrade
+stops and lists the first of them.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3f0a95c28'
+down_revision = 'a4c8e2d61f93'
+branch_labels = None
+depends_on = None
+
+OVERLAPS = """
+SELECT a.id, b.id, '%(column)s', a.%(column)s
+FROM "Show" a JOIN "Show" b
+  ON a.%(column)s = b.%(column)s AND a.id < b.id
+ AND tsrange(a.start_time, a.end_time) && tsrange(b.start_time, b.end_time)
+LIMIT 10
+"""
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    op.execute('UPDATE "Show" SET end_time = start_time + interval \'120 minutes\'')
+    op.alter_column('Show', 'end_time', nullable=False)
+    # keep the interval in step with SHOW_MAX_HOURS
+    op.create_check_constraint(
+        'ck_Show_duration', 'Show',
+        "end_time > start_time AND end_time <= start_time + interval '24 hours'")
+
+    connection = op.get_bind()
+    overlaps = []
+    for column in ('venue_id', 'artist_id'):
+        overlaps += connection.execute(sa.text(OVERLAPS % {'column': column})).fetchall()
+    if overlaps:
+        raise RuntimeError('overlapping shows, move or delete them first:\n' + '\n'.join(
+            'shows %d and %d, %s %d' % tuple(row) for row in overlaps))
+
+    # the equality part of the constraints needs btree_gist
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    for column in ('venue_id', 'artist_id'):
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_%s_period" EXCLUDE USING gist '
+                   '(%s WITH =, tsrange(start_time, end_time) WITH &&)'
+                   % (column.split('_')[0], column))
+
+
+def downgrade():
+    op.drop_constraint('ex_Show_artist_period', 'Show')
+    op.drop_constraint('ex_Show_venue_period', 'Show')
+    op.drop_constraint('ck_Show_duration', 'Show', type_='check')
+    op.drop_column('Show', 'end_time')
@@ -0,0 +1,46 @@
+"""add upcoming/past show counters to Venue and Artist
+
+Revision ID: c7a3e05f4d12
+Revises: 8d41e6b2c9f0
+Create Date: 2026-10-18 11:48:12.730554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a3e05f4d12'
+down_revision = '8d41e6b2c9f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ShowCounterState',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_over_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    for table, owner in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill the counters as of now
+    op.execute('INSERT INTO "ShowCounterState" (id, rolled_over_at) VALUES (1, localtimestamp)')
+    for table, owner in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.execute(
+            'UPDATE "{table}" SET '
+            'upcoming_shows_count = (SELECT count(*) FROM "Show" '
+            'WHERE "Show".{owner} = "{table}".id AND "Show".start_time > localtimestamp), '
+            'past_shows_count = (SELECT count(*) FROM "Show" '
+            'WHERE "Show".{owner} = "{table}".id AND "Show".start_time <= localtimestamp)'
+            .format(table=table, owner=owner))
+
+
+def downgrade():
+    op.drop_column('Artist', 'past_shows_count')
+    op.drop_column('Artist', 'upcoming_shows_count')
+    op.drop_column('Venue', 'past_shows_count')
+    op.drop_column('Venue', 'upcoming_shows_count')
+    op.drop_table('ShowCounterState')
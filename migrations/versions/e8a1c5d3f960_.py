@@ -0,0 +1,33 @@
+"""add IdempotencyKey table for the write API
+
+Revision ID: e8a1c5d3f960
+Revises: d2f6b8e4a17c
+Create Date: 2026-10-18 18:05:13.640287
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a1c5d3f960'
+down_revision = 'd2f6b8e4a17c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('IdempotencyKey',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('request_hash', sa.String(length=64), nullable=False),
+    sa.Column('status_code', sa.Integer(), nullable=False),
+    sa.Column('response', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_IdempotencyKey_created_at', 'IdempotencyKey', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_IdempotencyKey_created_at', table_name='IdempotencyKey')
+    op.drop_table('IdempotencyKey')
@@ -0,0 +1,220 @@
+#----------------------------------------------------------------------------#
+# Per-request SQL profiler.
+#----------------------------------------------------------------------------#
+
+import heapq
+import threading
+import time
+
+from flask import g, has_app_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryProfiler(object):
+  # Counts the queries and database time of every request, keeps per
+  # endpoint totals with the slowest statements, adds a Server-Timing
+  # header to the response and logs requests above the PROFILER_* limits.
+
+  def __init__(self):
+    self.logger = None
+    self.config = {}
+    self._endpoints = {}
+    self._lock = threading.Lock()
+
+  def init_app(self, app):
+    self.logger = app.logger
+    self.config = app.config
+    event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+    event.listen(Engine, 'handle_error', self.handle_error)
+    app.before_request(self.start_request)
+    app.after_request(self.finish_request)
+
+  # SQLAlchemy hooks
+
+  def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append((time.perf_counter(), statement))
+
+  def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info['query_start_time'].pop()[0]) * 1000
+    profile = g.get('query_profile') if has_app_context() else None
+    if profile is None:
+      return
+    profile['queries'] += 1
+    profile['db_ms'] += elapsed_ms
+    profile['statements'].append((elapsed_ms, statement))
+
+  def handle_error(self, context):
+    # a failed statement never reaches after_cursor_execute, drop its start
+    # time so the next statement on the connection is not timed from it.
+    # Statements that failed before they started have none to drop.
+    if context.connection is None:
+      return
+    start_times = context.connection.info.get('query_start_time')
+    if start_times and start_times[-1][1] == context.statement:
+      start_times.pop()
+
+  # Flask hooks
+
+  def start_request(self):
+    g.query_profile = {
+      'start': time.perf_counter(),
+      'queries': 0,
+      'db_ms': 0.0,
+      'statements': [],
+    }
+
+  def finish_request(self, response):
+    profile = g.pop('query_profile', None)
+    if profile is None:
+      return response
+    total_ms = (time.perf_counter() - profile['start']) * 1000
+    endpoint = request.endpoint or 'unknown'
+    self.record(endpoint, profile, total_ms)
+
+    if self.config['PROFILER_SERVER_TIMING']:
+      response.headers.add('Server-Timing', 'db;dur=%.1f;desc="%d queries"' % (
+        profile['db_ms'], profile['queries']))
+      response.headers.add('Server-Timing', 'app;dur=%.1f' % total_ms)
+
+    if total_ms >= self.config['PROFILER_SLOW_REQUEST_MS'] or \
+       profile['queries'] >= self.config['PROFILER_MAX_QUERIES']:
+      slowest = max(profile['statements'], default=(0.0, ''))
+      self.logger.warning('slow request %s %s: %.1f ms, %d queries, %.1f ms in db, slowest query %.1f ms: %s',
+                          request.method, request.path, total_ms, profile['queries'],
+                          profile['db_ms'], slowest[0], slowest[1][:500])
+    return response
+
+  # Statistics
+
+  def record(self, endpoint, profile, total_ms):
+    top = self.config['PROFILER_TOP_STATEMENTS']
+    with self._lock:
+      stats = self._endpoints.setdefault(endpoint, {
+        'requests': 0,
+        'queries': 0,
+        'max_queries': 0,
+        'db_ms': 0.0,
+        'total_ms': 0.0,
+        'slowest': [],
+      })
+      stats['requests'] += 1
+      stats['queries'] += profile['queries']
+      stats['max_queries'] = max(stats['max_queries'], profile['queries'])
+      stats['db_ms'] += profile['db_ms']
+      stats['total_ms'] += total_ms
+      # min-heap of the slowest statements seen for this endpoint
+      for elapsed_ms, statement in profile['statements']:
+        entry = (elapsed_ms, statement[:500])
+        if len(stats['slowest']) < top:
+          heapq.heappush(stats['slowest'], entry)
+        elif entry > stats['slowest'][0]:
+          heapq.heapreplace(stats['slowest'], entry)
+
+  def stats(self):
+    with self._lock:
+      return {endpoint: {
+        'requests': stats['requests'],
+        'queries_per_request': round(stats['queries'] / stats['requests'], 2),
+        'max_queries': stats['max_queries'],
+        'db_ms_per_request': round(stats['db_ms'] / stats['requests'], 3),
+        'ms_per_request': round(stats['total_ms'] / stats['requests'], 3),
+        'slowest': [{'ms': round(elapsed_ms, 3), 'statement': statement}
+                    for elapsed_ms, statement in sorted(stats['slowest'], reverse=True)],
+      } for endpoint, stats in self._endpoints.items()}
+
+  def reset(self):
+    with self._lock:
+      self._endpoints.clear()
+
+
+query_profiler = QueryProfiler()
+
+
+#----------------------------------------------------------------------------#
+# Template block profiler.
+#----------------------------------------------------------------------------#
+
+class ProfiledTemplate(Template):
+  # Template whose root render function and blocks report their render time
+  # to template_profiler. Times are inclusive: a block's time contains the
+  # blocks rendered inside it, the root time of a template the whole page.
+
+  @classmethod
+  def _from_namespace(cls, environment, namespace, globals):
+    template = super(ProfiledTemplate, cls)._from_namespace(environment, namespace, globals)
+    template.root_render_func = timed_render(template.name, '(root)', template.root_render_func)
+    template.blocks = {name: timed_render(template.name, name, render)
+                       for name, render in template.blocks.items()}
+    return template
+
+
+def timed_render(template_name, block_name, render):
+  def render_timed(context):
+    start = time.perf_counter()
+    for chunk in render(context):
+      yield chunk
+    template_profiler.record_block(template_name, block_name,
+                                   (time.perf_counter() - start) * 1000)
+  return render_timed
+
+
+class TemplateProfiler(object):
+  # Collects the render time of every template block per request, adds them
+  # to the Server-Timing header and keeps per endpoint averages.
+
+  def __init__(self):
+    self.config = {}
+    self._endpoints = {}
+    self._lock = threading.Lock()
+
+  def init_app(self, app):
+    self.config = app.config
+    if not app.config['PROFILER_TEMPLATES']:
+      return
+    app.jinja_env.template_class = ProfiledTemplate
+    app.after_request(self.finish_request)
+
+  def record_block(self, template_name, block_name, elapsed_ms):
+    profile = g.setdefault('template_profile', {}) if has_app_context() else None
+    if profile is None:
+      return
+    key = '%s:%s' % (template_name, block_name)
+    renders, total_ms = profile.get(key, (0, 0.0))
+    profile[key] = (renders + 1, total_ms + elapsed_ms)
+
+  def finish_request(self, response):
+    profile = g.pop('template_profile', None)
+    if not profile:
+      return response
+    if self.config['PROFILER_SERVER_TIMING']:
+      for index, (key, (renders, total_ms)) in enumerate(sorted(profile.items())):
+        response.headers.add('Server-Timing', 'tpl%d;dur=%.1f;desc="%s"' % (index, total_ms, key))
+
+    endpoint = request.endpoint or 'unknown'
+    with self._lock:
+      blocks = self._endpoints.setdefault(endpoint, {})
+      for key, (renders, total_ms) in profile.items():
+        stats = blocks.setdefault(key, [0, 0, 0.0])
+        stats[0] += 1
+        stats[1] += renders
+        stats[2] += total_ms
+    return response
+
+  def stats(self):
+    with self._lock:
+      return {endpoint: {key: {
+        'requests': requests,
+        'renders': renders,
+        'ms_per_request': round(total_ms / requests, 3),
+      } for key, (requests, renders, total_ms) in blocks.items()}
+        for endpoint, blocks in self._endpoints.items()}
+
+  def reset(self):
+    with self._lock:
+      self._endpoints.clear()
+
+
+template_profiler = TemplateProfiler()
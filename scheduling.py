@@ -0,0 +1,65 @@
+#----------------------------------------------------------------------------#
+# Booking overlaps. A venue and an artist can only be in one show at a time.
+# No show lasts longer than a fixed maximum, so the shows that can overlap
+# [start, end) all start in [start - max duration, end): one range over
+# start times, in the database on the (venue_id|artist_id, start_time)
+# indexes (see calendar_query in app.py) and here in memory with bisect.
+#----------------------------------------------------------------------------#
+
+import bisect
+
+
+class IntervalIndex(object):
+  # [start, end) intervals with a payload, kept sorted by start
+
+  def __init__(self, max_duration):
+    self.max_duration = max_duration
+    self.starts = []
+    self.intervals = []
+
+  def __len__(self):
+    return len(self.starts)
+
+  def add(self, start, end, item):
+    position = bisect.bisect_right(self.starts, start)
+    self.starts.insert(position, start)
+    self.intervals.insert(position, (start, end, item))
+
+  def overlapping(self, start, end):
+    low = bisect.bisect_left(self.starts, start - self.max_duration)
+    high = bisect.bisect_left(self.starts, end)
+    return [item for item_start, item_end, item in self.intervals[low:high]
+            if item_end > start]
+
+
+class Bookings(object):
+  # the shows of each venue and each artist
+
+  def __init__(self, max_duration):
+    self.max_duration = max_duration
+    self.indexes = {}
+
+  def add(self, show):
+    for key in (('venue', show['venue_id']), ('artist', show['artist_id'])):
+      index = self.indexes.get(key)
+      if index is None:
+        index = self.indexes[key] = IntervalIndex(self.max_duration)
+      index.add(show['start_time'], show['end_time'], show)
+
+  def conflicts(self, show):
+    # [(kind, booked show)] overlapping show at its venue or with its artist
+    found = []
+    for kind in ('venue', 'artist'):
+      index = self.indexes.get((kind, show[kind + '_id']))
+      if index is None:
+        continue
+      for booked in index.overlapping(show['start_time'], show['end_time']):
+        if show.get('id') is None or booked.get('id') != show['id']:
+          found.append((kind, booked))
+    return found
+
+
+def describe_conflict(kind, booked):
+  return '%s %d is booked from %s to %s' % (
+    kind, booked[kind + '_id'], booked['start_time'].strftime('%Y-%m-%d %H:%M'),
+    booked['end_time'].strftime('%Y-%m-%d %H:%M'))
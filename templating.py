@@ -0,0 +1,85 @@
+#----------------------------------------------------------------------------#
+# Jinja setup: on-disk bytecode cache and the {% cache %} fragment tag.
+#----------------------------------------------------------------------------#
+
+import os
+import tempfile
+import time
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+# seconds a fragment is kept when the tag gives no ttl
+DEFAULT_FRAGMENT_TTL = 300
+
+
+class AtomicBytecodeCache(FileSystemBytecodeCache):
+  # FileSystemBytecodeCache shared by all workers. Files are written to a
+  # temporary name and renamed, so a worker starting up never loads a
+  # half-written file from another one.
+
+  def dump_bytecode(self, bucket):
+    path = self._get_cache_filename(bucket)
+    fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        bucket.write_bytecode(f)
+      os.replace(tmp, path)
+    except OSError:
+      try:
+        os.remove(tmp)
+      except OSError:
+        pass
+
+
+class FragmentCacheExtension(Extension):
+  # {% cache key, ttl %}...{% endcache %} renders the body once and reuses
+  # the HTML for ttl seconds. Fragments live in environment.fragment_cache
+  # (a cache.CacheBackend of their own, see FRAGMENT_CACHE_SIZE) under
+  # 'fragment:<key>'; the backend's own ttl caps the fragment ttl. Every
+  # fragment costs a lookup and an entry, so the tag is for large blocks
+  # that are expensive to render, not for the tiles of a list. Fragments
+  # rendered by another fragment_cache_version are ignored.
+
+  tags = {'cache'}
+
+  def __init__(self, environment):
+    super(FragmentCacheExtension, self).__init__(environment)
+    environment.extend(fragment_cache=None, fragment_cache_version=None)
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    args = [parser.parse_expression()]
+    if parser.stream.skip_if('comma'):
+      args.append(parser.parse_expression())
+    else:
+      args.append(nodes.Const(None))
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    return nodes.CallBlock(self.call_method('_render_fragment', args),
+                           [], [], body).set_lineno(lineno)
+
+  def _render_fragment(self, key, ttl, caller):
+    backend = self.environment.fragment_cache
+    if backend is None:
+      return caller()
+    key = 'fragment:%s' % key
+    version = self.environment.fragment_cache_version
+    entry = backend.get(key)
+    if entry is not None and entry[0] > time.time() and entry[1] == version:
+      return Markup(entry[2])
+    html = caller()
+    backend.set(key, (time.time() + (ttl or DEFAULT_FRAGMENT_TTL), version, str(html)))
+    return html
+
+
+def init_templating(app, fragment_cache=None, version=None):
+  # JINJA_BYTECODE_CACHE_DIR keeps compiled templates across restarts, so
+  # cold workers skip the compile step
+  directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = AtomicBytecodeCache(directory)
+  app.jinja_env.add_extension(FragmentCacheExtension)
+  app.jinja_env.fragment_cache = fragment_cache
+  app.jinja_env.fragment_cache_version = version
@@ -0,0 +1,30 @@
+#----------------------------------------------------------------------------#
+# Shared fixtures: the app on a throwaway sqlite file (or on the database in
+# FYYUR_BENCH_DATABASE_URI), emptied for every test.
+#----------------------------------------------------------------------------#
+
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault('FYYUR_BENCH_DATABASE_URI',
+                      'sqlite:///' + os.path.join(tempfile.gettempdir(), 'fyyur_test.db'))
+
+from app import app, db, page_cache
+from benchmarks.common import setup_database
+
+
+@pytest.fixture
+def database():
+  app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, JOBS_WORKERS=0)
+  ctx = setup_database()
+  page_cache.backend.clear()
+  yield db
+  db.session.remove()
+  ctx.pop()
+
+
+@pytest.fixture
+def client(database):
+  return app.test_client()
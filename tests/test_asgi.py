@@ -0,0 +1,74 @@
+#----------------------------------------------------------------------------#
+# The async read path of asgi.py against the Flask app it falls back to.
+#----------------------------------------------------------------------------#
+
+import asyncio
+from http.cookies import SimpleCookie
+
+import pytest
+
+from app import app
+from benchmarks.common import seed
+
+pytest.importorskip('aiosqlite')
+
+FLASH = 'Venue Flash Check was successfully listed!'
+
+
+def call(application, method, path, cookie=None, body=b''):
+  # (status, headers, body) of one request through the ASGI app
+  headers = [(b'host', b'localhost')]
+  if cookie:
+    headers.append((b'cookie', cookie.encode('latin-1')))
+  if body:
+    headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+  scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'path': path,
+           'query_string': b'',
+           'headers': headers, 'server': ('localhost', 80)}
+  messages = []
+
+  async def receive():
+    return {'type': 'http.request', 'body': body, 'more_body': False}
+
+  async def send(message):
+    messages.append(message)
+
+  asyncio.run(application(scope, receive, send))
+  start = messages[0]
+  return (start['status'],
+          [(name.decode('latin-1'), value.decode('latin-1')) for name, value in start['headers']],
+          b''.join(message.get('body', b'') for message in messages[1:]).decode('utf-8'))
+
+
+def get_session_cookie(headers):
+  cookies = SimpleCookie()
+  for name, value in headers:
+    if name == 'set-cookie':
+      cookies.load(value)
+  name = app.session_cookie_name
+  return '%s=%s' % (name, cookies[name].value) if name in cookies else None
+
+
+@pytest.mark.parametrize('method, path, body', [
+  ('GET', '/venues', b''),
+  ('POST', '/venues/search', b'search_term=venue'),
+])
+def test_pending_flash_is_shown_once(client, method, path, body):
+  from asgi import AsyncReadApp, create_engine_for
+  seed(venues=3, artists=3, shows=5)
+  application = AsyncReadApp(app, create_engine_for(app.config))
+  with client.session_transaction() as flask_session:
+    flask_session['_flashes'] = [('message', FLASH)]
+  cookie = next('%s=%s' % (c.name, c.value) for c in client.cookie_jar
+                if c.name == app.session_cookie_name)
+
+  status, headers, html = call(application, method, path, cookie, body)
+  assert status == 200
+  assert html.count(FLASH) == 1
+  # the session without the flash is sent back
+  cookie = get_session_cookie(headers)
+  assert cookie is not None
+
+  status, headers, html = call(application, 'GET', '/venues', cookie)
+  assert status == 200
+  assert FLASH not in html
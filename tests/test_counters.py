@@ -0,0 +1,85 @@
+#----------------------------------------------------------------------------#
+# The Venue/Artist upcoming/past show counters stay equal to the counts from
+# the Show table through every way of writing shows.
+#----------------------------------------------------------------------------#
+
+import io
+from datetime import datetime, timedelta
+
+from app import (app, db, check_show_counters, get_show_end_time, import_entities,
+                 roll_over_show_counters, Artist, Show, Venue)
+from benchmarks.common import seed
+
+
+def counters(model, owner_id):
+  owner = db.session.query(model).get(owner_id)
+  db.session.refresh(owner)
+  return owner.upcoming_shows_count, owner.past_shows_count
+
+
+def add_show(venue_id, artist_id, start_time):
+  show = Show(venue_id=venue_id, artist_id=artist_id, start_time=start_time,
+              end_time=get_show_end_time(start_time))
+  db.session.add(show)
+  db.session.commit()
+  return show
+
+
+def test_seeded_counters_are_consistent(database):
+  seed(venues=30, artists=30, shows=300)
+  assert check_show_counters() == []
+
+
+def test_orm_writes_keep_counters(database):
+  seed(venues=3, artists=3)
+  later = datetime.now() + timedelta(days=30)
+  show = add_show(1, 1, later)
+  assert counters(Venue, 1) == (1, 0)
+  assert counters(Artist, 1) == (1, 0)
+
+  # moved to another venue and into the past
+  show.venue_id = 2
+  show.start_time = datetime.now() - timedelta(days=30)
+  show.end_time = get_show_end_time(show.start_time)
+  db.session.commit()
+  assert counters(Venue, 1) == (0, 0)
+  assert counters(Venue, 2) == (0, 1)
+  assert counters(Artist, 1) == (0, 1)
+
+  db.session.delete(show)
+  db.session.commit()
+  assert counters(Venue, 2) == (0, 0)
+  assert counters(Artist, 1) == (0, 0)
+  assert check_show_counters() == []
+
+
+def test_roll_over_moves_started_shows(database):
+  seed(venues=2, artists=2)
+  start = datetime.now() + timedelta(hours=1)
+  add_show(1, 1, start)
+  add_show(2, 2, start + timedelta(days=2))
+  assert roll_over_show_counters(start + timedelta(minutes=1)) == 1
+  assert counters(Venue, 1) == (0, 1)
+  assert counters(Venue, 2) == (1, 0)
+  assert check_show_counters() == []
+
+
+def test_import_and_batch_api_keep_counters(client):
+  seed(venues=10, artists=10)
+  start = datetime.now() + timedelta(days=1)
+  rows = '\n'.join('%d,%d,%s' % (day % 10 + 1, day % 10 + 1,
+                                (start + timedelta(days=day)).strftime('%Y-%m-%d %H:%M:%S'))
+                   for day in range(20))
+  result = import_entities('shows', io.BytesIO(('venue_id,artist_id,start_time\n' + rows).encode()),
+                           'csv')
+  assert result['imported'] == 20
+  assert check_show_counters() == []
+
+  shows = [{'venue_id': day % 10 + 1, 'artist_id': (day + 3) % 10 + 1,
+            'start_time': (start - timedelta(days=day + 2)).isoformat()} for day in range(15)]
+  response = client.post('/api/v1/shows', json={'shows': shows})
+  assert response.status_code == 201
+  assert response.json['created'] == 15
+  db.session.remove()
+  assert check_show_counters() == []
+  assert sum(counters(Venue, venue_id)[1] for venue_id in range(1, 11)) == 15
@@ -0,0 +1,43 @@
+#----------------------------------------------------------------------------#
+# Background job bookkeeping: what write handlers queue and what is pruned.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime, timedelta
+
+from app import Job, page_cache
+from benchmarks.common import seed
+from jobs import job_queue
+
+
+def add_job(database, status, finished_days_ago):
+  finished_at = datetime.utcnow() - timedelta(days=finished_days_ago)
+  database.session.add(Job(name='warm_pages', payload={'paths': []}, status=status,
+                           attempts=1, run_at=finished_at, created_at=finished_at,
+                           finished_at=finished_at if status != 'queued' else None))
+
+
+def test_prune_keeps_recent_and_unfinished_jobs(database):
+  database.session.query(Job).delete()
+  add_job(database, 'done', 1)
+  add_job(database, 'done', 10)
+  add_job(database, 'failed', 10)
+  add_job(database, 'failed', 40)
+  add_job(database, 'queued', 40)
+  database.session.commit()
+  assert job_queue.prune(done_days=7, failed_days=30) == 2
+  assert sorted((job.status, job.finished_at is None) for job in Job.query) == [
+    ('done', False), ('failed', False), ('queued', True)]
+
+
+def test_pages_are_warmed_only_with_a_shared_cache(client, monkeypatch):
+  seed(venues=1, artists=1, shows=0)
+  database = client.application.extensions['sqlalchemy'].db
+  database.session.query(Job).delete()
+  database.session.commit()
+
+  client.delete('/venues/1')
+  assert Job.query.count() == 0
+
+  monkeypatch.setattr(page_cache.backend, 'shared', True)
+  client.delete('/artists/1')
+  assert [job.name for job in Job.query] == ['warm_pages']
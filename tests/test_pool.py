@@ -0,0 +1,60 @@
+#----------------------------------------------------------------------------#
+# Pool metrics under concurrent checkouts.
+#----------------------------------------------------------------------------#
+
+import os
+import tempfile
+import threading
+
+import pytest
+from sqlalchemy import create_engine, exc
+
+from db_pool import InstrumentedQueuePool, pool_metrics
+
+
+@pytest.fixture
+def engine():
+  path = os.path.join(tempfile.gettempdir(), 'fyyur_pool_test.db')
+  engine = create_engine('sqlite:///' + path, poolclass=InstrumentedQueuePool,
+                         pool_size=2, max_overflow=3, pool_timeout=0.2,
+                         connect_args={'check_same_thread': False})
+  pool_metrics.watch(engine, 'test')
+  yield engine
+  engine.dispose()
+
+
+def test_concurrent_checkouts_count_each_overflow_once(engine):
+  held = threading.Semaphore(0)
+  release = threading.Event()
+
+  def hold():
+    connection = engine.connect()
+    held.release()
+    release.wait()
+    connection.close()
+
+  threads = [threading.Thread(target=hold) for _ in range(5)]
+  for thread in threads:
+    thread.start()
+  try:
+    for thread in threads:
+      assert held.acquire(timeout=5)
+    stats = pool_metrics.stats()['test']
+    assert stats['checked_out'] == 5
+    assert stats['open'] == 5
+    assert stats['overflows'] == 3
+
+    # the pool is exhausted, the next checkout times out
+    with pytest.raises(exc.TimeoutError):
+      engine.connect()
+  finally:
+    release.set()
+    for thread in threads:
+      thread.join()
+
+  stats = pool_metrics.stats()['test']
+  assert stats['timeouts'] == 1
+  assert stats['checkouts'] == stats['checkins'] == 5
+  # the overflow connections were closed on return
+  assert stats['open'] == 2
+  assert stats['overflow'] == 0
@@ -0,0 +1,21 @@
+#----------------------------------------------------------------------------#
+# The query profiler's bookkeeping on the connection.
+#----------------------------------------------------------------------------#
+
+import pytest
+from sqlalchemy import exc, text
+
+
+def test_failed_statement_drops_its_start_time(database):
+  with database.engine.connect() as connection:
+    with pytest.raises(exc.OperationalError):
+      connection.execute(text('SELECT * FROM no_such_table'))
+    assert connection.info.get('query_start_time') == []
+    connection.execute(text('SELECT 1'))
+    assert connection.info['query_start_time'] == []
+
+
+def test_server_timing_is_off_by_default(client):
+  response = client.get('/artists')
+  assert response.status_code == 200
+  assert 'Server-Timing' not in response.headers
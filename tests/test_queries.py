@@ -0,0 +1,77 @@
+#----------------------------------------------------------------------------#
+# Query counts of the read paths, which must not grow with the data.
+#----------------------------------------------------------------------------#
+
+import pytest
+
+from app import (get_artist_list, get_artist_page, get_shows_page, get_venue_page,
+                 page_cache, search_entities, venue_areas_data, venue_areas_query, Venue)
+from benchmarks.common import count_queries, seed
+
+
+def run(database, load):
+  # (result of load, number of statements it ran)
+  database.session.expunge_all()
+  with count_queries() as counter:
+    result = load()
+  return result, counter['queries']
+
+
+@pytest.mark.parametrize('shows', [10, 300])
+def test_detail_pages_run_two_queries(database, shows):
+  seed(venues=1, artists=1, shows=shows)
+  for load in (get_venue_page, get_artist_page):
+    page, queries = run(database, lambda: load(1))
+    assert queries == 2
+    assert page['past_shows_count'] + page['upcoming_shows_count'] == shows
+
+
+@pytest.mark.parametrize('venues', [20, 400])
+def test_venue_areas_run_one_query(database, venues):
+  seed(venues=venues, artists=10, shows=venues * 2)
+  areas, queries = run(database, lambda: venue_areas_data(venue_areas_query().all()))
+  assert queries == 1
+  assert sum(len(area['venues']) for area in areas) == venues
+
+
+def test_list_pages_run_one_query(database):
+  seed(venues=50, artists=50, shows=500)
+  (shows, next_cursor), queries = run(database, lambda: get_shows_page())
+  assert queries == 1
+  assert next_cursor is not None
+  (more, _), queries = run(database, lambda: get_shows_page(after=next_cursor))
+  assert queries == 1
+  assert not set(show['id'] for show in shows) & set(show['id'] for show in more)
+  artists, queries = run(database, get_artist_list)
+  assert queries == 1
+  assert len(artists) == 50
+
+
+def test_search_runs_two_queries(database):
+  seed(venues=100, artists=10, shows=100)
+  result, queries = run(database, lambda: search_entities(Venue, 'venue 1', per_page=5))
+  # the page and the total count
+  assert queries <= 3
+  assert result['count'] == Venue.query.filter(Venue.name.ilike('%venue 1%')).count()
+  assert len(result['data']) == 5
+
+
+def test_unchanged_page_is_answered_with_304(client):
+  seed(venues=20, artists=20, shows=50)
+  response = client.get('/artists')
+  assert response.status_code == 200
+  etag = response.headers['ETag']
+  with count_queries() as counter:
+    response = client.get('/artists', headers={'If-None-Match': etag})
+  assert response.status_code == 304
+  # only the table watermarks
+  assert counter['queries'] == 1
+
+
+@pytest.mark.parametrize('path, moves', [
+  ('/artists', False), ('/venues/1', False), ('/shows', False), ('/shows?when=upcoming', True)])
+def test_only_pages_filtering_on_now_change_etag_with_time(client, monkeypatch, path, moves):
+  seed(venues=1, artists=1, shows=5)
+  etag = client.get(path).headers['ETag']
+  monkeypatch.setattr(page_cache, 'now_bucket', lambda: 0)
+  assert (client.get(path).headers['ETag'] != etag) == moves
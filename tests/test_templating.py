@@ -0,0 +1,52 @@
+#----------------------------------------------------------------------------#
+# The {% cache %} fragment tag and its store.
+#----------------------------------------------------------------------------#
+
+import pytest
+
+import templating
+from app import app, fragment_cache, page_cache
+
+TEMPLATE = "{% cache 'tag-check', 60 %}<p>{{ render() }}</p>{% endcache %}"
+
+
+@pytest.fixture
+def fragments():
+  fragment_cache.clear()
+  renders = []
+
+  def render():
+    renders.append(1)
+    return len(renders)
+
+  template = app.jinja_env.from_string(TEMPLATE)
+  yield lambda: template.render(render=render)
+  fragment_cache.clear()
+
+
+def test_second_render_reuses_the_fragment(fragments):
+  assert fragments() == '<p>1</p>'
+  assert fragments() == '<p>1</p>'
+  assert fragment_cache.stats()['hits'] >= 1
+
+
+def test_fragment_expires_after_its_ttl(fragments, monkeypatch):
+  now = templating.time.time()
+  assert fragments() == '<p>1</p>'
+  monkeypatch.setattr(templating.time, 'time', lambda: now + 61)
+  assert fragments() == '<p>2</p>'
+
+
+def test_fragment_of_another_build_is_rendered_again(fragments, monkeypatch):
+  assert fragments() == '<p>1</p>'
+  monkeypatch.setattr(app.jinja_env, 'fragment_cache_version', 'next-deploy')
+  assert fragments() == '<p>2</p>'
+
+
+def test_fragments_cannot_evict_pages(database):
+  page_cache.set('venues', {'context': {}, 'html': '<p>page</p>', 'versions': [0]})
+  for number in range(app.config['FRAGMENT_CACHE_SIZE'] * 2):
+    app.jinja_env.from_string("{% cache 'fill-%d' % n %}x{% endcache %}").render(n=number)
+  assert fragment_cache.stats()['evictions'] > 0
+  assert page_cache.get('venues')['html'] == '<p>page</p>'
+  fragment_cache.clear()